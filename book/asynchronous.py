@@ -0,0 +1,105 @@
+'''
+Async read path of the catalog and comment views.
+
+Under ASGI with ASYNC_READ_VIEWS on, GET requests of views with
+AsyncReadMixin run on the event loop. The token, the validators, the cached
+response and the page are read with the async cache and ORM APIs, so a
+worker process keeps serving other requests while one waits on the
+database instead of holding a thread per request. Other methods keep the
+sync path, run in a thread.
+
+It's off by default, measure it with `manage.py load_test_reads` against
+the production database before turning it on. Under WSGI, or with it off,
+the views are the same sync views as before.
+'''
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.utils.functional import classproperty
+
+from rest_framework import exceptions
+
+
+class AsyncReadMixin:
+    '''
+        Mixin that serves GET requests asynchronously when ASYNC_READ_VIEWS is on.
+
+        Mixins before it in the bases provide async twins of their get(),
+        e.g. ConditionalMixin.aget(), and the view reads its response in
+        aread(), which by default is the page of a list view.
+    '''
+
+    @classproperty
+    def view_is_async(cls):
+        return settings.ASYNC_READ_VIEWS
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.view_is_async:
+            return super().dispatch(request, *args, **kwargs)
+
+        return self.adispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        '''APIView.dispatch() of GET requests, with authentication and the handler awaited'''
+
+        if request.method not in ('GET', 'HEAD'):
+            return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # once the user is set, initial() runs its checks without touching the database
+            await self.aperform_authentication(request)
+            self.initial(request, *args, **kwargs)
+
+            response = await self.aget(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aperform_authentication(self, request):
+        '''Request._authenticate() with authenticators' aauthenticate(), or their authenticate() in a thread'''
+
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+
+        request._not_authenticated()
+
+    async def aget(self, request, *args, **kwargs):
+        return await self.aread(request, *args, **kwargs)
+
+    async def aread(self, request, *args, **kwargs):
+        '''Function to get the response of a list view, reading its page with the async ORM'''
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await self.paginator.apaginate_queryset(self.page_queryset(queryset), request, view=self)
+
+        return self.paged_response(page)
+
+    def page_queryset(self, queryset):
+        '''Function to get the queryset a list view reads its page from'''
+
+        return queryset
+
+    def paged_response(self, page):
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
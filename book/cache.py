@@ -0,0 +1,199 @@
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+from booktopia import compression
+from booktopia.media import current_expiry
+
+# version scope shared by every catalog page
+CATALOG = 'catalog'
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def book_scope(pk):
+    return f'book:{pk}'
+
+
+def version_key(scope):
+    return f'booktopia:version:{scope}'
+
+
+def get_versions(scopes):
+    '''
+        Function to get the current version token of each scope.
+
+        Tokens are random rather than counters, so a version key that was
+        evicted can never come back with a value an old entry was stored under.
+    '''
+
+    cache = get_cache()
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid4().hex, None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(scopes):
+    '''get_versions() for async views'''
+
+    cache = get_cache()
+    keys = [version_key(scope) for scope in scopes]
+    versions = await cache.aget_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, uuid4().hex, None)
+            versions[key] = await cache.aget(key)
+
+    return [versions[key] for key in keys]
+
+
+def invalidate(scopes):
+    '''Function to give scopes new versions, so every response cached under the old ones is skipped'''
+
+    get_cache().set_many({version_key(scope): uuid4().hex for scope in scopes}, None)
+
+
+def invalidate_books(pks):
+    '''Function to invalidate the catalog and the detail responses of books'''
+
+    scopes = [CATALOG] + [book_scope(pk) for pk in pks]
+    invalidate(scopes)
+
+    # a response cached by another request before this transaction commits still holds the old rows
+    transaction.on_commit(lambda: invalidate(scopes))
+
+
+def response_key(request, scopes):
+    '''Function to build the cache key of a GET request under the current versions of its scopes'''
+
+    return _response_key(request, get_versions(scopes))
+
+
+async def aresponse_key(request, scopes):
+    return _response_key(request, await aget_versions(scopes))
+
+
+def _response_key(request, versions):
+    parts = [
+        # payloads link to media by absolute URL
+        request.build_absolute_uri(request.path),
+        '&'.join(f'{name}={value}' for name, value in sorted(request.query_params.lists())),
+        request.accepted_media_type,
+        # anonymous users get payloads without book files
+        str(request.user.is_authenticated),
+        # cached payloads hold signed media URLs, keep them no older than the URLs
+        str(current_expiry()),
+        *versions,
+    ]
+    return 'booktopia:response:' + md5('|'.join(parts).encode()).hexdigest()
+
+
+class CachedResponseMixin:
+    '''
+        Mixin for read views whose GET response is the same for every user
+        allowed to see it.
+
+        Responses are looked up after authentication, permission checks and
+        content negotiation, and stored once rendered. Browsable API pages are
+        never cached, they show the user they're rendered for and a CSRF token.
+    '''
+
+    def get_cache_scopes(self):
+        raise NotImplementedError('get_cache_scopes() must return the version scopes of the response.')
+
+    def is_cacheable(self, request):
+        return request.accepted_renderer.format != 'api'
+
+    def get(self, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return super().get(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = response_key(request, self.get_cache_scopes())
+        entry = cache.get(key)
+
+        if entry is not None:
+            return self.cached_response(cache, key, entry)
+
+        return self.store_rendered(super().get(request, *args, **kwargs), cache, key)
+
+    async def aget(self, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return await super().aget(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = await aresponse_key(request, self.get_cache_scopes())
+        entry = await cache.aget(key)
+
+        if entry is not None:
+            response, encoded = self.entry_response(entry)
+            if encoded:
+                await cache.aset(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+            return response
+
+        return self.store_rendered(await super().aget(request, *args, **kwargs), cache, key)
+
+    def store_rendered(self, response, cache, key):
+        '''Function to cache a successful response under `key` once it's rendered'''
+
+        if response.status_code == 200:
+            # async views are rendered by Django in a thread, so this stays sync
+            def store(rendered):
+                entry = {'content': rendered.content, 'content_type': rendered['Content-Type'], 'encoded': {}}
+                self.encode(rendered, entry)
+                cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+
+            response.add_post_render_callback(store)
+
+        return response
+
+    def encode(self, response, entry):
+        '''
+            Function to compress a response with the coding the request accepts,
+            keeping the compressed bytes in its cache entry. Returns True when
+            the entry got new bytes.
+        '''
+
+        encoding = compression.accepted_encoding(self.request)
+
+        if encoding is None or not compression.is_compressible(entry['content_type'], entry['content']):
+            return False
+
+        # entries cached before responses were compressed have no encoded bytes
+        encodings = entry.setdefault('encoded', {})
+        encoded = encodings.get(encoding)
+        compressed = encoded is None
+
+        if compressed:
+            encoded = encodings[encoding] = compression.compress(entry['content'], encoding)
+
+        compression.encode_response(response, encoding, encoded)
+        return compressed
+
+    def cached_response(self, cache, key, entry):
+        response, encoded = self.entry_response(entry)
+        if encoded:
+            cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+
+        return response
+
+    def entry_response(self, entry):
+        '''Function to get the response of a cache entry, and whether the entry has to be stored again'''
+
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+
+        # the first hit of each coding compresses the entry, later hits send its bytes
+        return response, self.encode(response, entry)
@@ -0,0 +1,142 @@
+'''
+Removal of the files of deleted rows.
+
+Deletes only queue the files their rows pointed at, so deleting a user with
+thousands of books doesn't touch the disk. `manage.py remove_deleted_media`
+empties the queue in the background, and `manage.py collect_media_garbage`
+finds whatever it can't know about, e.g. files replaced by a newer upload.
+'''
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from booktopia.batches import CommitBatch
+
+from . import covers
+from .models import Book, MediaBlob, MediaRemoval
+from .storage import is_content_addressed
+
+User = get_user_model()
+
+# file fields of the models, their defaults are shared by many rows and never removed
+FILE_FIELDS = [
+    (Book, 'book_file'),
+    (Book, 'book_cover_picture'),
+    (User, 'profile_pic'),
+]
+
+
+def default_files():
+    return {model._meta.get_field(field_name).get_default() for model, field_name in FILE_FIELDS}
+
+
+def rendered_cover_files(renditions):
+    '''Function to get the cover a book's renditions were made from, and their files'''
+
+    source = renditions.get('source')
+
+    # renditions of the default cover are shared by every book that has it
+    if not source or source == covers.default_cover():
+        return []
+
+    return [source] + covers.rendition_files(renditions)
+
+
+def book_files(book):
+    '''Function to get the files a book row points at'''
+
+    names = [book.book_file.name, book.book_cover_picture.name]
+
+    # renditions of a previous cover were queued when the cover changed
+    if book.cover_renditions.get('source') == book.book_cover_picture.name:
+        names += rendered_cover_files(book.cover_renditions)[1:]
+
+    return names
+
+
+def is_counted_rendition(name):
+    '''Content-addressed renditions are referenced through their MediaBlob counts alone, no row names them in a column'''
+
+    return name.startswith(covers.RENDITION_DIRECTORY + '/') and is_content_addressed(name)
+
+
+def _create_removals(names):
+    MediaRemoval.objects.bulk_create([MediaRemoval(name=name) for name in names], batch_size=500)
+
+
+removals = CommitBatch(_create_removals)
+
+
+def queue_removals(names):
+    '''Function to queue the files of deleted rows for removal once the delete commits'''
+
+    defaults = default_files()
+    removals.add(name for name in names if name and name not in defaults)
+
+
+def remove_queued_files(batch_size=500):
+    '''
+        Function to drop the references of queued files, removing the files
+        nothing else uses.
+
+        Files a row still points at are kept whatever queued them, only their
+        other references are dropped.
+    '''
+
+    removed = 0
+
+    while True:
+        with transaction.atomic():
+            # concurrent runs skip each other's rows instead of dropping a reference twice
+            batch = list(MediaRemoval.objects.select_for_update(skip_locked=True).order_by('pk').values_list('pk', 'name')[:batch_size])
+            if not batch:
+                break
+
+            # counted renditions lose a reference and go with their last one
+            counted = {name for _, name in batch if is_counted_rendition(name)}
+            still_used = referenced_files({name for _, name in batch} - counted)
+
+            for _, name in batch:
+                if name in counted or name not in still_used:
+                    default_storage.delete(name)
+                elif hasattr(default_storage, 'drop_reference'):
+                    default_storage.drop_reference(name, keep_file=True)
+
+            MediaRemoval.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+
+        removed += len(batch)
+
+    return removed
+
+
+def referenced_files(names, recent_since=None):
+    '''
+        Function to get which of the stored files are still used by a row.
+
+        Content-addressed files referenced since `recent_since` also count,
+        their row may not be committed yet.
+    '''
+
+    names = list(names)
+    referenced = default_files().intersection(names)
+
+    for model, field_name in FILE_FIELDS:
+        referenced.update(model.objects.filter(**{f'{field_name}__in': names}).values_list(field_name, flat=True))
+
+    if recent_since is not None:
+        referenced.update(MediaBlob.objects.filter(name__in=names, updated__gte=recent_since).values_list('name', flat=True))
+
+    counted = [name for name in names if is_counted_rendition(name)]
+    if counted:
+        referenced.update(MediaBlob.objects.filter(name__in=counted, references__gt=0).values_list('name', flat=True))
+
+    # renditions stored before content addressing have no counts, they're looked up in the
+    # books' JSON until `manage.py render_book_covers --force` replaces them
+    legacy = {name for name in names if name.startswith(covers.RENDITION_DIRECTORY + '/') and not is_content_addressed(name)}
+
+    if legacy:
+        for book_renditions in Book.objects.values_list('cover_renditions', flat=True).iterator():
+            referenced.update(legacy.intersection(covers.rendition_files(book_renditions)))
+
+    return referenced
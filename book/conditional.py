@@ -0,0 +1,231 @@
+import copy
+import re
+from hashlib import md5
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from booktopia.media import current_expiry
+
+PRECONDITION_HEADERS = ('HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_UNMODIFIED_SINCE')
+
+# part of the ETags of GET responses naming their representation, see ConditionalMixin.make_validators()
+REPRESENTATION_TAG = re.compile(r'\.[0-9a-f]{8}"')
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'This resource has changed since you last fetched it.'
+    default_code = 'precondition_failed'
+
+
+def object_state(queryset, *related_fields):
+    '''
+        Function to get the `updated` timestamp of a single row, together with
+        the related values its representation shows, or None if it doesn't exist
+    '''
+
+    return _object_state(queryset.order_by().values_list('updated', *related_fields).first())
+
+
+async def aobject_state(queryset, *related_fields):
+    '''object_state() for async views'''
+
+    return _object_state(await queryset.order_by().values_list('updated', *related_fields).afirst())
+
+
+def _object_state(row):
+    if row is None:
+        return None
+    return row[0], row[1:]
+
+
+def list_state(queryset, *related_fields, counted=True):
+    '''
+        Function to get the latest `updated` timestamp of a list, together with
+        its size so deletions also change the validators.
+
+        Keyset pages skip the count, so there only changes to `updated` are seen.
+    '''
+
+    aggregates = _list_aggregates(related_fields, counted)
+    return _list_state(queryset.order_by().aggregate(**aggregates), aggregates)
+
+
+async def alist_state(queryset, *related_fields, counted=True):
+    '''list_state() for async views'''
+
+    aggregates = _list_aggregates(related_fields, counted)
+    return _list_state(await queryset.order_by().aaggregate(**aggregates), aggregates)
+
+
+def rows_state(queryset, *related_fields):
+    '''
+        Function to get the latest `updated` timestamp of a short list, together
+        with every row's related values. Unlike list_state(), a change of a
+        related value of any row changes the validators, not only of the largest.
+    '''
+
+    rows = list(queryset.order_by('pk').values_list('pk', 'updated', *related_fields))
+    return max((row[1] for row in rows), default=None), rows
+
+
+def _list_aggregates(related_fields, counted):
+    aggregates = {f'max_{field}': Max(field) for field in related_fields}
+    if counted:
+        aggregates['count'] = Count('pk')
+
+    return {'last_updated': Max('updated'), **aggregates}
+
+
+def _list_state(state, aggregates):
+    return state['last_updated'], [state[key] for key in aggregates if key != 'last_updated']
+
+
+class ConditionalMixin:
+    '''
+        Mixin that sends ETag and Last-Modified validators computed from the
+        `updated` timestamps of the rows a response is built from.
+
+        GET requests that still match get a 304 before anything is serialized,
+        and writes that send If-Match or If-Unmodified-Since fail with a 412
+        when the resource has changed in the meantime. Writes check this in
+        their own transaction with the row locked, see check_preconditions().
+    '''
+
+    def get_validator_state(self):
+        raise NotImplementedError('get_validator_state() must return object_state() or get_list_state() of the response rows.')
+
+    async def aget_validator_state(self):
+        raise NotImplementedError('aget_validator_state() must return aobject_state() or aget_list_state() of the response rows.')
+
+    def is_counted(self):
+        return self.paginator is None or not self.paginator.is_keyset(self.request)
+
+    def get_list_state(self, queryset, *related_fields):
+        '''Function to get the list_state() of a paginated list view'''
+
+        return list_state(queryset, *related_fields, counted=self.is_counted())
+
+    async def aget_list_state(self, queryset, *related_fields):
+        return await alist_state(queryset, *related_fields, counted=self.is_counted())
+
+    def get_validators(self):
+        '''Function to get the ETag and Last-Modified timestamp of the current resource'''
+
+        return self.make_validators(self.get_validator_state())
+
+    async def aget_validators(self):
+        return self.make_validators(await self.aget_validator_state())
+
+    def make_validators(self, state):
+        if state is None:
+            return None, None
+
+        last_modified, parts = state
+        # the signed media URLs in the payload change when their expiry moves on,
+        # and anonymous users get payloads without book files
+        parts = [current_expiry(), self.request.user.is_authenticated, last_modified, *parts]
+        etag = md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+        # the format and sparse fieldset of a GET change its body, writes hold across them
+        if self.request.method in ('GET', 'HEAD'):
+            etag += '.' + md5('|'.join(self.representation()).encode()).hexdigest()[:8]
+
+        return quote_etag(etag), last_modified and int(last_modified.timestamp())
+
+    def representation(self):
+        query_params = self.request.query_params
+        return [self.request.accepted_media_type, query_params.get('fields', ''), query_params.get('omit', '')]
+
+    def lock_for_write(self):
+        '''Function to lock the row a write changes until the end of the current transaction'''
+
+        rows = self.get_queryset().model.objects.filter(pk=self.kwargs['pk'])
+
+        if connection.features.has_select_for_update:
+            list(rows.select_for_update().values_list('pk', flat=True))
+        else:
+            # without row locks, e.g. on SQLite, a write that changes nothing takes the database write lock
+            rows.update(updated=F('updated'))
+
+    def check_preconditions(self):
+        '''
+            Function to fail a write with a 412 when its If-Match or
+            If-Unmodified-Since no longer holds. Call it in the transaction of
+            the write, before it changes anything.
+        '''
+
+        if not any(header in self.request.META for header in PRECONDITION_HEADERS):
+            return
+
+        self.lock_for_write()
+        etag, last_modified = self.get_validators()
+
+        if self.conditional_response(self.request, etag, last_modified) is not None:
+            raise PreconditionFailed()
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            self.check_preconditions()
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            self.check_preconditions()
+            super().perform_destroy(instance)
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+
+        response = self.conditional_response(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        return self.add_validators(response, etag, last_modified)
+
+    async def aget(self, request, *args, **kwargs):
+        etag, last_modified = await self.aget_validators()
+
+        response = self.conditional_response(request, etag, last_modified)
+        if response is None:
+            response = await super().aget(request, *args, **kwargs)
+
+        return self.add_validators(response, etag, last_modified)
+
+    def conditional_response(self, request, etag, last_modified):
+        '''Function to get the 304 or 412 response of a request whose validators still match, if any'''
+
+        if etag is None:
+            return None
+        elif request.method not in ('GET', 'HEAD'):
+            request = self.without_representation(request)
+
+        return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    def without_representation(self, request):
+        '''Function to get a copy of a write request whose ETags are compared without their representation part'''
+
+        stripped = copy.copy(request._request)
+        stripped.META = {
+            **request.META,
+            **{header: REPRESENTATION_TAG.sub('"', request.META[header]) for header in ('HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH') if header in request.META},
+        }
+
+        return stripped
+
+    def add_validators(self, response, etag, last_modified):
+        patch_vary_headers(response, ('Accept',))
+
+        if etag is not None:
+            # cached responses are already compressed, see booktopia.compression
+            response['ETag'] = 'W/' + etag if response.has_header('Content-Encoding') else etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+
+        return response
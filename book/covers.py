@@ -0,0 +1,196 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+
+from booktopia.media import sign_url
+
+from . import cache
+from .imaging import FORMATS, render_cover
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIRECTORY = 'book_pics/renditions'
+
+_executor = None
+
+
+def get_executor():
+    '''
+        Function to get the process pool covers are rendered in, or None when
+        COVER_RENDITION_WORKERS is 0 and covers are rendered in the calling thread.
+
+        Workers are spawned rather than forked, a fork of a threaded server
+        process can inherit locks held by other threads.
+    '''
+
+    global _executor
+
+    if settings.COVER_RENDITION_WORKERS == 0:
+        return None
+    elif _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.COVER_RENDITION_WORKERS, mp_context=get_context('spawn'))
+
+    return _executor
+
+
+def default_cover():
+    return Book._meta.get_field('book_cover_picture').get_default()
+
+
+def needs_renditions(book):
+    return bool(book.book_cover_picture) and book.cover_renditions.get('source') != book.book_cover_picture.name
+
+
+def read_cover(source):
+    with default_storage.open(source, 'rb') as cover:
+        return cover.read()
+
+
+def rendition_files(renditions):
+    '''Function to get the stored files of a book's cover renditions'''
+
+    return [image[extension] for image in renditions.get('images', []) for _, extension in FORMATS]
+
+
+def rendition_name(source, width, extension):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f'{RENDITION_DIRECTORY}/{stem}_{width}w.{extension}'
+
+
+def store_renditions(source, rendered):
+    '''Function to save the files of a rendered cover and get the renditions kept on its books'''
+
+    images = []
+
+    for rendition in rendered['renditions']:
+        files = {
+            extension: default_storage.save(rendition_name(source, rendition['width'], extension), ContentFile(data))
+            for extension, data in rendition['files'].items()
+        }
+        images.append({'width': rendition['width'], 'height': rendition['height'], **files})
+
+    return {'source': source, 'placeholder': rendered['placeholder'], 'images': images}
+
+
+def save_renditions(book_ids, renditions):
+    '''Function to attach renditions to the books whose cover is still the one they were made from'''
+
+    saved = Book.objects.filter(pk__in=book_ids, book_cover_picture=renditions['source']).update(
+        cover_renditions=renditions, updated=timezone.now()
+    )
+
+    if saved:
+        cache.invalidate_books(book_ids)
+
+    return saved
+
+
+def shared_renditions(source):
+    '''Function to get renditions already made for the default cover, which most books share'''
+
+    if source != default_cover():
+        return None
+
+    return Book.objects.order_by().filter(cover_renditions__source=source).values_list('cover_renditions', flat=True).first()
+
+
+def schedule_renditions(book):
+    '''Function to render a book's cover in the background once the book is committed'''
+
+    pk, source = book.pk, book.book_cover_picture.name
+    transaction.on_commit(lambda: start_rendering([pk], source))
+
+
+def schedule_book_renditions(books):
+    '''Function to render the covers of books once they're committed, each distinct cover once'''
+
+    sources = {}
+    for book in books:
+        if needs_renditions(book):
+            sources.setdefault(book.book_cover_picture.name, []).append(book.pk)
+
+    transaction.on_commit(lambda: [start_rendering(book_ids, source) for source, book_ids in sources.items()])
+
+
+def attach_renditions(book_ids, renditions):
+    '''Function to save renditions stored once for all the books, whose files are referenced by each of them'''
+
+    saved = save_renditions(book_ids, renditions)
+
+    if saved > 1 and hasattr(default_storage, 'add_references'):
+        for name in rendition_files(renditions):
+            default_storage.add_references(name, saved - 1)
+    elif not saved:
+        # the covers changed while rendering, nothing refers to the files stored for them
+        for name in rendition_files(renditions):
+            default_storage.delete(name)
+
+
+def start_rendering(book_ids, source):
+    renditions = shared_renditions(source)
+    if renditions is not None:
+        save_renditions(book_ids, renditions)
+        return
+
+    try:
+        data = read_cover(source)
+    except OSError:
+        logger.warning('Cover %s of books %s could not be read', source, book_ids)
+        return
+
+    executor = get_executor()
+
+    if executor is None:
+        # runs once the book is committed, a cover that can't be rendered mustn't fail its request
+        try:
+            rendered = render_cover(data, settings.COVER_RENDITION_WIDTHS, settings.COVER_RENDITION_QUALITY)
+            attach_renditions(book_ids, store_renditions(source, rendered))
+        except Exception:
+            logger.exception('Cover %s of books %s could not be rendered', source, book_ids)
+    else:
+        future = executor.submit(render_cover, data, settings.COVER_RENDITION_WIDTHS, settings.COVER_RENDITION_QUALITY)
+        future.add_done_callback(partial(finish_rendering, book_ids, source, threading.get_ident()))
+
+
+def finish_rendering(book_ids, source, caller, future):
+    '''
+        Callback run by the pool's management thread once a cover is rendered,
+        or by the caller itself when rendering was already done.
+    '''
+
+    try:
+        attach_renditions(book_ids, store_renditions(source, future.result()))
+    except Exception:
+        logger.exception('Cover %s of books %s could not be rendered', source, book_ids)
+    finally:
+        # database connections are per thread, don't leave the management thread's one open
+        if threading.get_ident() != caller:
+            connections.close_all()
+
+
+def represent_renditions(renditions, request=None):
+    '''Function to get the placeholder and signed rendition URLs of a book's cover'''
+
+    if not renditions:
+        return None
+
+    def url(name):
+        signed = sign_url(name)
+        return request.build_absolute_uri(signed) if request is not None else signed
+
+    images = [
+        {'width': image['width'], 'height': image['height'], **{extension: url(image[extension]) for _, extension in FORMATS}}
+        for image in renditions['images']
+    ]
+
+    return {'placeholder': renditions['placeholder'], 'images': images}
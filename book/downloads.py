@@ -0,0 +1,154 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+class RangeFile:
+    '''
+        Read only view of `length` bytes of a file starting at `start`.
+
+        It keeps the file's fileno(), so WSGI servers that use sendfile (e.g.
+        gunicorn) send the range straight from the file descriptor, from the
+        current position up to Content-Length.
+    '''
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    '''
+        Function to get the (start, end) bytes of a single `Range: bytes=` header.
+
+        Returns None when the whole file should be sent, which includes
+        malformed and multi-range headers, and raises UnsatisfiableRange when
+        the range is outside the file.
+    '''
+
+    match = RANGE.match((header or '').strip())
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+
+    start, end = match.groups()
+
+    # bytes=-500 is the last 500 bytes
+    if start == '':
+        suffix = int(end)
+        if suffix == 0 or size == 0:
+            raise UnsatisfiableRange()
+        return max(size - suffix, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+
+    if start >= size or start > end:
+        raise UnsatisfiableRange()
+
+    return start, end
+
+
+def if_range_passes(header, etag, last_modified):
+    '''Function to check if a Range still applies to the current version of the file'''
+
+    if not header:
+        return True
+    elif header.startswith('"') or header.startswith('W/'):
+        # only strong validators can be used with If-Range
+        return header == etag
+
+    return parse_http_date_safe(header) == last_modified
+
+
+def accel_response(storage, name, filename, content_type, as_attachment):
+    '''
+        Function to hand the transfer of a file over to the front web server,
+        which also takes care of Range and If-Range
+    '''
+
+    response = HttpResponse(content_type=content_type)
+    if as_attachment:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    if settings.BOOK_DOWNLOAD_ACCEL == 'nginx':
+        response['X-Accel-Redirect'] = settings.BOOK_DOWNLOAD_ACCEL_PREFIX + name
+    else:
+        response['X-Sendfile'] = storage.path(name)
+
+    return response
+
+
+def file_response(request, storage, name, as_attachment=True, filename=None):
+    '''Function to build the response that sends a stored file, or the requested range of it'''
+
+    filename = filename or os.path.basename(name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if settings.BOOK_DOWNLOAD_ACCEL:
+        return accel_response(storage, name, filename, content_type, as_attachment)
+
+    # links outlive files, which may have been replaced or collected since
+    try:
+        size = storage.size(name)
+        last_modified = int(storage.get_modified_time(name).timestamp())
+    except OSError:
+        raise Http404('This file does not exist.')
+
+    etag = f'"{last_modified:x}-{size:x}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        try:
+            byte_range = None
+            if if_range_passes(request.META.get('HTTP_IF_RANGE'), etag, last_modified):
+                byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except UnsatisfiableRange:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        try:
+            file = storage.open(name, 'rb')
+        except OSError:
+            raise Http404('This file does not exist.')
+
+        if byte_range is None:
+            response = FileResponse(file, as_attachment=as_attachment, filename=filename, content_type=content_type)
+        else:
+            start, end = byte_range
+            response = FileResponse(RangeFile(file, start, end - start + 1), status=206, as_attachment=as_attachment, filename=filename, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
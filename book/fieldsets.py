@@ -0,0 +1,79 @@
+'''
+Sparse fieldsets.
+
+GET requests can ask for some fields of a payload with `?fields=title,book_cover_picture`
+or leave some out with `?omit=description`. Only the columns of the fields that
+are sent are read from the database.
+'''
+
+from rest_framework.exceptions import ValidationError
+
+# columns list views read whatever the fields, the keyset cursor is built from them
+REQUIRED_COLUMNS = ['id', 'updated']
+
+
+def parse_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class SparseFieldsSerializerMixin:
+    '''Serializer mixin that keeps only the fields named by its `fields` argument'''
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class SparseFieldsetMixin:
+    '''
+        Mixin for model views whose serializer takes SparseFieldsSerializerMixin's
+        `fields` argument. The querysets they filter only load the requested
+        columns, and their related author only when it's sent.
+    '''
+
+    def get_fieldset(self):
+        '''Function to get the names of the fields to send, None for all of them'''
+
+        if hasattr(self, '_fieldset'):
+            return self._fieldset
+
+        fields = parse_names(self.request.query_params.get('fields'))
+        omit = parse_names(self.request.query_params.get('omit'))
+
+        if self.request.method != 'GET' or not (fields or omit):
+            self._fieldset = None
+            return None
+
+        available = list(self.get_serializer_class()().fields)
+        unknown = [name for name in fields + omit if name not in available]
+        if unknown:
+            raise ValidationError({'message': f'Unknown fields: {", ".join(unknown)}'})
+
+        self._fieldset = [name for name in available if (not fields or name in fields) and name not in omit]
+        return self._fieldset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_fieldset())
+        return super().get_serializer(*args, **kwargs)
+
+    def load_fieldset(self, queryset):
+        '''Function to limit a queryset to the columns of the requested fields'''
+
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return queryset
+
+        columns = {field.name for field in queryset.model._meta.concrete_fields}
+        loaded = REQUIRED_COLUMNS + [name for name in fieldset if name in columns and name not in REQUIRED_COLUMNS]
+
+        if 'author' in fieldset:
+            # the author is shown by email
+            return queryset.select_related('author').only(*loaded, 'author__email')
+
+        return queryset.select_related(None).only(*loaded)
+
+    def filter_queryset(self, queryset):
+        return self.load_fieldset(super().filter_queryset(queryset))
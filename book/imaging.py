@@ -0,0 +1,66 @@
+'''
+Cover image renditions.
+
+Everything here works on bytes and doesn't touch Django, so it can run in
+worker processes that never set Django up.
+'''
+
+import base64
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# formats every rendition is encoded in, as (Pillow format, file extension)
+FORMATS = [('WEBP', 'webp'), ('JPEG', 'jpg')]
+
+# width of the placeholder inlined in book payloads, it is meant to be blurred and stretched
+PLACEHOLDER_WIDTH = 16
+
+
+def open_rgb(data):
+    '''Function to decode an image upright and without transparency'''
+
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+
+    return image.convert('RGB')
+
+
+def encode(image, image_format, quality):
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def render_cover(data, widths, quality=80):
+    '''
+        Function to render a cover image at each width in every format, and
+        its placeholder as a data URI.
+
+        Covers are never upscaled, widths larger than the image give a single
+        rendition at its own width.
+    '''
+
+    image = open_rgb(data)
+    renditions = []
+
+    for width in sorted({min(width, image.width) for width in widths}):
+        height = max(round(image.height * width / image.width), 1)
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+
+        renditions.append({
+            'width': width,
+            'height': height,
+            'files': {extension: encode(resized, image_format, quality) for image_format, extension in FORMATS},
+        })
+
+    placeholder = image.copy()
+    placeholder.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH * 4), Image.Resampling.BILINEAR)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(encode(placeholder, 'JPEG', 50)).decode()
+
+    return {'placeholder': placeholder, 'renditions': renditions}
@@ -0,0 +1,214 @@
+'''
+Bulk import of books from a manifest.
+
+Each row names a title, a description, the author's email and the paths of
+the book file and, optionally, its cover, relative to a root directory.
+Rows are validated with the AddBookSerializer rules, the files of a chunk are
+copied into storage by a pool of threads, and its books are inserted with one
+bulk_create in one transaction. bulk_create sends no signals, so the search
+index, the cached responses and the cover renditions are updated for the
+whole chunk instead.
+'''
+
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils._os import safe_join
+
+from booktopia.batches import chunked
+
+from . import cache, covers, search
+from .models import Book
+from .serializers import AddBookSerializer
+
+User = get_user_model()
+
+FILE_FIELDS = ['book_file', 'book_cover_picture']
+
+
+def resolve_path(root, path):
+    '''Function to get the full path of a manifest file, which has to be under root'''
+
+    if not isinstance(path, str) or not path:
+        raise SuspiciousFileOperation('File path must be a non-empty string')
+
+    return safe_join(root, path)
+
+
+def open_files(row, root):
+    '''Function to open the files a row names, as the uploads AddBookSerializer expects'''
+
+    files = {}
+
+    try:
+        for field_name in FILE_FIELDS:
+            if row.get(field_name):
+                path = resolve_path(root, row[field_name])
+                files[field_name] = File(open(path, 'rb'), os.path.basename(path))
+    except (OSError, SuspiciousFileOperation):
+        close_files(files)
+        raise
+
+    return files
+
+
+def close_files(files):
+    for file in files.values():
+        file.close()
+
+
+def validate_chunk(numbered_rows, root):
+    '''
+        Function to split (row number, row) pairs into valid books and the
+        errors of the others. Authors are looked up in one query.
+    '''
+
+    rows = [(number, row) for number, row in numbered_rows]
+    emails = {row.get('author') for _, row in rows if isinstance(row, dict) and isinstance(row.get('author'), str)}
+    authors = {author.email: author for author in User.objects.filter(email__in=emails, role=User.AUTHOR)}
+
+    valid = []
+    errors = []
+
+    for number, row in rows:
+        if not isinstance(row, dict):
+            errors.append({'row': number, 'errors': {'message': 'Row must be an object'}})
+            continue
+
+        author = authors.get(row.get('author'))
+        if author is None:
+            errors.append({'row': number, 'errors': {'author': ['No author has this email']}})
+            continue
+
+        try:
+            files = open_files(row, root)
+        except (OSError, SuspiciousFileOperation) as error:
+            errors.append({'row': number, 'errors': {'message': f'File could not be read: {error}'}})
+            continue
+
+        try:
+            serializer = AddBookSerializer(data={'title': row.get('title'), 'description': row.get('description'), **files})
+            is_valid = serializer.is_valid()
+        finally:
+            close_files(files)
+
+        if not is_valid:
+            errors.append({'row': number, 'errors': serializer.errors})
+            continue
+
+        data = serializer.validated_data
+        paths = {field_name: resolve_path(root, row[field_name]) for field_name in files}
+        valid.append((number, {'title': data['title'], 'description': data['description'], 'author': author}, paths))
+
+    return valid, errors
+
+
+def copy_file(field_name, path):
+    '''
+        Function to copy a file into storage, returns its stored name.
+
+        Content-addressed storage only writes the file here, its reference is
+        counted when the book is inserted.
+    '''
+
+    with open(path, 'rb') as source:
+        content = File(source, os.path.basename(path))
+        name = Book._meta.get_field(field_name).generate_filename(None, content.name)
+
+        if hasattr(default_storage, 'write_blob'):
+            return default_storage.write_blob(name, content)
+
+        return default_storage.save(name, content)
+
+
+def copy_row_files(paths):
+    return {field_name: copy_file(field_name, path) for field_name, path in paths.items()}
+
+
+def reference_files(stored):
+    '''Function to count a reference per book to each content-addressed file the books were given'''
+
+    if not hasattr(default_storage, 'reference_blob'):
+        return
+
+    counts = Counter()
+    paths = {}
+
+    for row_paths, names in stored:
+        for field_name, name in names.items():
+            counts[name] += 1
+            paths[name] = row_paths[field_name]
+
+    for name, count in counts.items():
+        # the content is only read again if the file was removed since it was copied
+        with open(paths[name], 'rb') as source:
+            default_storage.reference_blob(name, File(source, os.path.basename(paths[name])), count)
+
+
+def insert_books(valid, stored):
+    '''Function to insert books with their stored files and update what their signals would have'''
+
+    books = [Book(**data, **names) for (_, data, _), (_, names) in zip(valid, stored)]
+
+    with transaction.atomic():
+        reference_files(stored)
+        books = Book.objects.bulk_create(books)
+
+        book_ids = [book.pk for book in books]
+        search.index_books(book_ids)
+        cache.invalidate_books(book_ids)
+        covers.schedule_book_renditions(books)
+
+    return books
+
+
+def import_books(rows, root, chunk_size=500, workers=None, start_after=0, on_chunk=None):
+    '''
+        Function to create books from an iterable of dicts whose file paths are relative to root.
+
+        Returns the number of books created and the errors of the rows that
+        weren't, by 1-based row number. Rows up to `start_after` are skipped,
+        so an import can resume after the last chunk it committed.
+        `on_chunk(created, errors, last_row)` is called once a chunk is committed.
+    '''
+
+    created = 0
+    all_errors = []
+
+    numbered_rows = ((number, row) for number, row in enumerate(rows, start=1) if number > start_after)
+
+    # copying is mostly waiting on the disk, and hashing releases the GIL
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as executor:
+        for chunk in chunked(numbered_rows, chunk_size):
+            valid, errors = validate_chunk(chunk, root)
+
+            futures = [executor.submit(copy_row_files, paths) for _, _, paths in valid]
+            copied = []
+            stored = []
+
+            for row, future in zip(valid, futures):
+                try:
+                    names = future.result()
+                except OSError as error:
+                    errors.append({'row': row[0], 'errors': {'message': f'File could not be copied: {error}'}})
+                    continue
+
+                copied.append(row)
+                stored.append((row[2], names))
+
+            books = insert_books(copied, stored) if copied else []
+
+            created += len(books)
+            errors.sort(key=lambda error: error['row'])
+            all_errors.extend(errors)
+
+            if on_chunk is not None:
+                on_chunk(len(books), errors, chunk[-1][0])
+
+    return created, all_errors
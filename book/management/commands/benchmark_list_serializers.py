@@ -0,0 +1,88 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rest_framework.renderers import JSONRenderer
+
+from book import rows, serializers
+from book.models import Book, Comment
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure rows per second of list pages built by the model serializers and from values() rows, on generated rows that are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of books and of comments to generate')
+        parser.add_argument('--rounds', type=int, default=3, help='Number of times each representation is built, the best round counts')
+
+    def generate(self, count):
+        author = User.objects.create(email='benchmark-author@example.com', first_name='Bench', last_name='Author', password='unusable', role=User.AUTHOR)
+        reader = User.objects.create(email='benchmark-reader@example.com', first_name='Bench', last_name='Reader', password='unusable')
+
+        books = Book.objects.bulk_create([
+            Book(title=f'Benchmark book {i}', description='A generated book. ' * 50, book_file=f'books/benchmark-{i}.pdf', author=author)
+            for i in range(count)
+        ], batch_size=1000)
+
+        Comment.objects.bulk_create([
+            Comment(book=book, commenter=reader, comment='A generated comment', rating=i % 5 + 1)
+            for i, book in enumerate(books)
+        ], batch_size=1000)
+
+        return Book.objects.filter(author=author), Comment.objects.filter(commenter=reader)
+
+    def measure(self, build, rounds):
+        best = None
+
+        for _ in range(rounds):
+            started = time.perf_counter()
+            data = build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+
+        return data, best
+
+    def compare(self, name, serializer_class, queryset, related, count, rounds):
+        def with_serializer():
+            return serializer_class(list(queryset.select_related(*related)), many=True).data
+
+        def with_rows():
+            builders, columns = rows.row_builders(serializer_class())
+            return rows.RowListSerializer(queryset.values(*columns), builders).data
+
+        renderer = JSONRenderer()
+        results = {}
+
+        for label, build in (('serializer', with_serializer), ('rows', with_rows)):
+            data, elapsed = self.measure(build, rounds)
+            results[label] = renderer.render(data)
+            self.stdout.write(f'{name:>8} {label:>10}: {count / elapsed:10.0f} rows/s, {elapsed:.3f}s')
+
+        if results['serializer'] != results['rows']:
+            self.stdout.write(f'{name}: the representations differ', self.style.ERROR)
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        rounds = options['rounds']
+
+        self.stdout.write(f'Generating {count} books and {count} comments')
+
+        try:
+            with transaction.atomic():
+                books, comments = self.generate(count)
+
+                self.compare('books', serializers.BookDetailsSerializer, books, ['author'], count, rounds)
+                self.compare('comments', serializers.CommentSerializer, comments, ['commenter', 'book__author'], count, rounds)
+
+                # nothing generated is kept
+                raise Rollback()
+        except Rollback:
+            pass
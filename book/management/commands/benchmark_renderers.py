@@ -0,0 +1,71 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
+
+from book.models import Book, Comment
+from book.serializers import BookDetailsSerializer, CommentSerializer
+from booktopia import renderers
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure encode time and payload size of book and comment lists with each renderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of books and of comments in the lists')
+        parser.add_argument('--rounds', type=int, default=5, help='Number of times each list is encoded, the best round counts')
+
+    def payloads(self, count):
+        '''Function to get book and comment lists as the list views send them, built from unsaved rows'''
+
+        author = User(email='benchmark-author@example.com', role=User.AUTHOR)
+        reader = User(email='benchmark-reader@example.com')
+        now = timezone.now()
+
+        books = [
+            Book(
+                pk=i + 1, title=f'Benchmark book {i}', description='A generated book. ' * 50,
+                book_file=f'books/benchmark-{i}.pdf', author=author, no_of_comments=i % 40, no_of_ratings=i % 40,
+                average_rating=Decimal(i % 500) / 100, created=now, updated=now
+            )
+            for i in range(count)
+        ]
+        comments = [
+            Comment(pk=i + 1, book=book, commenter=reader, comment='A generated comment', rating=i % 5 + 1, created=now, updated=now)
+            for i, book in enumerate(books)
+        ]
+
+        return [
+            ('books', {'results': BookDetailsSerializer(books, many=True).data}),
+            ('comments', {'results': CommentSerializer(comments, many=True).data}),
+        ]
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        rounds = options['rounds']
+
+        encoders = [('json', JSONRenderer()), ('orjson', renderers.ORJSONRenderer())]
+        if renderers.msgpack is not None:
+            encoders.append(('msgpack', renderers.MessagePackRenderer()))
+        else:
+            self.stdout.write('msgpack is not installed, MessagePack is skipped', self.style.WARNING)
+
+        for name, data in self.payloads(count):
+            for label, renderer in encoders:
+                best = None
+
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    content = renderer.render(data)
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+
+                self.stdout.write(
+                    f'{name:>8} {label:>8}: {best * 1000:8.1f} ms, {count / best:10.0f} rows/s, {len(content) / 1024:8.0f} KiB'
+                )
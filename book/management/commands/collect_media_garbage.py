@@ -0,0 +1,71 @@
+import os
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from book import cleanup
+from booktopia.batches import chunked
+
+
+class Command(BaseCommand):
+    help = 'Find files under MEDIA_ROOT that no row points at, and remove them with --delete'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of files checked per round of queries')
+        parser.add_argument('--min-age', type=int, default=3600, help='Seconds since a file was written before it can be an orphan')
+        parser.add_argument('--delete', action='store_true', help='Remove the orphans instead of only listing them')
+
+    def walk(self, root, written_before):
+        '''Function to yield the storage names of the files under root, one directory at a time'''
+
+        # parts of chunked uploads are removed by `manage.py remove_expired_uploads`
+        skipped = {os.path.abspath(settings.BOOK_UPLOAD_ROOT)}
+        directories = [root]
+
+        while directories:
+            directory = directories.pop()
+
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # chunked uploads belong to their BookUpload rows
+                        if os.path.abspath(entry.path) not in skipped:
+                            directories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < written_before:
+                        yield os.path.relpath(entry.path, root).replace(os.sep, '/'), entry.stat().st_size
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        if not os.path.isdir(root):
+            self.stdout.write(f'{root} does not exist.')
+            return
+
+        written_before = time.time() - options['min_age']
+        recent_since = datetime.fromtimestamp(written_before, tz=timezone.utc)
+        purge = getattr(default_storage, 'purge', default_storage.delete)
+
+        checked = 0
+        orphans = 0
+        orphan_bytes = 0
+
+        for batch in chunked(self.walk(root, written_before), options['batch_size']):
+            referenced = cleanup.referenced_files([name for name, _ in batch], recent_since)
+
+            for name, size in batch:
+                if name in referenced:
+                    continue
+
+                orphans += 1
+                orphan_bytes += size
+                self.stdout.write(name)
+
+                if options['delete']:
+                    purge(name)
+
+            checked += len(batch)
+
+        action = 'removed' if options['delete'] else 'found'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} files, {action} {orphans} orphans ({orphan_bytes} bytes).'))
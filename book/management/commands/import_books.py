@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from book import importing
+
+
+class Command(BaseCommand):
+    help = 'Create books from a CSV file with a header row, or a JSON Lines file, copying the files they name into storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with one book per row: title, description, author (email), book_file and optionally book_cover_picture')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Format of the file, guessed from its extension by default')
+        parser.add_argument('--files-root', help='Directory the file paths of the rows are relative to, the directory of the manifest by default')
+        parser.add_argument('--author', help='Email of the author of rows that have none')
+        parser.add_argument('--chunk-size', type=int, default=settings.BOOK_IMPORT_CHUNK_SIZE, help='Number of books validated and inserted per transaction')
+        parser.add_argument('--workers', type=int, default=settings.BOOK_IMPORT_WORKERS, help='Number of threads copying files')
+        parser.add_argument('--checkpoint', help='File recording the last committed row, the manifest path with .checkpoint appended by default')
+        parser.add_argument('--from-start', action='store_true', help='Ignore the checkpoint of a previous run and import every row')
+
+    def read_rows(self, file, file_format, author):
+        if file_format == 'csv':
+            rows = (
+                # empty cells fall back to the field defaults
+                {key: value for key, value in row.items() if value not in ('', None)}
+                for row in csv.DictReader(file)
+            )
+        else:
+            rows = (self.parse_line(line) for line in file if line.strip())
+
+        for row in rows:
+            if author and isinstance(row, dict):
+                row.setdefault('author', author)
+            yield row
+
+    def parse_line(self, line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            # reported as an invalid row
+            return line
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)['row']
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError, TypeError):
+            raise CommandError(f'Checkpoint {path} is unreadable, remove it or pass --from-start')
+
+    def write_checkpoint(self, path, row):
+        # written aside and renamed, an interrupted write leaves the previous checkpoint
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'row': row}, file)
+
+        os.replace(path + '.tmp', path)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        root = options['files_root'] or os.path.dirname(os.path.abspath(path))
+        checkpoint = options['checkpoint'] or path + '.checkpoint'
+
+        start_after = 0 if options['from_start'] else self.read_checkpoint(checkpoint)
+        if start_after:
+            self.stdout.write(f'Resuming after row {start_after}')
+
+        totals = {'created': 0, 'failed': 0}
+
+        def report(created, errors, last_row):
+            totals['created'] += created
+            totals['failed'] += len(errors)
+            self.write_checkpoint(checkpoint, last_row)
+
+            for error in errors:
+                self.stdout.write(f'Row {error["row"]}: {json.dumps(error["errors"])}', self.style.WARNING)
+
+            self.stdout.write(f'Row {last_row}: {totals["created"]} books created, {totals["failed"]} rows failed so far')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                importing.import_books(
+                    self.read_rows(file, file_format, options['author']),
+                    root,
+                    chunk_size=options['chunk_size'],
+                    workers=options['workers'],
+                    start_after=start_after,
+                    on_chunk=report
+                )
+        except OSError as error:
+            raise CommandError(f'Could not read {path}: {error}')
+
+        # the import is complete, a next run starts over
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        self.stdout.write(self.style.SUCCESS(f'Created {totals["created"]} books, {totals["failed"]} rows failed.'))
@@ -0,0 +1,88 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+DEFAULT_PATHS = ['/book/allBooks/', '/book/userComments/']
+
+
+class Command(BaseCommand):
+    help = (
+        'Send concurrent GET requests to the book and comment read endpoints of a running server and report '
+        'throughput and latency at each concurrency. To compare what one process serves, run it against '
+        '`ASYNC_READ_VIEWS=1 uvicorn booktopia.asgi:application --workers 1`, where the reads are async views, and against '
+        '`gunicorn booktopia.wsgi --workers 1`, a single sync worker, with the same database and settings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server')
+        parser.add_argument('--token', help='Token sent in the Authorization header, needed for the comment endpoints')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64], help='Numbers of requests in flight to measure')
+        parser.add_argument('--requests', type=int, default=2000, help='Number of requests sent at each concurrency')
+        parser.add_argument('--path', action='append', dest='paths', help='Path to request, repeat for several, in turn')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds after which a request counts as failed')
+
+    def fetch(self, url, headers, timeout):
+        '''Function to send one request, returning its latency in seconds and whether it failed'''
+
+        started = time.perf_counter()
+
+        try:
+            with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+                response.read()
+                failed = response.status >= 400
+        except (HTTPError, URLError, OSError):
+            failed = True
+
+        return time.perf_counter() - started, failed
+
+    def run(self, urls, headers, concurrency, total, timeout):
+        sent = iter(range(total))
+        lock = threading.Lock()
+        latencies = []
+        errors = 0
+
+        def worker():
+            nonlocal errors
+
+            while True:
+                with lock:
+                    number = next(sent, None)
+                if number is None:
+                    return
+
+                latency, failed = self.fetch(urls[number % len(urls)], headers, timeout)
+
+                with lock:
+                    latencies.append(latency)
+                    errors += failed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        elapsed = time.perf_counter() - started
+
+        return latencies, errors, elapsed
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        urls = [base + path for path in options['paths'] or DEFAULT_PATHS]
+        headers = {'Accept-Encoding': 'gzip'}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+
+        self.stdout.write(f'{"concurrency":>11} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+
+        for concurrency in options['concurrency']:
+            latencies, errors, elapsed = self.run(urls, headers, concurrency, options['requests'], options['timeout'])
+            percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+
+            self.stdout.write(
+                f'{concurrency:>11} {len(latencies) / elapsed:>9.0f} {percentiles[49] * 1000:>8.1f} '
+                f'{percentiles[94] * 1000:>8.1f} {percentiles[98] * 1000:>8.1f} {errors:>7}'
+            )
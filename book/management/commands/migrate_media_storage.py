@@ -0,0 +1,98 @@
+from django.core.files.storage import default_storage, get_storage_class
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from book import cache
+from book.cleanup import FILE_FIELDS
+from book.models import Book
+from book.storage import ContentAddressedStorage, is_content_addressed
+
+
+class Command(BaseCommand):
+    help = 'Move files saved under their upload names into content-addressed storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Number of rows moved per query')
+        parser.add_argument('--dry-run', action='store_true', help='Report the files that would be moved without moving them')
+
+    def handle(self, *args, **options):
+        if not issubclass(get_storage_class(), ContentAddressedStorage):
+            raise CommandError('DEFAULT_FILE_STORAGE is not book.storage.ContentAddressedStorage.')
+
+        for model, field_name in FILE_FIELDS:
+            moved, removed = self.migrate_field(model, field_name, options['batch_size'], options['dry_run'])
+            action = 'would move' if options['dry_run'] else 'moved'
+            self.stdout.write(self.style.SUCCESS(
+                f'{model.__name__}.{field_name}: {action} {moved} files, removed {removed} old files.'
+            ))
+
+    def migrate_field(self, model, field_name, batch_size, dry_run):
+        default = model._meta.get_field(field_name).get_default()
+        is_book = model is Book
+        columns = ['pk', field_name] + (['cover_renditions'] if is_book else [])
+
+        rows = model.objects.order_by('pk').exclude(**{field_name: default}).exclude(**{field_name: ''})
+        moved = 0
+        removed = 0
+        last_pk = 0
+
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk).values(*columns)[:batch_size])
+            if not batch:
+                break
+
+            last_pk = batch[-1]['pk']
+            pending = [row for row in batch if row[field_name] and not is_content_addressed(row[field_name])]
+
+            if dry_run:
+                moved += len(pending)
+                continue
+
+            new_names = {}
+            changed = []
+            now = timezone.now()
+
+            for row in pending:
+                old_name = row[field_name]
+
+                if old_name not in new_names:
+                    try:
+                        with default_storage.open(old_name, 'rb') as old_file:
+                            new_names[old_name] = default_storage.save(old_name, old_file)
+                    except FileNotFoundError:
+                        self.stdout.write(f'{model.__name__} {row["pk"]}: {old_name} is missing', self.style.WARNING)
+                        continue
+
+                instance = model(pk=row['pk'], **{field_name: new_names[old_name]})
+
+                if is_book:
+                    instance.updated = now
+                    instance.cover_renditions = row['cover_renditions']
+                    # keep renditions made from this cover current
+                    if field_name == 'book_cover_picture' and row['cover_renditions'].get('source') == old_name:
+                        instance.cover_renditions = {**row['cover_renditions'], 'source': new_names[old_name]}
+
+                changed.append(instance)
+
+            if not changed:
+                continue
+
+            update_fields = [field_name] + (['updated', 'cover_renditions'] if is_book else [])
+
+            with transaction.atomic():
+                model.objects.bulk_update(changed, update_fields)
+                if is_book:
+                    cache.invalidate_books([instance.pk for instance in changed])
+
+            # old names still used by rows that weren't moved keep their file
+            still_used = set(model.objects.filter(**{f'{field_name}__in': list(new_names)}).values_list(field_name, flat=True))
+
+            for old_name in new_names:
+                if old_name not in still_used:
+                    default_storage.delete(old_name)
+                    removed += 1
+
+            moved += len(changed)
+
+        return moved, removed
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from book import cache, ratings
+from book.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Recompute the comment and rating counters of books from their comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('books', nargs='*', type=int, help='Ids of the books to check, all books by default')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of books checked and updated per query')
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted books without fixing them')
+
+    def lock_batch(self, books, last_pk, batch_size):
+        '''Function to lock the next batch of books until the end of the current transaction and get their counters'''
+
+        # walk the books by primary key so each batch is one indexed range query
+        batch = books.filter(pk__gt=last_pk).values('pk', *ratings.COUNTER_FIELDS)
+
+        if connection.features.has_select_for_update:
+            # comments can still be added, only the counter updates of their books wait
+            batch = batch.select_for_update(no_key=True)
+        else:
+            # without row locks, e.g. on SQLite, a write that changes nothing takes the database write lock
+            Book.objects.filter(pk=last_pk).update(updated=F('updated'))
+
+        return list(batch[:batch_size])
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        books = Book.objects.order_by('pk')
+        if options['books']:
+            books = books.filter(pk__in=options['books'])
+
+        checked = 0
+        drifted = 0
+        last_pk = 0
+
+        while True:
+            # counters are read, computed and written with the batch locked, so comment
+            # writes meanwhile wait and add to the repaired values instead of being lost
+            with transaction.atomic():
+                batch = self.lock_batch(books, last_pk, batch_size)
+                if not batch:
+                    break
+
+                last_pk = batch[-1]['pk']
+                expected = ratings.expected_counters([row['pk'] for row in batch])
+                now = timezone.now()
+                changed = []
+
+                for row in batch:
+                    counters = expected[row['pk']]
+                    differences = [f'{field} {row[field]} -> {value}' for field, value in counters.items() if row[field] != value]
+
+                    if differences:
+                        changed.append(Book(pk=row['pk'], updated=now, **counters))
+                        self.stdout.write(f'Book {row["pk"]}: ' + ', '.join(differences), self.style.WARNING)
+
+                if changed and not dry_run:
+                    Book.objects.bulk_update(changed, ratings.COUNTER_FIELDS + ['updated'])
+                    cache.invalidate_books([book.pk for book in changed])
+
+            checked += len(batch)
+            drifted += len(changed)
+
+        action = 'found' if dry_run else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} books, {action} {drifted} with drifted counters.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from book import cleanup
+
+
+class Command(BaseCommand):
+    help = 'Remove the files of deleted books and users queued by their deletes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of queued files handled per transaction')
+
+    def handle(self, *args, **options):
+        removed = cleanup.remove_queued_files(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Handled {removed} queued files.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from book import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that got no chunk for BOOK_UPLOAD_TTL seconds, their part files, and part files of deleted uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of uploads deleted per query')
+
+    def handle(self, *args, **options):
+        expired = uploads.remove_expired(options['batch_size'])
+        stray = uploads.remove_stray_parts()
+        self.stdout.write(self.style.SUCCESS(f'Removed {expired} expired uploads and {stray} stray parts.'))
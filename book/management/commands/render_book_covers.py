@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from book import cleanup, covers
+from book.imaging import render_cover
+from book.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Render the cover renditions of books that are missing them or whose cover changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('books', nargs='*', type=int, help='Ids of the books to render, all books by default')
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of books read and rendered at a time')
+        parser.add_argument('--force', action='store_true', help='Render covers again even when their renditions are current')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        force = options['force']
+
+        books = Book.objects.order_by('pk')
+        if options['books']:
+            books = books.filter(pk__in=options['books'])
+
+        executor = covers.get_executor()
+        # renditions made by this run, so a cover shared by several books is rendered once
+        rendered_sources = {}
+        # renditions whose files hold the reference made when they were stored, until a book takes it
+        unclaimed = set()
+        rendered = 0
+        last_pk = 0
+
+        while True:
+            batch = list(books.filter(pk__gt=last_pk).values('pk', 'book_cover_picture', 'cover_renditions')[:batch_size])
+            if not batch:
+                break
+
+            last_pk = batch[-1]['pk']
+            pending = {}
+            # files of current renditions that --force makes again, their references go with them
+            replaced = {}
+
+            for row in batch:
+                source = row['book_cover_picture']
+                if source and (force or row['cover_renditions'].get('source') != source):
+                    pending.setdefault(source, []).append(row['pk'])
+                    if row['cover_renditions'].get('source') == source:
+                        replaced.setdefault(source, []).extend(cleanup.rendered_cover_files(row['cover_renditions'])[1:])
+
+            sources = []
+            data = []
+
+            for source in pending:
+                if source in rendered_sources:
+                    continue
+
+                try:
+                    data.append(covers.read_cover(source))
+                    sources.append(source)
+                except OSError:
+                    self.stdout.write(f'Cover {source} of books {pending[source]} could not be read', self.style.WARNING)
+
+            # the pool renders the batch's covers in parallel
+            arguments = (settings.COVER_RENDITION_WIDTHS, settings.COVER_RENDITION_QUALITY)
+            futures = [executor.submit(render_cover, cover, *arguments) for cover in data] if executor else [None] * len(data)
+
+            for source, cover, future in zip(sources, data, futures):
+                try:
+                    result = future.result() if future else render_cover(cover, *arguments)
+                except Exception as error:
+                    self.stdout.write(f'Cover {source} could not be rendered: {error}', self.style.WARNING)
+                    continue
+
+                rendered_sources[source] = covers.store_renditions(source, result)
+                unclaimed.add(source)
+
+            for source, book_ids in pending.items():
+                if source not in rendered_sources:
+                    continue
+
+                saved = covers.save_renditions(book_ids, rendered_sources[source])
+                rendered += saved
+
+                # files stored once are referenced by every book given the renditions
+                extra = saved
+                if saved and source in unclaimed:
+                    unclaimed.discard(source)
+                    extra -= 1
+
+                if extra > 0 and hasattr(default_storage, 'add_references'):
+                    for name in covers.rendition_files(rendered_sources[source]):
+                        default_storage.add_references(name, extra)
+
+                if saved:
+                    cleanup.queue_removals(replaced.get(source, []))
+
+        # covers that changed while they were rendered
+        for source in unclaimed:
+            for name in covers.rendition_files(rendered_sources[source]):
+                default_storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered covers of {rendered} books from {len(rendered_sources)} images.'))
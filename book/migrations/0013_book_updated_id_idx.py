@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0012_alter_book_options_alter_comment_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-updated', '-id'], name='book_updated_id_idx'),
+        ),
+    ]
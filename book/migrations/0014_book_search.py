@@ -0,0 +1,55 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = [
+    '''CREATE VIRTUAL TABLE book_search USING fts5(
+        title, author_name, description,
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )''',
+    '''INSERT INTO book_search (rowid, title, author_name, description)
+    SELECT b.id, b.title, coalesce(u.first_name || ' ' || u.last_name, ''), b.description
+    FROM book_book b LEFT JOIN user_customuser u ON u.id = b.author_id''',
+]
+
+SQLITE_DROP = ['DROP TABLE IF EXISTS book_search']
+
+POSTGRESQL_CREATE = [
+    '''CREATE TABLE book_search (
+        book_id bigint PRIMARY KEY REFERENCES book_book (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )''',
+    'CREATE INDEX book_search_document_idx ON book_search USING GIN (document)',
+    '''INSERT INTO book_search (book_id, document)
+    SELECT b.id,
+        setweight(to_tsvector('english', b.title), 'A') ||
+        setweight(to_tsvector('english', coalesce(u.first_name || ' ' || u.last_name, '')), 'B') ||
+        setweight(to_tsvector('english', b.description), 'C')
+    FROM book_book b LEFT JOIN user_customuser u ON u.id = b.author_id''',
+]
+
+POSTGRESQL_DROP = ['DROP TABLE IF EXISTS book_search']
+
+
+def run_for_vendor(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_alter_customuser_id'),
+        ('book', '0013_book_updated_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_CREATE, POSTGRESQL_CREATE),
+            run_for_vendor(SQLITE_DROP, POSTGRESQL_DROP),
+        ),
+    ]
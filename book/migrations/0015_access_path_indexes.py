@@ -0,0 +1,68 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:48
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+
+
+def remove_duplicate_comments(apps, schema_editor):
+    '''Keep only the latest comment of a user on a book before adding the unique constraint'''
+
+    Comment = apps.get_model('book', 'Comment')
+
+    duplicates = (
+        Comment.objects.values('book', 'commenter')
+        .annotate(latest=Max('id'), count=Count('id'))
+        .filter(book__isnull=False, commenter__isnull=False, count__gt=1)
+        .order_by()
+    )
+
+    for duplicate in duplicates.iterator():
+        Comment.objects.filter(
+            book=duplicate['book'], commenter=duplicate['commenter'], id__lt=duplicate['latest']
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('book', '0014_book_search'),
+    ]
+
+    operations = [
+        # create the composite indexes before dropping the foreign key indexes they replace
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', '-updated', '-id'], name='book_author_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['book', '-updated', '-id'], name='comment_book_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['commenter', '-updated', '-id'], name='comment_commenter_updated_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_comments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='comment',
+            constraint=models.UniqueConstraint(fields=('book', 'commenter'), name='unique_book_commenter'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='author',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='book',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='book.book'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='commenter',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
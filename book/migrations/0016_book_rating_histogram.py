@@ -0,0 +1,82 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:50
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+STAR_FIELDS = ['one_star_ratings', 'two_star_ratings', 'three_star_ratings', 'four_star_ratings', 'five_star_ratings']
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    '''Compute the ratings sum and histogram of existing books from their comments'''
+
+    Book = apps.get_model('book', 'Book')
+    Comment = apps.get_model('book', 'Comment')
+
+    stars = {field: Count('id', filter=Q(rating=star)) for star, field in enumerate(STAR_FIELDS, start=1)}
+    aggregates = (
+        Comment.objects.filter(book__isnull=False)
+        .values('book')
+        .annotate(count=Count('id'), total=Sum('rating'), **stars)
+        .order_by()
+    )
+
+    fields = ['no_of_comments', 'no_of_ratings', 'ratings_sum', 'average_rating'] + STAR_FIELDS
+    books = []
+
+    for row in aggregates.iterator():
+        book = Book(pk=row['book'], no_of_comments=row['count'], no_of_ratings=row['count'], ratings_sum=row['total'])
+        # rounded half up to hundredths like book.ratings.average_rating()
+        book.average_rating = Decimal((row['total'] * 200 + row['count']) // (row['count'] * 2)).scaleb(-2)
+        for field in STAR_FIELDS:
+            setattr(book, field, row[field])
+        books.append(book)
+
+        if len(books) == 500:
+            Book.objects.bulk_update(books, fields)
+            books = []
+
+    Book.objects.bulk_update(books, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0015_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='five_star_ratings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='four_star_ratings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='one_star_ratings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='ratings_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='three_star_ratings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='two_star_ratings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
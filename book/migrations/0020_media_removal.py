@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0019_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaRemoval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='mediablob',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:54
+
+import book.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0020_media_removal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookupload',
+            name='expires',
+            field=models.DateTimeField(db_index=True, default=book.models.upload_expiry),
+        ),
+        migrations.AddField(
+            model_name='bookupload',
+            name='finalizing',
+            field=models.BooleanField(default=False),
+        ),
+    ]
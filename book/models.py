@@ -1,4 +1,10 @@
+import os
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 from user.models import CustomUser
@@ -11,9 +17,19 @@ class Book(models.Model):
     description = models.CharField(max_length=5000, null=False)
     book_file = models.FileField(upload_to='books', null=False)
     book_cover_picture = models.ImageField(default='book_pics/default.jpg',upload_to='book_pics')
-    author = models.ForeignKey(CustomUser, null=True, on_delete=models.CASCADE)
+    # sized WebP/JPEG copies of the cover and its placeholder, rendered in the background by book.covers
+    cover_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # indexed by book_author_updated_idx
+    author = models.ForeignKey(CustomUser, null=True, on_delete=models.CASCADE, db_index=False)
     no_of_comments = models.IntegerField(null=False, default=0)
     no_of_ratings = models.IntegerField(null=False, default=0)
+    # exact sum and per-star histogram of all ratings, average_rating is derived from them
+    ratings_sum = models.IntegerField(null=False, default=0)
+    one_star_ratings = models.IntegerField(null=False, default=0)
+    two_star_ratings = models.IntegerField(null=False, default=0)
+    three_star_ratings = models.IntegerField(null=False, default=0)
+    four_star_ratings = models.IntegerField(null=False, default=0)
+    five_star_ratings = models.IntegerField(null=False, default=0)
     average_rating = models.DecimalField(null=False, decimal_places=2, max_digits=3, default=0.00)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
@@ -23,15 +39,23 @@ class Book(models.Model):
 
     class Meta:
         ordering = ['-updated']
+        indexes = [
+            # keyset pagination over the catalog
+            models.Index(fields=['-updated', '-id'], name='book_updated_id_idx'),
+            # an author's books, newest first
+            models.Index(fields=['author', '-updated', '-id'], name='book_author_updated_idx'),
+        ]
 
 
 class Comment(models.Model):
     '''Comments model'''
 
-    commenter = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True)
+    # indexed by comment_commenter_updated_idx
+    commenter = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, db_index=False)
     comment = models.CharField(max_length=5000, null=False)
     rating = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
-    book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True)
+    # indexed by comment_book_updated_idx and unique_book_commenter
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True, db_index=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
@@ -40,9 +64,77 @@ class Comment(models.Model):
     
     class Meta:
         ordering = ['-updated']
+        indexes = [
+            # a book's comments and a user's comments, newest first
+            models.Index(fields=['book', '-updated', '-id'], name='comment_book_updated_idx'),
+            models.Index(fields=['commenter', '-updated', '-id'], name='comment_commenter_updated_idx'),
+        ]
+        constraints = [
+            # a user can comment only once on a particular book
+            models.UniqueConstraint(fields=['book', 'commenter'], name='unique_book_commenter'),
+        ]
+
+
+
+
+
+def upload_expiry():
+    '''Function to get the time an upload that gets no more chunks expires'''
+
+    return timezone.now() + timedelta(seconds=settings.BOOK_UPLOAD_TTL)
+
+
+class BookUpload(models.Model):
+    '''Resumable upload of a book file, sent in chunks before the book is created'''
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    author = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255, null=False)
+    size = models.BigIntegerField(null=False)
+    # number of bytes received so far, the next chunk has to start here
+    offset = models.BigIntegerField(null=False, default=0)
+    # moved on by every chunk, expired uploads and their parts are removed by `manage.py remove_expired_uploads`
+    expires = models.DateTimeField(default=upload_expiry, db_index=True)
+    # set while a book is created from the upload, so it's only finalized once
+    finalizing = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.file_name} | {self.offset}/{self.size}'
+
+    @property
+    def part_path(self):
+        '''Path of the file the received chunks are written to'''
+        return os.path.join(settings.BOOK_UPLOAD_ROOT, f'{self.pk}.part')
 
+    @property
+    def is_complete(self):
+        return self.offset == self.size
 
 
+class MediaBlob(models.Model):
+    '''Stored file shared by every upload with the same content, see book.storage'''
+
+    name = models.CharField(max_length=255, primary_key=True)
+    # number of saves of this content not yet deleted
+    references = models.PositiveIntegerField(null=False, default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    # last time a save referenced the file
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} | {self.references}'
+
+
+class MediaRemoval(models.Model):
+    '''File of a deleted row, waiting for `manage.py remove_deleted_media` to drop its reference'''
+
+    name = models.CharField(max_length=255, null=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
 
 
 
@@ -1,9 +1,184 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination, CursorPagination, Cursor
+from rest_framework.settings import api_settings
+
+
+class KeysetPagination(CursorPagination):
+    '''
+        Cursor pagination keyed on (updated, id).
+
+        Each page is a single indexed range query on the models' `-updated`
+        ordering with `id` as a tie breaker, so page 10,000 costs the same as
+        page 1 and no COUNT(*) is run. The order can't follow search relevance
+        or `ordering`, so requests asking for either are rejected.
+    '''
+
+    page_size = 5
+    max_page_size = 10
+    page_size_query_param = 'size'
+    ordering = ('-updated', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, position, reverse = self.page_query(queryset, request)
+        return self.set_page(list(queryset[:self.page_size + 1]), position, reverse)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        '''paginate_queryset() for async views, reading the page with the async ORM'''
+
+        queryset, position, reverse = self.page_query(queryset, request)
+        return self.set_page([row async for row in queryset[:self.page_size + 1]], position, reverse)
+
+    def page_query(self, queryset, request):
+        '''Function to get the rows of the requested page and after it in order, with the cursor position'''
+
+        self.request = request
+
+        if any(request.query_params.get(param) for param in (api_settings.SEARCH_PARAM, api_settings.ORDERING_PARAM)):
+            raise ValidationError({'message': f'{self.cursor_query_param} cannot be combined with {api_settings.SEARCH_PARAM} or {api_settings.ORDERING_PARAM}, use page numbers instead'})
+
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+
+        position = self.decode_position(self.cursor)
+        reverse = position is not None and self.cursor.reverse
+
+        if reverse:
+            queryset = queryset.order_by('updated', 'id')
+        else:
+            queryset = queryset.order_by('-updated', '-id')
+
+        if position is not None:
+            updated, pk = position
+
+            # range on the leading index column first, then break ties on id
+            if reverse:
+                queryset = queryset.filter(Q(updated__gte=updated), Q(updated__gt=updated) | Q(id__gt=pk))
+            else:
+                queryset = queryset.filter(Q(updated__lte=updated), Q(updated__lt=updated) | Q(id__lt=pk))
+
+        return queryset, position, reverse
+
+    def set_page(self, results, position, reverse):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        return self.page
+
+    def decode_position(self, cursor):
+        '''Function to get the (updated, id) pair stored in a cursor'''
+
+        if cursor is None or cursor.position is None:
+            return None
+
+        try:
+            updated, pk = cursor.position.rsplit('|', 1)
+            updated = parse_datetime(updated)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if updated is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return updated, pk
+
+    def encode_position(self, instance):
+        # pages of list views can be values() rows, see book.rows
+        if isinstance(instance, dict):
+            return f'{instance["updated"].isoformat()}|{instance["id"]}'
+
+        return f'{instance.updated.isoformat()}|{instance.pk}'
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        cursor = Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1]))
+        return self.encode_cursor(cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+
+        cursor = Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0]))
+        return self.encode_cursor(cursor)
+
 
 class DefaultPagination(PageNumberPagination):
-    '''Custom default pagination class'''
+    '''
+        Custom default pagination class.
+
+        Clients opt in to keyset pagination by sending a `cursor` query
+        parameter (empty for the first page), otherwise pages are numbered.
+    '''
 
     page_size = 5
     page_query_param = 'page'
     max_page_size = 10
     page_size_query_param = 'size'
+    cursor_query_param = 'cursor'
+    keyset_pagination_class = KeysetPagination
+
+    def is_keyset(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_keyset(request):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        '''paginate_queryset() for async views, counting and reading the page with the async ORM'''
+
+        if self.is_keyset(request):
+            self.keyset = self.keyset_pagination_class()
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+
+        self.keyset = None
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator would count synchronously the first time it needs the count
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        self.page.object_list = [row async for row in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+
+        self.request = request
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.keyset is not None:
+            return self.keyset.to_html()
+        return super().to_html()
@@ -0,0 +1,134 @@
+from decimal import Decimal
+
+from django.db.models import Case, When, F, Q, Value, Count, Sum, DecimalField, ExpressionWrapper, FloatField, IntegerField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Book, Comment
+
+# Book field counting the ratings of each star value
+STAR_FIELDS = {
+    1: 'one_star_ratings',
+    2: 'two_star_ratings',
+    3: 'three_star_ratings',
+    4: 'four_star_ratings',
+    5: 'five_star_ratings',
+}
+
+# every Book field maintained from its comments
+COUNTER_FIELDS = ['no_of_comments', 'no_of_ratings', 'ratings_sum', 'average_rating'] + list(STAR_FIELDS.values())
+
+
+def average_rating(total, count):
+    '''
+        Function to get the average of `count` ratings adding up to `total`,
+        rounded half up to hundredths. Whole numbers of hundredths are
+        computed exactly, so the database and Python always agree, see
+        _average().
+    '''
+
+    if not count:
+        return Decimal(0)
+
+    return Decimal((total * 200 + count) // (count * 2)).scaleb(-2)
+
+
+def _average(total, count):
+    '''average_rating() of two integer expressions, computed in the database'''
+
+    # integer division truncates, which is flooring for these positive numbers
+    hundredths = ExpressionWrapper((total * 200 + count) / (count * 2), output_field=IntegerField())
+    return Cast(Cast(hundredths, FloatField()) / 100, DecimalField(max_digits=3, decimal_places=2))
+
+
+def _apply(book_id, comments=0, added=None, removed=None):
+    '''
+        Function to move ratings in or out of a book's aggregates.
+
+        Runs a single UPDATE that increments the counters in the database, so
+        concurrent comment writes on a book never overwrite each other.
+        Every right hand side reads the row's values from before the update.
+    '''
+
+    count_delta = 0
+    sum_delta = 0
+    changes = {}
+
+    if added is not None:
+        count_delta += 1
+        sum_delta += added
+        changes[STAR_FIELDS[added]] = F(STAR_FIELDS[added]) + 1
+
+    if removed is not None:
+        count_delta -= 1
+        sum_delta -= removed
+        changes[STAR_FIELDS[removed]] = F(STAR_FIELDS[removed]) - 1
+
+    if added is not None and added == removed:
+        del changes[STAR_FIELDS[added]]
+
+    new_count = F('no_of_ratings') + count_delta
+    new_sum = F('ratings_sum') + sum_delta
+
+    # the average of no ratings is 0
+    average = Case(
+        When(no_of_ratings=-count_delta, then=Value(0)),
+        default=_average(new_sum, new_count),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+    return Book.objects.filter(pk=book_id).update(
+        no_of_comments=F('no_of_comments') + comments,
+        no_of_ratings=new_count,
+        ratings_sum=new_sum,
+        average_rating=average,
+        updated=timezone.now(),
+        **changes
+    )
+
+
+def add_rating(book_id, rating):
+    '''Function to count a new comment and its rating'''
+
+    return _apply(book_id, comments=1, added=rating)
+
+
+def change_rating(book_id, old_rating, new_rating):
+    '''Function to replace a comment's rating'''
+
+    return _apply(book_id, added=new_rating, removed=old_rating)
+
+
+def remove_rating(book_id, rating):
+    '''Function to uncount a deleted comment and its rating'''
+
+    return _apply(book_id, comments=-1, removed=rating)
+
+
+def expected_counters(book_ids):
+    '''
+        Function to compute the counters of several books from their comments
+        with a single grouped query
+    '''
+
+    stars = {field: Count('id', filter=Q(rating=star)) for star, field in STAR_FIELDS.items()}
+    rows = (
+        Comment.objects.filter(book__in=book_ids)
+        .values('book')
+        .annotate(count=Count('id'), total=Sum('rating'), **stars)
+        .order_by()
+    )
+
+    # books without comments have all counters at 0
+    counters = {pk: dict.fromkeys(COUNTER_FIELDS, 0) for pk in book_ids}
+
+    for row in rows:
+        counters[row['book']] = {
+            'no_of_comments': row['count'],
+            'no_of_ratings': row['count'],
+            'ratings_sum': row['total'],
+            'average_rating': average_rating(row['total'], row['count']),
+            **{field: row[field] for field in STAR_FIELDS.values()},
+        }
+
+    return counters
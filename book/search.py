@@ -0,0 +1,146 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from rest_framework import filters
+
+from .models import Book
+
+User = get_user_model()
+
+# name of the search index table created by migration 0014
+SEARCH_TABLE = 'book_search'
+
+# relative weight of each indexed column: title, author name, description
+SQLITE_WEIGHTS = '10.0, 5.0, 1.0'
+
+
+def is_supported():
+    '''Function to check if the database has a full-text search index'''
+
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def _reindex(where, params):
+    '''Function to rebuild the search rows of every book matching `where`'''
+
+    if not is_supported():
+        return
+
+    book_table = Book._meta.db_table
+    user_table = User._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN (SELECT b.id FROM {book_table} b WHERE {where})',
+                params
+            )
+            cursor.execute(
+                f'''INSERT INTO {SEARCH_TABLE} (rowid, title, author_name, description)
+                SELECT b.id, b.title, coalesce(u.first_name || ' ' || u.last_name, ''), b.description
+                FROM {book_table} b LEFT JOIN {user_table} u ON u.id = b.author_id
+                WHERE {where}''',
+                params
+            )
+        else:
+            cursor.execute(
+                f'''INSERT INTO {SEARCH_TABLE} (book_id, document)
+                SELECT b.id,
+                    setweight(to_tsvector('english', b.title), 'A') ||
+                    setweight(to_tsvector('english', coalesce(u.first_name || ' ' || u.last_name, '')), 'B') ||
+                    setweight(to_tsvector('english', b.description), 'C')
+                FROM {book_table} b LEFT JOIN {user_table} u ON u.id = b.author_id
+                WHERE {where}
+                ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document''',
+                params
+            )
+
+
+def index_books(book_ids, batch_size=500):
+    '''Function to add or refresh books in the search index'''
+
+    book_ids = list(book_ids)
+
+    for start in range(0, len(book_ids), batch_size):
+        batch = book_ids[start:start + batch_size]
+        placeholders = ', '.join(['%s'] * len(batch))
+        _reindex(f'b.id IN ({placeholders})', batch)
+
+
+def index_author_books(author_id):
+    '''Function to refresh every book of an author, e.g. after a name change'''
+
+    _reindex('b.author_id = %s', [author_id])
+
+
+def remove_books(book_ids, batch_size=500):
+    '''Function to drop deleted books from the search index'''
+
+    if not is_supported():
+        return
+
+    book_ids = list(book_ids)
+    column = 'rowid' if connection.vendor == 'sqlite' else 'book_id'
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(book_ids), batch_size):
+            batch = book_ids[start:start + batch_size]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE {column} IN ({placeholders})', batch)
+
+
+def search(queryset, terms):
+    '''
+        Function to filter a book queryset down to the books matching all
+        search terms, best match first
+    '''
+
+    book_table = Book._meta.db_table
+
+    if connection.vendor == 'sqlite':
+        # quote every term so user input can't use FTS5 query syntax,
+        # and prefix match the last one for search-as-you-type
+        quoted = ['"{}"'.format(term.replace('"', '""')) for term in terms]
+        query = ' '.join(quoted) + '*'
+
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[f'{SEARCH_TABLE}.rowid = {book_table}.id', f'{SEARCH_TABLE} MATCH %s'],
+            params=[query],
+            select={'search_rank': f'bm25({SEARCH_TABLE}, {SQLITE_WEIGHTS})'},
+            order_by=['search_rank'],
+        )
+
+    query = ' '.join(terms)
+
+    return queryset.extra(
+        tables=[SEARCH_TABLE],
+        where=[
+            f'{SEARCH_TABLE}.book_id = {book_table}.id',
+            f"{SEARCH_TABLE}.document @@ websearch_to_tsquery('english', %s)",
+        ],
+        params=[query],
+        select={'search_rank': f"ts_rank({SEARCH_TABLE}.document, websearch_to_tsquery('english', %s))"},
+        select_params=[query],
+        order_by=['-search_rank'],
+    )
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    '''
+        Search filter backed by the book search index.
+
+        Matches the `search` terms against title, author name and description
+        and orders the results by relevance. Databases without a search index
+        fall back to the view's `search_fields`.
+    '''
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+
+        if not terms:
+            return queryset
+        elif not is_supported():
+            return super().filter_queryset(request, queryset, view)
+
+        return search(queryset, terms)
@@ -1,27 +1,61 @@
+import os
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 
 from rest_framework import serializers
 from rest_framework.exceptions import NotFound
 
-from .models import Book, Comment
+from booktopia.media import SignedMediaSerializerMixin, sign_url
+
+from . import covers, ratings, uploads
+from .fieldsets import SparseFieldsSerializerMixin
+from .models import Book, BookUpload, Comment
 
 # user model
 User = get_user_model()
 
-class AddBookSerializer(serializers.ModelSerializer):
+
+# shared by the method fields and the row builders of list views, see book.rows
+
+def represent_book_label(title, author_email):
+    '''Function to get how comments show their book'''
+
+    return f'{title} by {author_email}'
+
+
+def represent_book_file(name, request):
+    '''
+        Function to get how books show their file, a signed URL sent to
+        signed in users only like bookDownload/, the catalog is open to all
+    '''
+
+    if not name or (request is not None and not request.user.is_authenticated):
+        return None
+
+    url = sign_url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+class AddBookSerializer(SignedMediaSerializerMixin, serializers.ModelSerializer):
     '''
         Serializer for authors to add their books
     '''
 
     author = serializers.SerializerMethodField()
+    cover_renditions = serializers.SerializerMethodField()
 
     def get_author(self, obj):
         return obj.author.email
 
+    def get_cover_renditions(self, obj):
+        return covers.represent_renditions(obj.cover_renditions, self.context.get('request'))
+
     class Meta:
         model = Book
         fields = '__all__'
-        read_only_fields = ['created', 'updated']
+        read_only_fields = ['created', 'updated'] + ratings.COUNTER_FIELDS
 
     def validate(self, data):
         '''Function to validate user input'''
@@ -57,19 +91,72 @@ class AddBookSerializer(serializers.ModelSerializer):
         return new_book
 
 
-class BookDetailsSerializer(serializers.ModelSerializer):
+class BookUploadSerializer(serializers.ModelSerializer):
+    '''
+        Serializer for authors to start a chunked upload of a book file
+    '''
+
+    class Meta:
+        model = BookUpload
+        fields = ['id', 'file_name', 'size', 'offset', 'created', 'updated']
+        read_only_fields = ['id', 'offset', 'created', 'updated']
+
+    def validate(self, data):
+        '''Function to validate user input'''
+
+        if os.path.basename(data['file_name']) != data['file_name'] or data['file_name'] in ('.', '..'):
+            raise serializers.ValidationError({'message': 'File name cannot contain a path'})
+        elif data['size'] <= 0:
+            raise serializers.ValidationError({'message': 'File cannot be empty'})
+        elif data['size'] > settings.BOOK_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError({'message': f'File cannot be larger than {settings.BOOK_UPLOAD_MAX_SIZE} bytes'})
+        elif uploads.open_uploads(self.context['request'].user).count() >= settings.BOOK_UPLOAD_MAX_OPEN:
+            raise serializers.ValidationError({'message': f'You can have at most {settings.BOOK_UPLOAD_MAX_OPEN} unfinished uploads, finish or cancel one first'})
+
+        return data
+
+    def create(self, validated_data):
+        '''Function to create an upload and its empty part file'''
+
+        upload = BookUpload(
+            file_name=validated_data.get('file_name'),
+            size=validated_data.get('size'),
+            author=self.context['request'].user
+        )
+
+        upload.save()
+        uploads.create_part(upload)
+        return upload
+
+
+class BookDetailsSerializer(SparseFieldsSerializerMixin, SignedMediaSerializerMixin, serializers.ModelSerializer):
     '''
         Serializer to update book details
     '''
 
+    cover_renditions = serializers.SerializerMethodField()
+
+    # columns and builders of the fields list views represent from values() rows, see book.rows
+    row_fields = {
+        'author': (['author__email'], lambda row, request: row['author__email']),
+        'book_file': (['book_file'], lambda row, request: represent_book_file(row['book_file'], request)),
+        'cover_renditions': (['cover_renditions'], lambda row, request: covers.represent_renditions(row['cover_renditions'], request)),
+    }
+
+    def get_cover_renditions(self, obj):
+        return covers.represent_renditions(obj.cover_renditions, self.context.get('request'))
+
     class Meta:
         model = Book
         fields = '__all__'
-        read_only_fields = ['created', 'updated']
+        read_only_fields = ['created', 'updated'] + ratings.COUNTER_FIELDS
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['author'] = instance.author.email
+        if 'author' in self.fields:
+            representation['author'] = instance.author.email
+        if 'book_file' in self.fields:
+            representation['book_file'] = represent_book_file(instance.book_file.name, self.context.get('request'))
         return representation
     
     def validate(self, data):
@@ -99,11 +186,17 @@ class CommentSerializer(serializers.ModelSerializer):
     commenter = serializers.SerializerMethodField(read_only=True)
     book = serializers.SerializerMethodField(read_only=True)
 
+    # columns and builders of the fields list views represent from values() rows, see book.rows
+    row_fields = {
+        'commenter': (['commenter__email'], lambda row, request: row['commenter__email']),
+        'book': (['book__title', 'book__author__email'], lambda row, request: represent_book_label(row['book__title'], row['book__author__email'])),
+    }
+
     def get_commenter(self, obj):
         return obj.commenter.email
     
     def get_book(self, obj):
-        return f'{obj.book.title} by {obj.book.author.email}'
+        return represent_book_label(obj.book.title, obj.book.author.email)
 
     class Meta:
         model = Comment
@@ -125,12 +218,6 @@ class CommentSerializer(serializers.ModelSerializer):
         comment_author = self.context['request'].user
         book_obj = Book.objects.get(pk=pk)
 
-        # check if a user has already made a comment on a book
-        comment_queryset = Comment.objects.filter(book=book_obj, commenter=comment_author)
-
-        if comment_queryset.exists():
-            raise serializers.ValidationError({'message': 'You are allowed to comment only once on a particulr book.'})
-        
         # create new comment object
         comment = Comment(
             comment=comment_content,
@@ -139,26 +226,14 @@ class CommentSerializer(serializers.ModelSerializer):
             commenter=comment_author
         )
 
-        comment.save()
-
-        # update number of comments
-        book_obj.no_of_comments += 1
-
-        if book_obj.no_of_ratings == 0:
-            # update the number of ratings and average rating value in book model
-            book_obj.no_of_ratings += 1
-            book_obj.average_rating = rating
-        elif book_obj.no_of_ratings > 0:
-            # get sum of all existing ratings
-            existing_ratings_sum = book_obj.average_rating * book_obj.no_of_ratings
-            
-            # update number of ratings -- increment by 1
-            book_obj.no_of_ratings += 1
-
-            # update average rating
-            book_obj.average_rating = (existing_ratings_sum + rating) / book_obj.no_of_ratings
-
-        book_obj.save()
+        # the unique_book_commenter constraint rejects a second comment by a user on a book
+        try:
+            with transaction.atomic():
+                comment.save()
+                # update number of comments, ratings and average rating of the book
+                ratings.add_rating(book_obj.pk, rating)
+        except IntegrityError:
+            raise serializers.ValidationError({'message': 'You are allowed to comment only once on a particulr book.'})
 
         return comment
     
@@ -171,12 +246,12 @@ class CommentDetailsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
-        read_only_fields = ['created', 'updated']
+        read_only_fields = ['book', 'commenter', 'created', 'updated']
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation['commenter'] = instance.commenter.email
-        representation['book'] = f'{instance.book.title} by {instance.book.author.email}'
+        representation['book'] = represent_book_label(instance.book.title, instance.book.author.email)
         return representation
 
     def validate(self, data):
@@ -186,36 +261,19 @@ class CommentDetailsSerializer(serializers.ModelSerializer):
         return data
 
     def update(self, instance, validated_data):
-        for key, value in validated_data.items():
-            setattr(instance, key, value)
+        with transaction.atomic():
+            # lock the comment so its current rating can't change under us
+            current_rating = Comment.objects.select_for_update().values_list('rating', flat=True).get(pk=instance.pk)
 
-        pk = self.context['view'].kwargs.get('pk')
+            for key, value in validated_data.items():
+                setattr(instance, key, value)
 
-        comment = Comment.objects.get(pk=pk)
-        book_obj = comment.book
+            instance.save()
 
-        # get existing sum of all ratings
-        existing_ratings_sum = book_obj.average_rating * book_obj.no_of_ratings
+            # move the book's aggregates from the current to the updated rating
+            updated_rating = validated_data.get('rating', current_rating)
 
-        # get current rating
-        current_rating = comment.rating
+            if updated_rating != current_rating:
+                ratings.change_rating(instance.book_id, current_rating, updated_rating)
 
-        # subtract current rating from existing sum of ratings
-        subtracted_ratings_sum = existing_ratings_sum - current_rating
-
-        # get updated rating from validated data
-        updated_rating = validated_data.get('rating')
-
-        # get new rating sum
-        new_ratings_sum = subtracted_ratings_sum + updated_rating
-
-        # FOR DEBUGGING PORPOSES
-        print(f'Current rating = {current_rating}')
-        print(f'Updated rating = {updated_rating}')
-        print(f'New ratings sum = {new_ratings_sum}')
-
-        book_obj.average_rating = new_ratings_sum / book_obj.no_of_ratings
-        book_obj.save()
-
-        instance.save()
         return instance    
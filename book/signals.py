@@ -0,0 +1,160 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from booktopia.batches import CommitBatch
+
+from . import cache, cleanup, covers, search
+from .models import Book, Comment
+
+User = get_user_model()
+
+# book fields stored in the search index
+SEARCH_FIELDS = {'title', 'description', 'author'}
+
+# deleted books leave the search index once their delete commits, together within a batched() block
+unindexed_books = CommitBatch(search.remove_books)
+
+# books whose responses are invalidated together once a delete of them, or their comments, commits
+deleted_books = CommitBatch(lambda book_ids: cache.invalidate_books(set(book_ids)))
+
+
+def stored_values(sender, instance, fields, raw=False, update_fields=None):
+    '''
+        Function to get the stored values of the fields a save may change, in
+        one query, or an empty dict for new rows and saves of other fields
+    '''
+
+    if update_fields is not None:
+        fields = [field for field in fields if field in update_fields]
+
+    if raw or instance.pk is None or not fields:
+        return {}
+
+    return sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+
+
+def replaced_files(instance, stored, field_names):
+    '''Function to get the stored files of the file fields a save points elsewhere'''
+
+    return [stored[name] for name in field_names if name in stored and stored[name] != getattr(instance, name).name]
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, update_fields=None, **kwargs):
+    '''Keep the search index in sync with the book'''
+
+    # saves that only touch counters don't change the indexed text
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+
+    search.index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    unindexed_books.add([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def queue_book_files(sender, instance, **kwargs):
+    cleanup.queue_removals(cleanup.book_files(instance))
+
+
+@receiver(pre_save, sender=Book)
+def find_replaced_book_files(sender, instance, raw=False, update_fields=None, **kwargs):
+    '''Files a book stops pointing at lose their reference once the save commits, see queue_replaced_files()'''
+
+    fields = ['book_file', 'book_cover_picture']
+    if update_fields is None or 'book_cover_picture' in update_fields:
+        fields.append('cover_renditions')
+
+    stored = stored_values(sender, instance, fields, raw, update_fields)
+    names = replaced_files(instance, stored, ['book_file', 'book_cover_picture'])
+
+    # renditions of the previous cover go with it
+    previous_cover = stored.get('book_cover_picture')
+    if previous_cover in names and stored['cover_renditions'].get('source') == previous_cover:
+        names += cleanup.rendered_cover_files(stored['cover_renditions'])[1:]
+
+    instance._replaced_files = names
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=User)
+def queue_replaced_files(sender, instance, **kwargs):
+    cleanup.queue_removals(instance.__dict__.pop('_replaced_files', []))
+
+
+@receiver(post_delete, sender=User)
+def queue_profile_pic(sender, instance, **kwargs):
+    cleanup.queue_removals([instance.profile_pic.name])
+
+
+@receiver(post_save, sender=User)
+def index_author_books(sender, instance, created=False, update_fields=None, **kwargs):
+    '''Authors' names are indexed with their books'''
+
+    if created:
+        return
+    elif update_fields is not None and not {'first_name', 'last_name'}.intersection(update_fields):
+        return
+
+    search.index_author_books(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def render_book_cover(sender, instance, update_fields=None, **kwargs):
+    '''Covers are rendered again whenever they change'''
+
+    if update_fields is not None and 'book_cover_picture' not in update_fields:
+        return
+
+    # the previous cover and its renditions were queued by queue_replaced_files()
+    if covers.needs_renditions(instance):
+        covers.schedule_renditions(instance)
+
+
+@receiver(post_save, sender=Book)
+def invalidate_book_responses(sender, instance, **kwargs):
+    cache.invalidate_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def invalidate_deleted_book_responses(sender, instance, **kwargs):
+    deleted_books.add([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_commented_book_responses(sender, instance, signal=None, **kwargs):
+    '''Comments change the counters and average rating of their book'''
+
+    if instance.book_id is None:
+        return
+    elif signal is post_delete:
+        deleted_books.add([instance.book_id])
+    else:
+        cache.invalidate_books([instance.book_id])
+
+
+@receiver(pre_save, sender=User)
+def compare_stored_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    '''A replaced profile picture loses its reference, a new email is seen by invalidate_author_book_responses()'''
+
+    stored = stored_values(sender, instance, ['email', 'profile_pic'], raw, update_fields)
+
+    instance._previous_email = stored.get('email')
+    instance._replaced_files = replaced_files(instance, stored, ['profile_pic'])
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_book_responses(sender, instance, created=False, **kwargs):
+    '''Book responses show their author's email, other saves, e.g. of last_login, leave them alone'''
+
+    previous_email = instance.__dict__.pop('_previous_email', None)
+    if created or previous_email is None or previous_email == instance.email:
+        return
+
+    book_ids = list(Book.objects.filter(author=instance).values_list('pk', flat=True))
+    if book_ids:
+        cache.invalidate_books(book_ids)
@@ -0,0 +1,221 @@
+'''
+Content-addressed media storage.
+
+Files are named by the SHA-256 of their content under the directory their
+field uploads to, sharded by the first characters of the digest, e.g.
+books/3f/a9/3fa9...c2.pdf. Identical uploads end up in the same file, which
+counts its references in MediaBlob and is removed with the last one.
+'''
+
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+BLOB_NAME = re.compile(r'(^|/)([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(\.[^/]*)?$')
+
+
+def is_content_addressed(name):
+    return BLOB_NAME.search(name or '') is not None
+
+
+class StagedFile(File):
+    '''Copy of saved content written next to the blobs, linked into place by ContentAddressedStorage._save()'''
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''FileSystemStorage that stores each distinct content once, under a name derived from it'''
+
+    # number of directory levels, and hex characters per level, blobs are spread over
+    shard_depth = 2
+    shard_width = 2
+
+    def content_hash(self, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def blob_name(self, name, digest):
+        '''Function to get the sharded name of the content with this digest, in the directory of `name`'''
+
+        directory, file_name = os.path.split(name)
+        extension = os.path.splitext(file_name)[1].lower()
+        shards = [digest[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+        return '/'.join(filter(None, [directory, *shards, digest + extension]))
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        # the content is hashed and copied before the transaction, which only links it into place
+        staged, digest = self.stage(content)
+
+        try:
+            return self.reference_blob(self.blob_name(name, digest), staged)
+        finally:
+            if staged is not content:
+                staged.close()
+                self.remove_staged(staged.temporary_file_path())
+
+    def stage(self, content):
+        '''
+            Function to get the digest of content, and a file of it on this
+            storage's filesystem that reference_blob() can link into place.
+        '''
+
+        if hasattr(content, 'temporary_file_path') and self.is_on_filesystem(content.temporary_file_path()):
+            return content, self.content_hash(content)
+
+        os.makedirs(self.location, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=self.location, prefix='.blob-')
+        digest = hashlib.sha256()
+
+        try:
+            with os.fdopen(fd, 'wb') as temporary_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary_file.write(chunk)
+        except BaseException:
+            self.remove_staged(temporary_path)
+            raise
+
+        return StagedFile(open(temporary_path, 'rb'), content.name), digest.hexdigest()
+
+    def is_on_filesystem(self, path):
+        os.makedirs(self.location, exist_ok=True)
+        return os.stat(path).st_dev == os.stat(self.location).st_dev
+
+    def remove_staged(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # linked into place, and removed, by _save()
+            pass
+
+    def write_blob(self, name, content):
+        '''
+            Function to write a file under its content-addressed name without
+            referencing it, the slow part of a save that can run on any thread.
+            reference_blob() has to be called with the returned name before the
+            file is used.
+        '''
+
+        name = self.blob_name(name, self.content_hash(content))
+
+        if not self.exists(name):
+            self._save(name, content)
+
+        return name
+
+    def reference_blob(self, name, content, count=1):
+        '''Function to count `count` references to the blob `name` of content, writing its file if it's missing'''
+
+        from .models import MediaBlob
+
+        # the blob's row is locked while its file is checked and linked, so a
+        # delete of its last reference can't remove the file under this save
+        with transaction.atomic():
+            blob, _ = MediaBlob.objects.select_for_update().get_or_create(name=name)
+            MediaBlob.objects.filter(pk=blob.pk).update(references=F('references') + count, updated=timezone.now())
+
+            if not self.exists(name):
+                self._save(name, content)
+
+        return name
+
+    def _save(self, name, content):
+        '''
+            Function to write a blob's file.
+
+            The file is written next to its final name and linked into place,
+            so readers never see a partly written blob, and files that already
+            are on disk (chunked uploads) are linked instead of copied.
+        '''
+
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            try:
+                self.link(content.temporary_file_path(), full_path)
+                os.remove(content.temporary_file_path())
+                return name
+            except OSError:
+                # another filesystem, copy the file instead
+                pass
+
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.blob-')
+
+        try:
+            with os.fdopen(fd, 'wb') as temporary_file:
+                for chunk in content.chunks():
+                    temporary_file.write(chunk)
+
+            self.link(temporary_path, full_path)
+        finally:
+            os.remove(temporary_path)
+
+        return name
+
+    def link(self, source, destination):
+        try:
+            os.link(source, destination)
+        except FileExistsError:
+            # the same content was written by another save in the meantime
+            return
+
+        if self.file_permissions_mode is not None:
+            os.chmod(destination, self.file_permissions_mode)
+
+    def delete(self, name):
+        '''Function to drop a reference to a file, which is removed with its last reference'''
+
+        self.drop_reference(name)
+
+    def drop_reference(self, name, keep_file=False):
+        '''Function to drop a reference to a file, keep_file keeps it even if that was the last one'''
+
+        if not is_content_addressed(name):
+            if not keep_file:
+                super().delete(name)
+            return
+
+        from .models import MediaBlob
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+
+            if blob is not None and blob.references > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(references=F('references') - 1)
+            elif not keep_file:
+                super().delete(name)
+                MediaBlob.objects.filter(name=name).delete()
+
+    def add_references(self, name, count=1):
+        '''Function to count more rows pointing at a file that was saved once for all of them'''
+
+        from .models import MediaBlob
+
+        MediaBlob.objects.filter(name=name).update(references=F('references') + count, updated=timezone.now())
+
+    def purge(self, name):
+        '''Function to remove a file whatever its references, for files no row refers to anymore'''
+
+        from .models import MediaBlob
+
+        super().delete(name)
+        MediaBlob.objects.filter(name=name).delete()
@@ -1,3 +1,1690 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import gzip
+import time
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+from booktopia import compression, renderers
+from booktopia.batches import batched
+from booktopia.media import signature
+from rest_framework.test import APITestCase
+
+from . import ratings, uploads, views
+from .cache import get_cache
+from .models import Book, BookUpload, Comment, MediaBlob, MediaRemoval
+
+User = get_user_model()
+
+# Maximum number of queries each list endpoint may run for a full page once
+# the token is in the authentication cache, including the ETag/Last-Modified
+# validator query.
+QUERY_BUDGETS = {
+    'book:allBooks': 3,
+    # one more to load the author's role, cached tokens only hold their user's id
+    'book:authorBooks': 4,
+    'book:bookComments': 3,
+    'book:userComments': 3,
+}
+
+
+class BookTestMixin:
+    '''Helpers to create users, books and comments for tests'''
+
+    def create_user(self, email, role=User.USER):
+        user = User.objects.create(email=email, password='pass1234word', first_name='Test', last_name='User', role=role)
+        Token.objects.create(user=user)
+        return user
+
+    def create_book(self, author, title='Test book'):
+        return Book.objects.create(title=title, description='A book used in tests', book_file='books/test.pdf', author=author)
+
+    def create_comment(self, book, commenter, rating=4):
+        return Comment.objects.create(book=book, commenter=commenter, comment='Nice book', rating=rating)
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.auth_token.key}')
+
+
+class QueryBudgetTests(BookTestMixin, APITestCase):
+    '''
+        Every list endpoint must load a page in a fixed number of queries,
+        no matter how many rows (and related authors/commenters) are on it.
+    '''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.book = self.create_book(self.author)
+
+    def add_rows(self, count):
+        for i in range(count):
+            author = self.create_user(f'author{Book.objects.count()}@example.com', role=User.AUTHOR)
+            self.create_book(author, title=f'Book number {i}')
+            self.create_book(self.author, title=f'Own book {i}')
+
+            commenter = self.create_user(f'reader{Comment.objects.count()}@example.com')
+            self.create_comment(self.book, commenter)
+
+            book = self.create_book(author, title=f'Commented book {i}')
+            self.create_comment(book, self.reader)
+
+    def assert_within_budget(self, url_name, user, **kwargs):
+        url = reverse(url_name, kwargs=kwargs or None)
+        self.login(user)
+        # the first request looks the token up
+        self.client.get(url)
+
+        counts = []
+        for rows in (1, 4):
+            self.add_rows(rows)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(context.captured_queries))
+
+        budget = QUERY_BUDGETS[url_name]
+        self.assertLessEqual(max(counts), budget, f'{url_name} ran {max(counts)} queries, budget is {budget}')
+        self.assertEqual(counts[0], counts[1], f'{url_name} query count grows with the number of rows: {counts}')
+
+    def test_all_books_budget(self):
+        self.assert_within_budget('book:allBooks', self.reader)
+
+    def test_author_books_budget(self):
+        self.assert_within_budget('book:authorBooks', self.author)
+
+    def test_book_comments_budget(self):
+        self.assert_within_budget('book:bookComments', self.reader, pk=self.book.pk)
+
+    def test_user_comments_budget(self):
+        self.assert_within_budget('book:userComments', self.reader)
+
+
+class ListPaginationTests(BookTestMixin, APITestCase):
+    '''List views that override list() still page their results'''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.book = self.create_book(self.author)
+
+    def test_book_comments_are_paged(self):
+        for i in range(7):
+            self.create_comment(self.book, self.create_user(f'reader{i}@example.com'))
+        self.login(self.reader)
+
+        response = self.client.get(reverse('book:bookComments', kwargs={'pk': self.book.pk}), {'size': 3})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_author_books_are_paged(self):
+        for i in range(6):
+            self.create_book(self.author, title=f'Own book {i}')
+        self.login(self.author)
+
+        response = self.client.get(reverse('book:authorBooks'), {'page': 2})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_empty_lists_keep_message(self):
+        self.login(self.reader)
+
+        response = self.client.get(reverse('book:userComments'))
+        self.assertIn('message', response.data)
+
+        response = self.client.get(reverse('book:bookComments', kwargs={'pk': self.book.pk}))
+        self.assertIn('message', response.data)
+
+
+class KeysetPaginationTests(BookTestMixin, APITestCase):
+    '''Clients that send `cursor` get keyset pages ordered by (updated, id)'''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.books = [self.create_book(self.author, title=f'Book number {i}') for i in range(12)]
+
+        # give some books the same timestamp so ties are broken on id
+        Book.objects.filter(pk__in=[book.pk for book in self.books[:4]]).update(updated=self.books[0].updated)
+        self.expected = list(Book.objects.order_by('-updated', '-id').values_list('pk', flat=True))
+
+    def test_cursor_walks_whole_catalog_without_count(self):
+        url = reverse('book:allBooks') + '?cursor='
+        seen = []
+
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in context.captured_queries))
+
+            seen += [book['id'] for book in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get(reverse('book:allBooks'), {'cursor': '', 'size': 4}).data
+        second = self.client.get(first['next']).data
+        previous = self.client.get(second['previous']).data
+
+        self.assertIsNone(first['previous'])
+        self.assertEqual([book['id'] for book in previous['results']], [book['id'] for book in first['results']])
+
+    def test_page_number_pagination_is_still_default(self):
+        response = self.client.get(reverse('book:allBooks'))
+        self.assertEqual(response.data['count'], 12)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('book:allBooks'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_rejects_search_and_ordering(self):
+        for params in ({'search': 'number'}, {'ordering': 'created'}):
+            response = self.client.get(reverse('book:allBooks'), {'cursor': '', **params})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('message', response.data)
+
+            # page numbers keep both
+            self.assertEqual(self.client.get(reverse('book:allBooks'), params).status_code, 200)
+
+        # empty parameters don't change the order
+        response = self.client.get(reverse('book:allBooks'), {'cursor': '', 'search': '', 'ordering': ''})
+        self.assertEqual(response.status_code, 200)
+
+
+class FullTextSearchTests(BookTestMixin, APITestCase):
+    '''Catalog search goes through the book search index'''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.other = self.create_user('other@example.com', role=User.AUTHOR)
+        self.dragons = Book.objects.create(title='Dragons of the north', description='An epic tale', book_file='books/a.pdf', author=self.author)
+        self.mention = Book.objects.create(title='Cooking at home', description='Recipes that even dragons would love', book_file='books/b.pdf', author=self.other)
+        self.unrelated = Book.objects.create(title='Gardening basics', description='Plants and soil', book_file='books/c.pdf', author=self.other)
+
+    def search(self, term, url_name='book:allBooks'):
+        response = self.client.get(reverse(url_name), {'search': term})
+        return [book['id'] for book in response.data['results']]
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search('dragons'), [self.dragons.pk, self.mention.pk])
+
+    def test_prefix_and_stemmed_match(self):
+        self.assertEqual(self.search('garden'), [self.unrelated.pk])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('"dragons OR AND*'), [])
+
+    def test_index_follows_book_changes(self):
+        self.unrelated.title = 'Dragon gardens'
+        self.unrelated.save()
+        self.assertIn(self.unrelated.pk, self.search('dragon'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dragons.delete()
+        self.assertNotIn(self.dragons.pk, self.search('dragon'))
+
+    def test_index_follows_author_changes(self):
+        self.other.first_name = 'Zanzibar'
+        self.other.save()
+        self.assertEqual(sorted(self.search('zanzibar')), sorted([self.mention.pk, self.unrelated.pk]))
+
+    def test_author_books_search(self):
+        self.login(self.other)
+        self.assertEqual(self.search('dragons', 'book:authorBooks'), [self.mention.pk])
+
+
+class AccessPathIndexTests(BookTestMixin, APITestCase):
+    '''The hot book and comment queries are served from an index, not a table scan'''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.book = self.create_book(self.author)
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # tiny test tables would otherwise always be scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor != 'sqlite':
+            self.skipTest(f'No query plan checks for {connection.vendor}')
+
+        return queryset.explain()
+
+    def assert_uses_index(self, queryset, index_name=None):
+        plan = self.explain(queryset)
+
+        self.assertIn('INDEX', plan.upper())
+        if index_name is not None:
+            self.assertIn(index_name, plan)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('SCAN', plan.replace('COVERING INDEX', ''))
+            self.assertNotIn('TEMP B-TREE', plan)
+        else:
+            self.assertNotIn('Seq Scan', plan)
+            self.assertNotIn('Sort', plan)
+
+    def test_comment_by_book_and_commenter(self):
+        # SQLite names the constraint's index itself
+        queryset = Comment.objects.filter(book=self.book, commenter=self.reader).order_by()
+        self.assert_uses_index(queryset)
+
+    def test_comments_of_book(self):
+        self.assert_uses_index(Comment.objects.filter(book=self.book.pk), 'comment_book_updated_idx')
+
+    def test_comments_of_user(self):
+        self.assert_uses_index(Comment.objects.filter(commenter=self.reader), 'comment_commenter_updated_idx')
+
+    def test_books_of_author(self):
+        self.assert_uses_index(Book.objects.filter(author=self.author), 'book_author_updated_idx')
+
+    def test_second_comment_is_rejected(self):
+        self.login(self.reader)
+        url = reverse('book:addComment', kwargs={'pk': self.book.pk})
+
+        response = self.client.post(url, {'comment': 'Great read', 'rating': 5})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(url, {'comment': 'Read it again', 'rating': 3})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.objects.filter(book=self.book).count(), 1)
+
+
+class RatingAggregateTests(BookTestMixin, APITestCase):
+    '''Comment writes keep the book's rating sum, histogram and average exact'''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.book = self.create_book(self.author)
+        self.readers = [self.create_user(f'reader{i}@example.com') for i in range(3)]
+
+    def comment(self, reader, rating):
+        self.login(reader)
+        response = self.client.post(reverse('book:addComment', kwargs={'pk': self.book.pk}), {'comment': 'Nice book', 'rating': rating})
+        self.assertEqual(response.status_code, 201)
+        return Comment.objects.get(book=self.book, commenter=reader)
+
+    def test_comment_writes_update_aggregates(self):
+        first = self.comment(self.readers[0], 5)
+        self.comment(self.readers[1], 4)
+        self.comment(self.readers[2], 4)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.no_of_comments, self.book.no_of_ratings, self.book.ratings_sum), (3, 3, 13))
+        self.assertEqual((self.book.four_star_ratings, self.book.five_star_ratings), (2, 1))
+        self.assertEqual(str(self.book.average_rating), '4.33')
+
+        self.login(self.readers[0])
+        response = self.client.put(reverse('book:commentDetails', kwargs={'pk': first.pk}), {'comment': 'Changed my mind', 'rating': 1})
+        self.assertEqual(response.status_code, 200)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.ratings_sum, self.book.one_star_ratings, self.book.five_star_ratings), (9, 1, 0))
+        self.assertEqual(str(self.book.average_rating), '3.00')
+
+        response = self.client.delete(reverse('book:commentDetails', kwargs={'pk': first.pk}))
+        self.assertEqual(response.status_code, 200)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.no_of_comments, self.book.no_of_ratings, self.book.ratings_sum), (2, 2, 8))
+        self.assertEqual(self.book.one_star_ratings, 0)
+        self.assertEqual(str(self.book.average_rating), '4.00')
+
+    def test_average_is_rounded_half_up_everywhere(self):
+        readers = [self.create_user(f'rater{i}@example.com') for i in range(8)]
+
+        # 17 / 8 is 2.125
+        for reader, rating in zip(readers, [3, 2, 2, 2, 2, 2, 2, 2]):
+            self.create_comment(self.book, reader, rating=rating)
+            ratings.add_rating(self.book.pk, rating)
+
+        self.book.refresh_from_db()
+        self.assertEqual(str(self.book.average_rating), '2.13')
+        self.assertEqual(ratings.expected_counters([self.book.pk])[self.book.pk]['average_rating'], self.book.average_rating)
+        self.assertEqual(ratings.average_rating(107, 40), Decimal('2.68'))
+
+    def test_removing_last_rating_resets_average(self):
+        comment = self.comment(self.readers[0], 3)
+
+        self.client.delete(reverse('book:commentDetails', kwargs={'pk': comment.pk}))
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.no_of_comments, self.book.no_of_ratings, self.book.ratings_sum), (0, 0, 0))
+        self.assertEqual(self.book.average_rating, 0)
+
+    def test_concurrent_delete_uncounts_once(self):
+        comment = self.comment(self.readers[0], 3)
+
+        # the other delete removed the row after this one read its rating
+        with mock.patch('django.db.models.query.QuerySet.delete', return_value=(0, {})):
+            response = self.client.delete(reverse('book:commentDetails', kwargs={'pk': comment.pk}))
+
+        self.assertEqual(response.status_code, 404)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.no_of_comments, self.book.no_of_ratings, self.book.ratings_sum), (1, 1, 3))
+
+    def test_counters_are_read_only(self):
+        self.login(self.author)
+        response = self.client.patch(
+            reverse('book:bookDetails', kwargs={'pk': self.book.pk}),
+            {'title': 'Test book', 'description': 'Still a test', 'average_rating': '5.00', 'ratings_sum': 100},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.average_rating, self.book.ratings_sum), (0, 0))
+
+
+class ReconcileBookCountersTests(BookTestMixin, APITestCase):
+    '''reconcile_book_counters rebuilds drifted counters in a fixed number of queries'''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.readers = [self.create_user(f'reader{i}@example.com') for i in range(3)]
+        self.books = [self.create_book(self.author, title=f'Book number {i}') for i in range(4)]
+
+        for reader in self.readers:
+            self.create_comment(self.books[0], reader, rating=5)
+        self.create_comment(self.books[1], self.readers[0], rating=2)
+
+        # counters written by the old code path, or never written at all
+        Book.objects.filter(pk=self.books[2].pk).update(no_of_comments=4, no_of_ratings=4, average_rating='3.50')
+
+    def reconcile(self, *args):
+        output = StringIO()
+        with CaptureQueriesContext(connection) as context:
+            call_command('reconcile_book_counters', *args, stdout=output)
+        return output.getvalue(), len(context.captured_queries)
+
+    def test_drifted_books_are_fixed(self):
+        output, _ = self.reconcile()
+        self.assertIn('fixed 3', output)
+
+        first, second, third, fourth = Book.objects.order_by('pk')
+        self.assertEqual((first.no_of_comments, first.ratings_sum, first.five_star_ratings, str(first.average_rating)), (3, 15, 3, '5.00'))
+        self.assertEqual((second.no_of_ratings, second.two_star_ratings, str(second.average_rating)), (1, 1, '2.00'))
+        self.assertEqual((third.no_of_comments, third.no_of_ratings, third.average_rating), (0, 0, 0))
+
+        output, _ = self.reconcile()
+        self.assertIn('fixed 0', output)
+
+    def test_dry_run_and_subset(self):
+        output, _ = self.reconcile('--dry-run', str(self.books[2].pk))
+        self.assertIn(f'Book {self.books[2].pk}: no_of_comments 4 -> 0', output)
+        self.assertIn('found 1', output)
+        self.assertEqual(Book.objects.get(pk=self.books[2].pk).no_of_comments, 4)
+
+    def test_rounded_averages_are_not_drift(self):
+        book = self.create_book(self.author, title='Rounded book')
+        raters = [self.create_user(f'rater{i}@example.com') for i in range(8)]
+
+        # 17 / 8 is 2.125, counted the way comment writes do
+        for rater, rating in zip(raters, [3, 2, 2, 2, 2, 2, 2, 2]):
+            self.create_comment(book, rater, rating=rating)
+            ratings.add_rating(book.pk, rating)
+
+        output, _ = self.reconcile('--dry-run', str(book.pk))
+        self.assertIn('found 0', output)
+
+    def test_queries_do_not_grow_with_books(self):
+        _, queries = self.reconcile('--batch-size', '10')
+
+        for i in range(10):
+            self.create_book(self.author, title=f'Extra book {i}')
+        Book.objects.update(no_of_comments=7)
+
+        _, more_queries = self.reconcile('--batch-size', '100')
+        self.assertLessEqual(more_queries, queries)
+
+
+class ResponseCacheTests(BookTestMixin, APITestCase):
+    '''Catalog and book detail responses are cached until a write invalidates them'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.book = self.create_book(self.author)
+        self.login(self.reader)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(context.captured_queries)
+
+    def test_catalog_hit_skips_queries(self):
+        first, _ = self.get(reverse('book:allBooks'))
+        second, queries = self.get(reverse('book:allBooks'))
+
+        # the token is cached too, only the validator query is left
+        self.assertEqual(queries, 1)
+        self.assertEqual(first.content, second.content)
+
+    def test_query_string_is_part_of_key(self):
+        self.create_book(self.author, title='Another book')
+        self.get(reverse('book:allBooks'))
+
+        response, queries = self.get(reverse('book:allBooks'), size=1)
+        self.assertGreater(queries, 2)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_comment_invalidates_book_and_catalog(self):
+        detail_url = reverse('book:bookDetails', kwargs={'pk': self.book.pk})
+        self.get(detail_url)
+        self.get(reverse('book:allBooks'))
+
+        self.client.post(reverse('book:addComment', kwargs={'pk': self.book.pk}), {'comment': 'Nice book', 'rating': 4})
+
+        response, _ = self.get(detail_url)
+        self.assertEqual(response.json()['no_of_comments'], 1)
+        response, _ = self.get(reverse('book:allBooks'))
+        self.assertEqual(response.json()['results'][0]['average_rating'], '4.00')
+
+    def test_author_change_invalidates_books(self):
+        detail_url = reverse('book:bookDetails', kwargs={'pk': self.book.pk})
+        self.get(detail_url)
+
+        self.author.email = 'new-author@example.com'
+        self.author.save()
+
+        response, _ = self.get(detail_url)
+        self.assertEqual(response.json()['author'], 'new-author@example.com')
+
+    def test_logins_keep_cached_books(self):
+        self.get(reverse('book:allBooks'))
+
+        with mock.patch('book.cache.invalidate') as invalidate:
+            self.author.last_login = timezone.now()
+            self.author.save(update_fields=['last_login'])
+            self.author.first_name = 'Renamed'
+            self.author.save()
+
+        invalidate.assert_not_called()
+
+    def test_browsable_pages_are_not_shared(self):
+        other = self.create_user('other@example.com')
+        url = reverse('book:allBooks')
+
+        first = self.client.get(url, HTTP_ACCEPT='text/html')
+        self.assertIn(b'reader@example.com', first.content)
+
+        self.login(other)
+        second = self.client.get(url, HTTP_ACCEPT='text/html')
+
+        self.assertIn(b'other@example.com', second.content)
+        self.assertNotIn(b'reader@example.com', second.content)
+
+
+class ConditionalRequestTests(BookTestMixin, APITestCase):
+    '''Books and comments send validators, answer 304 and honour If-Match'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.book = self.create_book(self.author)
+        self.comment = self.create_comment(self.book, self.reader)
+
+    def test_unchanged_book_is_not_modified(self):
+        self.login(self.reader)
+        url = reverse('book:bookDetails', kwargs={'pk': self.book.pk})
+
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_representations_have_their_own_etags(self):
+        self.login(self.reader)
+        url = reverse('book:bookDetails', kwargs={'pk': self.book.pk})
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        etag = response['ETag']
+        self.assertIn('Accept', response['Vary'])
+
+        self.assertEqual(self.client.get(url, {'fields': 'title'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_changed_list_is_sent_again(self):
+        self.login(self.reader)
+        url = reverse('book:bookComments', kwargs={'pk': self.book.pk})
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.create_comment(self.book, self.create_user('other@example.com'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_email_changes_are_sent_again(self):
+        self.login(self.reader)
+        urls = [reverse('book:allBooks'), reverse('book:bookComments', kwargs={'pk': self.book.pk}), reverse('book:userComments')]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        self.author.email = 'writer@example.com'
+        self.author.save()
+        self.reader.email = 'commenter@example.com'
+        self.reader.save()
+
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+        self.assertEqual(response.data['results'][0]['commenter'], 'commenter@example.com')
+        self.assertEqual(response.data['results'][0]['book'], 'Test book by writer@example.com')
+
+        # the rows themselves are left alone, the catalog keeps its order
+        self.assertEqual(Book.objects.get(pk=self.book.pk).updated, self.book.updated)
+        self.assertEqual(Comment.objects.get(pk=self.comment.pk).updated, self.comment.updated)
+
+    def test_if_match_guards_comment_updates(self):
+        self.login(self.reader)
+        url = reverse('book:commentDetails', kwargs={'pk': self.comment.pk})
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.put(url, {'comment': 'First edit', 'rating': 3}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # a second client still holding the old ETag loses
+        response = self.client.put(url, {'comment': 'Stale edit', 'rating': 1}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.comment, 'First edit')
+
+    def test_other_comments_leave_comment_validators_alone(self):
+        self.login(self.reader)
+        url = reverse('book:commentDetails', kwargs={'pk': self.comment.pk})
+        etag = self.client.get(url)['ETag']
+
+        # the book's counters change, this comment's representation doesn't
+        self.create_comment(self.book, self.create_user('other@example.com'))
+
+        response = self.client.put(url, {'comment': 'First edit', 'rating': 3}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_match_holds_across_representations(self):
+        self.login(self.reader)
+        url = reverse('book:commentDetails', kwargs={'pk': self.comment.pk})
+        etag = self.client.get(url, {'format': 'json'}, HTTP_ACCEPT='application/json')['ETag']
+
+        response = self.client.put(url, {'comment': 'First edit', 'rating': 3}, HTTP_IF_MATCH=etag, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_match_is_checked_in_the_write(self):
+        self.login(self.reader)
+        url = reverse('book:commentDetails', kwargs={'pk': self.comment.pk})
+        etag = self.client.get(url)['ETag']
+        get_object = views.CommentDetailsView.get_object
+
+        # another client's edit lands after the request started
+        def edited_meanwhile(view):
+            Comment.objects.filter(pk=self.comment.pk).update(comment='Other edit', updated=timezone.now() + timedelta(seconds=1))
+            return get_object(view)
+
+        with mock.patch.object(views.CommentDetailsView, 'get_object', edited_meanwhile):
+            response = self.client.put(url, {'comment': 'Stale edit', 'rating': 1}, HTTP_IF_MATCH=etag)
+
+        self.assertEqual(response.status_code, 412)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.comment, 'Other edit')
+
+    def test_if_match_guards_book_deletes(self):
+        self.login(self.author)
+        url = reverse('book:bookDetails', kwargs={'pk': self.book.pk})
+
+        response = self.client.delete(url, HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, 412)
+        self.assertTrue(Book.objects.filter(pk=self.book.pk).exists())
+
+
+class MediaTestMixin:
+    '''Keep files written by a test out of the real MEDIA_ROOT'''
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+
+        settings = override_settings(MEDIA_ROOT=media_root, BOOK_UPLOAD_ROOT=os.path.join(media_root, 'uploads'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class ChunkedUploadTests(MediaTestMixin, BookTestMixin, APITestCase):
+    '''Book files can be uploaded in resumable chunks and finalized into a book'''
+
+    content = b'%PDF-1.4 ' + bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.login(self.author)
+
+        response = self.client.post(reverse('book:bookUploads'), {'file_name': 'novel.pdf', 'size': len(self.content)})
+        self.assertEqual(response.status_code, 201)
+        self.upload_url = reverse('book:bookUploadDetails', kwargs={'pk': response.data['id']})
+        self.finalize_url = reverse('book:finalizeBookUpload', kwargs={'pk': response.data['id']})
+
+    def send(self, start, end):
+        return self.client.generic(
+            'PUT', self.upload_url, self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}',
+        )
+
+    def test_resumed_upload_becomes_book(self):
+        middle = len(self.content) // 2
+
+        self.assertEqual(self.send(0, middle - 1).data['offset'], middle)
+        self.assertEqual(self.client.get(self.upload_url)['Upload-Offset'], str(middle))
+
+        # a chunk that doesn't continue from the offset is refused
+        response = self.send(0, 10)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], middle)
+
+        response = self.client.post(self.finalize_url, {'title': 'Novel', 'description': 'A novel'})
+        self.assertEqual(response.status_code, 400)
+
+        self.send(middle, len(self.content) - 1)
+
+        response = self.client.post(self.finalize_url, {'title': 'Novel', 'description': 'A novel'})
+        self.assertEqual(response.status_code, 201)
+
+        book = Book.objects.get(title='Novel')
+        with book.book_file.open('rb') as book_file:
+            self.assertEqual(book_file.read(), self.content)
+        self.assertFalse(BookUpload.objects.exists())
+
+    def test_finalize_runs_book_validation(self):
+        self.send(0, len(self.content) - 1)
+
+        response = self.client.post(self.finalize_url, {'title': 'No', 'description': 'A novel'})
+        self.assertEqual(response.status_code, 400)
+
+        # the upload is kept so the author can fix the details and try again
+        response = self.client.post(self.finalize_url, {'title': 'Novel', 'description': 'A novel'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_file_name_cannot_be_a_path(self):
+        response = self.client.post(reverse('book:bookUploads'), {'file_name': '../settings.py', 'size': 10})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(BOOK_UPLOAD_MAX_OPEN=1)
+    def test_open_uploads_are_capped(self):
+        response = self.client.post(reverse('book:bookUploads'), {'file_name': 'other.pdf', 'size': 10})
+        self.assertEqual(response.status_code, 400)
+
+        # expired uploads don't count
+        BookUpload.objects.update(expires=timezone.now())
+        response = self.client.post(reverse('book:bookUploads'), {'file_name': 'other.pdf', 'size': 10})
+        self.assertEqual(response.status_code, 201)
+
+    def test_upload_is_finalized_once(self):
+        self.send(0, len(self.content) - 1)
+        BookUpload.objects.update(finalizing=True)
+
+        response = self.client.post(self.finalize_url, {'title': 'Novel', 'description': 'A novel'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.send(0, 10).status_code, 409)
+        self.assertFalse(Book.objects.exists())
+
+    def test_missing_part_conflicts(self):
+        self.send(0, len(self.content) - 1)
+        uploads.remove_part(BookUpload.objects.get())
+
+        response = self.client.post(self.finalize_url, {'title': 'Novel', 'description': 'A novel'})
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(BookUpload.objects.exists())
+
+    def test_expired_uploads_are_removed(self):
+        upload = BookUpload.objects.get()
+        BookUpload.objects.update(expires=timezone.now())
+        self.assertEqual(self.client.get(self.upload_url).status_code, 404)
+
+        # the part of an upload deleted with its author, written before BOOK_UPLOAD_TTL
+        stray = os.path.join(settings.BOOK_UPLOAD_ROOT, f'{uuid.uuid4()}.part')
+        open(stray, 'wb').close()
+        written = time.time() - settings.BOOK_UPLOAD_TTL - 1
+        os.utime(stray, (written, written))
+
+        output = StringIO()
+        call_command('remove_expired_uploads', stdout=output)
+
+        self.assertIn('Removed 1 expired uploads and 1 stray parts.', output.getvalue())
+        self.assertFalse(BookUpload.objects.exists())
+        self.assertFalse(os.path.exists(upload.part_path))
+        self.assertFalse(os.path.exists(stray))
+
+
+class BookDownloadTests(MediaTestMixin, BookTestMixin, APITestCase):
+    '''Book files are downloaded whole or by range'''
+
+    content = bytes(range(256)) * 8
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.book = self.create_book(self.author)
+        self.book.book_file.save('novel.pdf', ContentFile(self.content))
+        self.url = reverse('book:bookDownload', kwargs={'pk': self.book.pk})
+
+    def download(self, **headers):
+        self.login(self.reader)
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.download(HTTP_ACCEPT='application/pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="test-book.pdf"')
+
+    def test_ranges(self):
+        response, body = self.download(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '100')
+
+        response, body = self.download(HTTP_RANGE='bytes=-10')
+        self.assertEqual(body, self.content[-10:])
+
+        response, body = self.download(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(body, self.content[2000:])
+
+        response, _ = self.download(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_if_range(self):
+        etag = self.download()[0]['ETag']
+
+        response, body = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(body, self.content[:10])
+
+        # the file changed, so the whole file is sent again
+        response, body = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"changed"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    def test_login_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_missing_file(self):
+        os.remove(self.book.book_file.path)
+        self.assertEqual(self.download()[0].status_code, 404)
+
+    @override_settings(BOOK_DOWNLOAD_ACCEL='nginx', BOOK_DOWNLOAD_ACCEL_PREFIX='/protected/')
+    def test_front_server_handoff(self):
+        response, body = self.download()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.book.book_file.name)
+        self.assertEqual(body, b'')
+
+
+class SignedMediaTests(MediaTestMixin, BookTestMixin, APITestCase):
+    '''Book payloads link to files through expiring signed URLs checked without the database'''
+
+    content = b'%PDF-1.4 signed'
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.book = self.create_book(self.author)
+        self.book.book_file.save('novel.pdf', ContentFile(self.content))
+        self.login(self.author)
+
+    def signed_url(self):
+        response = self.client.get(reverse('book:bookDetails', kwargs={'pk': self.book.pk}))
+        url = urlsplit(response.json()['book_file'])
+        self.client.credentials()
+        return f'{url.path}?{url.query}'
+
+    def test_signed_url_serves_file_without_queries(self):
+        url = self.signed_url()
+        self.assertTrue(url.startswith(f'/signedMedia/{self.book.book_file.name}?'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_detail_and_list_urls_match(self):
+        detail = self.client.get(reverse('book:bookDetails', kwargs={'pk': self.book.pk})).json()
+        listed = self.client.get(reverse('book:allBooks')).json()['results'][0]
+
+        self.assertTrue(detail['book_file'].startswith('http://testserver/signedMedia/'))
+        self.assertEqual(detail['book_file'], listed['book_file'])
+
+    def test_anonymous_catalog_has_no_book_files(self):
+        url = reverse('book:allBooks')
+        self.client.credentials()
+
+        for _ in range(2):
+            listed = self.client.get(url).json()['results'][0]
+            self.assertIsNone(listed['book_file'])
+            self.assertTrue(listed['book_cover_picture'].startswith('http://testserver/signedMedia/'))
+
+        # the anonymous response was cached, signed in users still get theirs
+        self.login(self.author)
+        self.assertTrue(self.client.get(url).json()['results'][0]['book_file'].startswith('http://testserver/signedMedia/'))
+
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            self.client.credentials()
+            get_cache().clear()
+            self.assertIsNone(self.client.get(url).json()['results'][0]['book_file'])
+
+    def test_removed_file_is_not_found(self):
+        url = self.signed_url()
+        os.remove(self.book.book_file.path)
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_tampered_and_expired_urls_are_refused(self):
+        url = self.signed_url()
+
+        self.assertEqual(self.client.get(url.replace('.pdf', '.txt')).status_code, 403)
+        self.assertEqual(self.client.get(url[:-4]).status_code, 403)
+
+        name = self.book.book_file.name
+        expired = f'/signedMedia/{name}?expires=1000&signature={signature(name, 1000)}'
+        self.assertEqual(self.client.get(expired).status_code, 403)
+
+
+@override_settings(COVER_RENDITION_WORKERS=0, COVER_RENDITION_WIDTHS=[40, 80])
+class CoverRenditionTests(MediaTestMixin, BookTestMixin, APITestCase):
+    '''Covers are rendered at several widths in WebP and JPEG, with an inline placeholder'''
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.book = self.create_book(self.author)
+
+    def image(self, width, height, image_format='PNG'):
+        buffer = BytesIO()
+        Image.new('RGBA', (width, height), (200, 40, 40, 128)).save(buffer, image_format)
+        return ContentFile(buffer.getvalue())
+
+    def test_new_cover_is_rendered(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.book_cover_picture.save('cover.png', self.image(100, 150))
+
+        self.login(self.author)
+        response = self.client.get(reverse('book:bookDetails', kwargs={'pk': self.book.pk}))
+        renditions = response.json()['cover_renditions']
+
+        self.assertTrue(renditions['placeholder'].startswith('data:image/jpeg;base64,'))
+        self.assertEqual([(image['width'], image['height']) for image in renditions['images']], [(40, 60), (80, 120)])
+        self.assertRegex(renditions['images'][0]['webp'], r'/signedMedia/book_pics/renditions/\w\w/\w\w/\w+\.webp\?expires=')
+
+        url = urlsplit(renditions['images'][1]['jpg'])
+        response = self.client.get(f'{url.path}?{url.query}')
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (80, 120))
+
+    def test_covers_are_not_upscaled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.book_cover_picture.save('small.png', self.image(60, 60))
+
+        self.book.refresh_from_db()
+        self.assertEqual([image['width'] for image in self.book.cover_renditions['images']], [40, 60])
+
+    def test_broken_cover_is_logged(self):
+        with self.assertLogs('book.covers', 'ERROR') as logs, self.captureOnCommitCallbacks(execute=True):
+            self.book.book_cover_picture.save('broken.png', ContentFile(b'not an image'))
+
+        self.assertIn(f'of books [{self.book.pk}] could not be rendered', logs.output[0])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.cover_renditions, {})
+
+    def test_command_renders_shared_cover_once(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'book_pics'))
+        with open(os.path.join(settings.MEDIA_ROOT, 'book_pics', 'default.jpg'), 'wb') as cover:
+            cover.write(self.image(90, 90, 'WEBP').read())
+        self.create_book(self.author, title='Another book')
+
+        output = StringIO()
+        call_command('render_book_covers', stdout=output)
+
+        self.assertIn('Rendered covers of 2 books from 1 images.', output.getvalue())
+        first, second = Book.objects.values_list('cover_renditions', flat=True)
+        self.assertEqual(first, second)
+        renditions = os.walk(os.path.join(settings.MEDIA_ROOT, 'book_pics', 'renditions'))
+        self.assertEqual(sum(len(files) for _, _, files in renditions), 4)
+
+        output = StringIO()
+        call_command('render_book_covers', stdout=output)
+        self.assertIn('Rendered covers of 0 books', output.getvalue())
+
+
+class ContentAddressedStorageTests(MediaTestMixin, BookTestMixin, APITestCase):
+    '''Uploads are stored once per distinct content under sharded names'''
+
+    content = b'%PDF-1.4 same content'
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.first = self.create_book(self.author, title='First book')
+        self.second = self.create_book(self.author, title='Second book')
+
+    def write(self, name, content):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as media_file:
+            media_file.write(content)
+
+    def test_identical_uploads_share_a_file(self):
+        self.first.book_file.save('first.pdf', ContentFile(self.content))
+        self.second.book_file.save('second.PDF', ContentFile(self.content))
+
+        name = self.first.book_file.name
+        self.assertRegex(name, r'^books/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual(self.second.book_file.name, name)
+        self.assertEqual(MediaBlob.objects.get(name=name).references, 2)
+
+        self.first.book_file.storage.delete(name)
+        self.assertTrue(self.second.book_file.storage.exists(name))
+
+        self.second.book_file.storage.delete(name)
+        self.assertFalse(self.second.book_file.storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_content_is_copied_before_the_blob_is_locked(self):
+        storage = self.first.book_file.storage
+        reference_blob = storage.reference_blob
+        linked = []
+
+        def link_staged(name, content, count=1):
+            # only a file that is already on disk is handed to the locked block
+            linked.append(content.temporary_file_path())
+            return reference_blob(name, content, count)
+
+        with mock.patch.object(storage, 'reference_blob', link_staged):
+            self.first.book_file.save('first.pdf', ContentFile(self.content))
+            self.second.book_file.save('second.pdf', ContentFile(self.content))
+
+        self.assertEqual(len(linked), 2)
+        self.assertFalse(any(os.path.exists(path) for path in linked))
+        with storage.open(self.first.book_file.name) as book_file:
+            self.assertEqual(book_file.read(), self.content)
+        self.assertEqual(MediaBlob.objects.get(name=self.first.book_file.name).references, 2)
+
+    def test_existing_files_are_migrated(self):
+        self.write('books/first.pdf', self.content)
+        self.write('books/second.pdf', self.content)
+        self.write('book_pics/cover.png', b'cover')
+        Book.objects.filter(pk=self.first.pk).update(book_file='books/first.pdf', book_cover_picture='book_pics/cover.png', cover_renditions={'source': 'book_pics/cover.png'})
+        Book.objects.filter(pk=self.second.pk).update(book_file='books/second.pdf')
+
+        output = StringIO()
+        call_command('migrate_media_storage', stdout=output)
+        self.assertIn('Book.book_file: moved 2 files, removed 2 old files.', output.getvalue())
+
+        first, second = Book.objects.get(pk=self.first.pk), Book.objects.get(pk=self.second.pk)
+        self.assertEqual(first.book_file.name, second.book_file.name)
+        self.assertEqual(MediaBlob.objects.get(name=first.book_file.name).references, 2)
+        self.assertEqual(first.cover_renditions['source'], first.book_cover_picture.name)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'books', 'first.pdf')))
+
+        with first.book_file.open('rb') as book_file:
+            self.assertEqual(book_file.read(), self.content)
+
+
+class MediaCleanupTests(MediaTestMixin, BookTestMixin, APITestCase):
+    '''Deletes queue their files for a background pass, and orphans are collected'''
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.books = [self.create_book(self.author, title=f'Book number {i}') for i in range(3)]
+
+        for i, book in enumerate(self.books):
+            book.book_file.save('novel.pdf', ContentFile(f'book {i}'.encode()))
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(settings.MEDIA_ROOT, name))
+
+    def image_file(self, size):
+        buffer = BytesIO()
+        Image.new('RGB', size, (160, 90, 20)).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue())
+
+    def test_deleting_an_author_queues_their_files(self):
+        names = [book.book_file.name for book in self.books]
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True), batched():
+            self.author.delete()
+
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(len([sql for sql in statements if sql.startswith('INSERT INTO "book_mediaremoval"')]), 1)
+        self.assertEqual(len([sql for sql in statements if sql.startswith('DELETE FROM book_search')]), 1)
+        self.assertTrue(all(self.exists(name) for name in names))
+
+        call_command('remove_deleted_media', stdout=StringIO())
+        self.assertFalse(any(self.exists(name) for name in names))
+        self.assertFalse(MediaRemoval.objects.exists())
+
+    def test_rolled_back_deletes_queue_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), batched():
+                self.books[0].delete()
+                raise RuntimeError
+
+            self.books[1].delete()
+
+        self.assertEqual(list(MediaRemoval.objects.values_list('name', flat=True)), [self.books[1].book_file.name])
+
+    def test_files_shared_with_other_books_are_kept(self):
+        other = self.create_book(self.author, title='Same file')
+        other.book_file.save('copy.pdf', ContentFile(b'book 0'))
+        name = other.book_file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].delete()
+        call_command('remove_deleted_media', stdout=StringIO())
+        self.assertTrue(self.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        call_command('remove_deleted_media', stdout=StringIO())
+        self.assertFalse(self.exists(name))
+
+    def test_replaced_files_lose_their_reference(self):
+        book_file = self.books[0].book_file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].book_file.save('revised.pdf', ContentFile(b'revised book'))
+            self.author.profile_pic.save('me.png', self.image_file((20, 20)))
+        profile_pic = self.author.profile_pic.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.profile_pic.save('me.png', self.image_file((30, 30)))
+
+        self.assertEqual(sorted(MediaRemoval.objects.values_list('name', flat=True)), sorted([book_file, profile_pic]))
+        call_command('remove_deleted_media', stdout=StringIO())
+        self.assertFalse(self.exists(book_file) or self.exists(profile_pic))
+        self.assertFalse(MediaBlob.objects.filter(name__in=[book_file, profile_pic]).exists())
+
+    def test_orphans_are_collected(self):
+        orphan = os.path.join(settings.MEDIA_ROOT, 'books', 'orphan.pdf')
+        recent = os.path.join(settings.MEDIA_ROOT, 'books', 'recent.pdf')
+
+        for path in (orphan, recent):
+            with open(path, 'wb') as media_file:
+                media_file.write(b'orphan')
+
+        old = time.time() - 7200
+        for book in self.books:
+            os.utime(book.book_file.path, (old, old))
+        os.utime(orphan, (old, old))
+
+        output = StringIO()
+        call_command('collect_media_garbage', stdout=output)
+        self.assertEqual(output.getvalue().splitlines()[0], 'books/orphan.pdf')
+        self.assertIn('Checked 4 files, found 1 orphans (6 bytes).', output.getvalue())
+        self.assertTrue(os.path.exists(orphan))
+
+        call_command('collect_media_garbage', '--delete', stdout=StringIO())
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(all(os.path.exists(book.book_file.path) for book in self.books))
+
+
+    @override_settings(COVER_RENDITION_WORKERS=0, COVER_RENDITION_WIDTHS=[40])
+    def test_renditions_are_checked_by_their_counts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].book_cover_picture.save('cover.png', self.image_file((60, 60)))
+        self.books[0].refresh_from_db()
+        renditions = self.books[0].cover_renditions['images'][0]
+
+        old = time.time() - 7200
+        for directory, _, files in os.walk(settings.MEDIA_ROOT):
+            for name in files:
+                os.utime(os.path.join(directory, name), (old, old))
+
+        # the books' renditions JSON is never read to find them
+        output = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('collect_media_garbage', stdout=output)
+        self.assertIn('found 0 orphans', output.getvalue())
+        self.assertFalse(any('cover_renditions' in query['sql'] for query in queries.captured_queries))
+
+        # a new cover drops the old renditions' references, and their files with them
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].book_cover_picture.save('other.png', self.image_file((30, 30)))
+        call_command('remove_deleted_media', stdout=StringIO())
+        self.assertFalse(any(self.exists(name) for name in (renditions['webp'], renditions['jpg'])))
+
+@override_settings(COVER_RENDITION_WORKERS=0, COVER_RENDITION_WIDTHS=[40, 80])
+class BookImportTests(MediaTestMixin, BookTestMixin, APITestCase):
+    '''Catalogs are imported from a manifest, with their files copied into storage'''
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        for name, content in [('one.pdf', b'%PDF-1.4 shared'), ('two.pdf', b'%PDF-1.4 shared')]:
+            with open(os.path.join(self.root, name), 'wb') as book_file:
+                book_file.write(content)
+
+        Image.new('RGB', (60, 90), (10, 120, 200)).save(os.path.join(self.root, 'cover.png'))
+
+    def row(self, title, book_file='one.pdf', **extras):
+        return {'title': title, 'description': f'About {title}', 'author': 'author@example.com', 'book_file': book_file, **extras}
+
+    def write_manifest(self, rows):
+        path = os.path.join(self.root, 'books.jsonl')
+        with open(path, 'w') as manifest:
+            manifest.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def test_command_imports_and_resumes(self):
+        path = self.write_manifest([
+            self.row('Dragons of the north'),
+            self.row('Whales of the south', book_file='two.pdf', book_cover_picture='cover.png'),
+            self.row('Bad'),
+            self.row('Missing file', book_file='missing.pdf'),
+            self.row('Unknown author', author='nobody@example.com'),
+        ])
+
+        output = StringIO()
+        # the default cover isn't in the test MEDIA_ROOT
+        with self.assertLogs('book.covers', 'WARNING') as logs:
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                call_command('import_books', path, '--chunk-size', '2', stdout=output)
+
+        self.assertEqual(logs.output, [f'WARNING:book.covers:Cover book_pics/default.jpg of books [{Book.objects.earliest("pk").pk}] could not be read'])
+
+        self.assertIn('Row 3: {"message"', output.getvalue())
+        self.assertIn('Created 2 books, 3 rows failed.', output.getvalue())
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+        inserts = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('INSERT INTO "book_book"')]
+        self.assertEqual(len(inserts), 1)
+
+        dragons, whales = Book.objects.order_by('pk')
+        self.assertEqual(dragons.book_file.name, whales.book_file.name)
+        self.assertEqual(MediaBlob.objects.get(name=dragons.book_file.name).references, 2)
+        self.assertEqual([image['width'] for image in whales.cover_renditions['images']], [40, 60])
+
+        response = self.client.get(reverse('book:allBooks'), {'search': 'whales'})
+        self.assertEqual([book['id'] for book in response.data['results']], [whales.pk])
+
+        # a run interrupted after the first chunk starts from the row after it
+        with open(path + '.checkpoint', 'w') as checkpoint:
+            json.dump({'row': 2}, checkpoint)
+
+        output = StringIO()
+        call_command('import_books', path, stdout=output)
+        self.assertIn('Resuming after row 2', output.getvalue())
+        self.assertIn('Created 0 books, 3 rows failed.', output.getvalue())
+        self.assertEqual(Book.objects.count(), 2)
+
+    @override_settings(BOOK_IMPORT_MAX_BOOKS=3)
+    def test_admin_import(self):
+        admin = self.create_user('admin@example.com')
+        User.objects.filter(pk=admin.pk).update(is_staff=True)
+        books = [self.row('Dragons of the north'), self.row('Escaping the root', book_file='../books.jsonl')]
+
+        self.login(self.author)
+        response = self.client.post(reverse('book:importBooks'), {'books': books}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.login(admin)
+        with override_settings(BOOK_IMPORT_ROOT=self.root):
+            response = self.client.post(reverse('book:importBooks'), {'books': books}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2])
+
+        response = self.client.post(reverse('book:importBooks'), {'books': books * 2}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('manage.py import_books', response.data['message'])
+
+
+class BookBatchTests(BookTestMixin, APITestCase):
+    '''Several books are fetched in one request, in the order they were asked for'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.books = [self.create_book(self.author, title=f'Book number {i}') for i in range(5)]
+        self.login(self.reader)
+
+    def fetch(self, ids):
+        return self.client.get(reverse('book:bookBatch'), {'ids': ','.join(str(pk) for pk in ids)})
+
+    def test_books_in_requested_order(self):
+        missing = self.books[-1].pk + 100
+        ids = [self.books[3].pk, missing, self.books[0].pk, self.books[3].pk]
+
+        # warm the token cache
+        self.fetch([self.books[1].pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.fetch(ids)
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['id'] for result in results], [self.books[3].pk, missing, self.books[0].pk])
+        self.assertEqual(results[0]['author'], 'author@example.com')
+        self.assertEqual(results[1], {'id': missing, 'message': 'This book does not exist'})
+
+        # the validators and one query for the books
+        self.assertEqual(len(queries), 2)
+
+    def test_changes_are_seen(self):
+        ids = [self.books[0].pk, self.books[1].pk]
+        self.fetch(ids)
+
+        self.books[1].title = 'Renamed book'
+        self.books[1].save()
+
+        self.assertEqual(self.fetch(ids).data['results'][1]['title'], 'Renamed book')
+
+    def test_any_author_email_change_is_seen(self):
+        other = self.create_user('zed@example.com', role=User.AUTHOR)
+        book = self.create_book(other, title='Zed book')
+        ids = [self.books[0].pk, book.pk]
+
+        etag = self.fetch(ids)['ETag']
+
+        # the other author's email is still the largest
+        self.author.email = 'aaron@example.com'
+        self.author.save()
+
+        response = self.client.get(reverse('book:bookBatch'), {'ids': f'{ids[0]},{ids[1]}'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['author'], 'aaron@example.com')
+
+    @override_settings(BOOK_BATCH_MAX_IDS=3)
+    def test_invalid_ids(self):
+        self.assertEqual(self.fetch([]).status_code, 400)
+        self.assertEqual(self.fetch([book.pk for book in self.books]).status_code, 400)
+        self.assertEqual(self.client.get(reverse('book:bookBatch'), {'ids': '1,two'}).status_code, 400)
+
+
+class SparseFieldsetTests(BookTestMixin, APITestCase):
+    '''Book payloads can be trimmed with ?fields= and ?omit=, and only the columns sent are read'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.books = [self.create_book(self.author, title=f'Book number {i}') for i in range(3)]
+        self.login(self.author)
+
+    def book_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+
+        self.assertEqual(response.status_code, 200)
+        # the page or object query, not the validators' aggregate
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT "book_book"."id"')]
+        return response, selects
+
+    def test_list_fields(self):
+        for url_name in ['book:allBooks', 'book:authorBooks']:
+            response, selects = self.book_queries(reverse(url_name), fields='title,average_rating')
+
+            self.assertEqual(list(response.data['results'][0]), ['title', 'average_rating'])
+            self.assertEqual(len(selects), 1)
+            self.assertNotIn('description', selects[0])
+            self.assertNotIn('user_customuser', selects[0])
+
+    def test_omit_keeps_the_author(self):
+        response, selects = self.book_queries(reverse('book:allBooks'), omit='description,cover_renditions')
+
+        book = response.data['results'][0]
+        self.assertNotIn('description', book)
+        self.assertEqual(book['author'], 'author@example.com')
+        self.assertNotIn('"book_book"."description"', selects[0])
+
+    def test_detail_fields(self):
+        url = reverse('book:bookDetails', kwargs={'pk': self.books[0].pk})
+        response, selects = self.book_queries(url, fields='id,title,author')
+
+        self.assertEqual(response.data, {'id': self.books[0].pk, 'title': 'Book number 0', 'author': 'author@example.com'})
+        self.assertNotIn('description', selects[0])
+
+        response = self.client.get(url)
+        self.assertIn('description', response.data)
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse('book:allBooks'), {'fields': 'title,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'Unknown fields: secret')
+
+
+class RowListTests(BookTestMixin, APITestCase):
+    '''List pages built from values() rows are the same bytes as the serializers' pages'''
+
+    def setUp(self):
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.books = [self.create_book(self.author, title=f'Dragons number {i}') for i in range(7)]
+
+        self.books[0].cover_renditions = {
+            'source': 'book_pics/cover.png',
+            'placeholder': 'data:image/jpeg;base64,AAAA',
+            'images': [{'width': 40, 'height': 60, 'webp': 'book_pics/renditions/a.webp', 'jpg': 'book_pics/renditions/a.jpg'}],
+        }
+        self.books[0].average_rating = Decimal('4.5')
+        self.books[0].save()
+
+        for rating, book in zip([5, 4, 4, 1], self.books):
+            self.create_comment(book, self.reader, rating=rating)
+
+    def assert_same_content(self, url_name, user, kwargs=None, **params):
+        self.login(user)
+        url = reverse(url_name, kwargs=kwargs)
+        contents = []
+
+        for fast in (True, False):
+            get_cache().clear()
+            with override_settings(FAST_LIST_SERIALIZATION=fast):
+                response = self.client.get(url, params)
+
+            self.assertEqual(response.status_code, 200)
+            contents.append(response.content)
+
+        self.assertEqual(contents[0], contents[1])
+        return contents[0]
+
+    def test_books(self):
+        content = self.assert_same_content('book:allBooks', self.reader)
+        self.assertIn(b'"average_rating":"4.50"', content)
+
+        self.assert_same_content('book:allBooks', self.reader, page=2, ordering='created')
+        self.assert_same_content('book:allBooks', self.reader, cursor='', size=3)
+        self.assert_same_content('book:allBooks', self.reader, search='dragons')
+        self.assert_same_content('book:allBooks', self.reader, fields='title,book_file,author')
+        self.assert_same_content('book:authorBooks', self.author)
+
+    def test_comments(self):
+        self.assert_same_content('book:bookComments', self.reader, kwargs={'pk': self.books[0].pk})
+        self.assert_same_content('book:userComments', self.reader)
+        self.assert_same_content('book:userComments', self.reader, cursor='')
+
+    def test_next_cursor_pages_rows(self):
+        self.login(self.reader)
+        response = self.client.get(reverse('book:allBooks'), {'cursor': '', 'size': 4})
+        response = self.client.get(response.data['next'])
+
+        self.assertEqual([book['id'] for book in response.data['results']], [book.pk for book in reversed(self.books[1:4])])
+
+
+class RendererTests(BookTestMixin, APITestCase):
+    '''JSON is encoded with orjson as DRF encodes it, and MessagePack is sent to clients that ask for it'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.book = self.create_book(self.author, title='Dragons \u2028 of the north')
+        self.login(self.author)
+
+    def test_orjson_matches_json_renderer(self):
+        data = ReturnDict({
+            'rating': Decimal('4.50'),
+            'created': datetime(2023, 4, 1, 12, 30, 5, 120000, tzinfo=dt_timezone.utc),
+            'whole_second': datetime(2023, 4, 1, 12, 30, 5, tzinfo=dt_timezone(timedelta(hours=1))),
+            'naive': datetime(2023, 4, 1, 12, 30),
+            'day': datetime(2023, 4, 1).date(),
+            'id': uuid.UUID(int=7),
+            'lazy': gettext_lazy('Book'),
+            'error': [ErrorDetail('This field is required.', code='required')],
+            1: 'integer key',
+            'text': 'caf\u00e9 \u2029',
+        }, serializer=None)
+
+        self.assertEqual(renderers.ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            renderers.ORJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4')
+        )
+
+    def test_json_responses(self):
+        response = self.client.get(reverse('book:bookDetails', kwargs={'pk': self.book.pk}))
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn(b'"title":"Dragons \\u2028 of the north"', response.content)
+        self.assertEqual(response.json()['average_rating'], '0.00')
+
+    @unittest.skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_msgpack_negotiation(self):
+        url = reverse('book:bookDetails', kwargs={'pk': self.book.pk})
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        book = renderers.msgpack.unpackb(response.content)
+        self.assertEqual(book['title'], self.book.title)
+        self.assertEqual(book['author'], 'author@example.com')
+
+        body = renderers.msgpack.packb({'title': 'Dragons of the south', 'description': 'Another tale'})
+        response = self.client.patch(url, body, content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(renderers.msgpack.unpackb(response.content)['title'], 'Dragons of the south')
+
+
+@override_settings(COMPRESSION_MIN_SIZE=500)
+class CompressionTests(BookTestMixin, APITestCase):
+    '''Large responses are compressed with the coding the client accepts, cached ones only once'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.books = [self.create_book(self.author, title=f'Book number {i}') for i in range(5)]
+        self.login(self.author)
+
+    def get(self, url_name, encoding=None, **kwargs):
+        headers = {'HTTP_ACCEPT_ENCODING': encoding} if encoding else {}
+        return self.client.get(reverse(url_name, kwargs=kwargs or None), **headers)
+
+    def test_gzip_negotiation(self):
+        plain = self.get('book:authorBooks')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.get('book:authorBooks', 'br;q=0.5, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+        response = self.get('book:authorBooks', 'gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_compressed_responses_have_weak_etags(self):
+        plain = self.get('book:authorBooks')
+        response = self.get('book:authorBooks', 'gzip')
+
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        url = reverse('book:authorBooks')
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_html_is_not_compressed(self):
+        response = self.client.get(reverse('book:authorBooks'), HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(COMPRESSION_MIN_SIZE=100000)
+    def test_small_responses_are_sent_as_they_are(self):
+        response = self.get('book:authorBooks', 'gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_cached_responses_are_compressed_once(self):
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            first = self.get('book:allBooks', 'gzip')
+            second = self.get('book:allBooks', 'gzip')
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', second['Vary'])
+        self.assertTrue(second['ETag'].startswith('W/"'))
+
+        plain = self.get('book:allBooks')
+        self.assertEqual(gzip.decompress(second.content), plain.content)
+
+    @unittest.skipUnless(compression.brotli, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        plain = self.get('book:authorBooks')
+        response = self.get('book:authorBooks', 'gzip, deflate, br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), plain.content)
+
+    def test_accept_encoding_wildcard(self):
+        self.assertEqual(compression.accepted_encoding(mock.Mock(META={'HTTP_ACCEPT_ENCODING': '*'})), compression.ENCODINGS[0])
+        self.assertEqual(compression.accepted_encoding(mock.Mock(META={'HTTP_ACCEPT_ENCODING': '*;q=0.1, gzip;q=0.2'})), 'gzip')
+        self.assertIsNone(compression.accepted_encoding(mock.Mock(META={})))
+
+
+class AsyncReadTests(BookTestMixin, APITestCase):
+    '''Under ASGI, book and comment reads are served by async views with the same responses as the sync ones'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = self.create_user('author@example.com', role=User.AUTHOR)
+        self.reader = self.create_user('reader@example.com')
+        self.books = [self.create_book(self.author, title=f'Dragons number {i}') for i in range(7)]
+
+        for rating, book in zip([5, 4, 4, 1], self.books):
+            self.create_comment(book, self.reader, rating=rating)
+
+    def fetch(self, view_class, url, user=None, method='get', data=None, kwargs=None, **headers):
+        if user is not None:
+            headers['AUTHORIZATION'] = f'Token {user.auth_token.key}'
+
+        if method == 'get':
+            request = AsyncRequestFactory().get(url, data or {}, **headers)
+        else:
+            request = getattr(AsyncRequestFactory(), method)(url, json.dumps(data), content_type='application/json', **headers)
+
+        with override_settings(ASYNC_READ_VIEWS=True):
+            response = async_to_sync(view_class.as_view())(request, **(kwargs or {}))
+
+        # cache hits are plain responses, already rendered
+        return response.render() if hasattr(response, 'render') else response
+
+    def assert_same_response(self, view_class, url_name, user, kwargs=None, **params):
+        url = reverse(url_name, kwargs=kwargs)
+
+        get_cache().clear()
+        self.login(user)
+        expected = self.client.get(url, params)
+
+        get_cache().clear()
+        response = self.fetch(view_class, url, user, data=params, kwargs=kwargs)
+
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+        return response
+
+    def test_views_are_async_when_enabled(self):
+        with override_settings(ASYNC_READ_VIEWS=False):
+            self.assertFalse(asyncio.iscoroutinefunction(views.AllBooksView.as_view()))
+
+        with override_settings(ASYNC_READ_VIEWS=True):
+            for view_class in (views.AllBooksView, views.BookDetailsView, views.AllBookCommentsView, views.AllUserCommentsView):
+                self.assertTrue(asyncio.iscoroutinefunction(view_class.as_view()))
+
+    def test_same_responses(self):
+        self.assert_same_response(views.AllBooksView, 'book:allBooks', self.reader)
+        self.assert_same_response(views.AllBooksView, 'book:allBooks', self.reader, page=2, ordering='created')
+        self.assert_same_response(views.AllBooksView, 'book:allBooks', self.reader, cursor='', size=3)
+        self.assert_same_response(views.AllBooksView, 'book:allBooks', self.reader, search='dragons', fields='title,author')
+
+        book = {'pk': self.books[0].pk}
+        self.assert_same_response(views.BookDetailsView, 'book:bookDetails', self.reader, kwargs=book)
+        self.assert_same_response(views.BookDetailsView, 'book:bookDetails', self.reader, kwargs=book, fields='title')
+        self.assert_same_response(views.AllBookCommentsView, 'book:bookComments', self.reader, kwargs=book)
+        self.assert_same_response(views.AllUserCommentsView, 'book:userComments', self.reader, cursor='')
+
+    def test_empty_and_missing(self):
+        response = self.assert_same_response(views.AllBookCommentsView, 'book:bookComments', self.reader, kwargs={'pk': self.books[6].pk})
+        self.assertIn('message', response.data)
+
+        response = self.fetch(views.BookDetailsView, '/book/bookDetail/0/', self.reader, kwargs={'pk': 0})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.fetch(views.AllBooksView, reverse('book:allBooks'), self.reader, data={'page': 50})
+        self.assertEqual(response.status_code, 404)
+
+    def test_authentication(self):
+        self.assertEqual(self.fetch(views.AllBooksView, reverse('book:allBooks')).status_code, 200)
+
+        response = self.fetch(views.AllUserCommentsView, reverse('book:userComments'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        response = self.fetch(views.AllUserCommentsView, reverse('book:userComments'), AUTHORIZATION='Token not-a-token')
+        self.assertEqual(response.status_code, 401)
+
+    def test_validators_and_cache(self):
+        url = reverse('book:allBooks')
+        first = self.fetch(views.AllBooksView, url, self.reader)
+
+        # the token and the response are cached, only the validator query is left
+        with self.assertNumQueries(1):
+            second = self.fetch(views.AllBooksView, url, self.reader)
+        self.assertEqual(second.content, first.content)
+
+        response = self.fetch(views.AllBooksView, url, self.reader, IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_keep_sync_path(self):
+        url = reverse('book:bookDetails', kwargs={'pk': self.books[0].pk})
+        data = {'title': 'A new title', 'description': 'A new description'}
+
+        response = self.fetch(views.BookDetailsView, url, self.author, method='patch', data=data, kwargs={'pk': self.books[0].pk})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).title, 'A new title')
@@ -0,0 +1,153 @@
+import os
+import re
+import time
+from uuid import UUID
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from .models import BookUpload
+
+# bytes read from the request and written to the part file at a time
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadedPart(File):
+    '''
+        Assembled upload handed to the storage backend.
+
+        FileSystemStorage moves files that have a temporary_file_path() instead
+        of copying them, so finalizing an upload is a rename.
+    '''
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def open_uploads(author):
+    '''Function to get an author's uploads that haven't expired'''
+
+    return BookUpload.objects.filter(author=author, expires__gt=timezone.now())
+
+
+def parse_content_range(header):
+    '''Function to get the (start, end, total) of a `Content-Range: bytes start-end/total` header'''
+
+    match = CONTENT_RANGE.match(header or '')
+    if match is None:
+        return None
+
+    start, end, total = (int(value) for value in match.groups())
+    if start > end or end >= total:
+        return None
+
+    return start, end, total
+
+
+def create_part(upload):
+    '''Function to create the empty file an upload's chunks are written to'''
+
+    os.makedirs(os.path.dirname(upload.part_path), exist_ok=True)
+    open(upload.part_path, 'wb').close()
+
+
+def write_chunk(upload, stream, start, length):
+    '''
+        Function to copy a chunk from the request stream into the part file.
+
+        The chunk goes to disk a few kilobytes at a time, so memory use doesn't
+        depend on the chunk size. Returns the number of bytes written, which
+        is less than `length` when the client disconnected mid chunk.
+    '''
+
+    written = 0
+
+    with open(upload.part_path, 'r+b') as part:
+        part.seek(start)
+
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+            if not data:
+                break
+
+            part.write(data)
+            written += len(data)
+
+    return written
+
+
+def open_part(upload):
+    '''Function to open a complete upload under its original file name'''
+
+    part = UploadedPart(open(upload.part_path, 'rb'), name=upload.file_name)
+    part.size = upload.size
+    return part
+
+
+def remove_part(upload):
+    try:
+        os.remove(upload.part_path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_expired(batch_size=500):
+    '''
+        Function to delete the uploads that got no chunk for BOOK_UPLOAD_TTL
+        seconds, and their parts. Returns the number of uploads deleted.
+    '''
+
+    removed = 0
+
+    while True:
+        # expired uploads are never found by the upload views, so nothing extends them now
+        batch = list(BookUpload.objects.filter(expires__lte=timezone.now()).order_by('expires')[:batch_size])
+        if not batch:
+            return removed
+
+        for upload in batch:
+            remove_part(upload)
+
+        BookUpload.objects.filter(pk__in=[upload.pk for upload in batch]).delete()
+        removed += len(batch)
+
+
+def remove_stray_parts():
+    '''
+        Function to delete part files older than BOOK_UPLOAD_TTL that no upload
+        refers to, e.g. those of deleted authors. Returns the number deleted.
+    '''
+
+    root = settings.BOOK_UPLOAD_ROOT
+    written_before = time.time() - settings.BOOK_UPLOAD_TTL
+    parts = {}
+
+    if not os.path.isdir(root):
+        return 0
+
+    with os.scandir(root) as entries:
+        for entry in entries:
+            name, extension = os.path.splitext(entry.name)
+            if extension != '.part' or not entry.is_file() or entry.stat().st_mtime >= written_before:
+                continue
+
+            try:
+                parts[UUID(name)] = entry.path
+            except ValueError:
+                continue
+
+    known = set(BookUpload.objects.filter(pk__in=list(parts)).values_list('pk', flat=True))
+    removed = 0
+
+    for pk, path in parts.items():
+        if pk not in known:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+    return removed
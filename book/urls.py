@@ -4,7 +4,13 @@ from . import views
 app_name = 'book'
 urlpatterns = [
     path('addBook/', views.AddNewBookView.as_view(), name='addBook'),
+    path('bookUploads/', views.BookUploadView.as_view(), name='bookUploads'),
+    path('bookUploads/<uuid:pk>/', views.BookUploadDetailView.as_view(), name='bookUploadDetails'),
+    path('bookUploads/<uuid:pk>/finalize/', views.FinalizeBookUploadView.as_view(), name='finalizeBookUpload'),
+    path('importBooks/', views.ImportBooksView.as_view(), name='importBooks'),
     path('bookDetail/<int:pk>/', views.BookDetailsView.as_view(), name='bookDetails'),
+    path('bookBatch/', views.BookBatchView.as_view(), name='bookBatch'),
+    path('bookDownload/<int:pk>/', views.BookDownloadView.as_view(), name='bookDownload'),
     path('allBooks/', views.AllBooksView.as_view(), name='allBooks'),
     path('authorBooks/', views.AuthorBooksView.as_view(), name='authorBooks'),
 
@@ -1,21 +1,38 @@
-from django.shortcuts import render
+import os
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render
 from django.contrib.auth import get_user_model
 from django.urls import reverse_lazy, reverse
+from django.db import transaction
+from django.utils.text import slugify
 
 from rest_framework import filters
 from rest_framework import generics
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
-from rest_framework.parsers import MultiPartParser
-from rest_framework.exceptions import NotFound
-
-from . import serializers
-from .models import Book, Comment
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.views import APIView
+
+from . import downloads, importing, ratings, serializers, uploads
+from .asynchronous import AsyncReadMixin
+from .cache import CachedResponseMixin, CATALOG, book_scope
+from .conditional import ConditionalMixin, aobject_state, object_state, rows_state
+from .fieldsets import SparseFieldsetMixin
+from .models import Book, BookUpload, Comment, upload_expiry
 from .permissions import IsBookAuthorOrReadOnly, IsAuthorRole, IsCommentAuthor
 from .pagination import DefaultPagination
+from .rows import RowListMixin
+from .search import FullTextSearchFilter
 
 User = get_user_model()
 
+# comment lists show their book's title and the emails of the book's author and commenter,
+# a change of those users' details moves their `updated` on
+COMMENT_LIST_RELATED = ('book__updated', 'book__author__updated', 'commenter__updated')
+
 # Create your views here.
 class AddNewBookView(generics.CreateAPIView):
     '''
@@ -36,7 +53,182 @@ class AddNewBookView(generics.CreateAPIView):
         return Response(serializer.data)
         
 
-class AuthorBooksView(generics.ListAPIView):
+class BookUploadView(generics.CreateAPIView):
+    '''
+        View to start a chunked upload of a book file
+    '''
+
+    serializer_class = serializers.BookUploadSerializer
+    permission_classes = [IsAuthenticated, IsAuthorRole]
+    queryset = BookUpload.objects.all()
+
+    def perform_create(self, serializer):
+        # check permission before saving serializer
+        self.check_object_permissions(self.request, self.queryset)
+
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+class BookUploadDetailView(generics.RetrieveDestroyAPIView):
+    '''
+        View to send the chunks of an upload, get how much of it was received and cancel it
+    '''
+
+    serializer_class = serializers.BookUploadSerializer
+    permission_classes = [IsAuthenticated, IsAuthorRole]
+
+    def get_queryset(self):
+        current_user = self.request.user
+        return uploads.open_uploads(current_user)
+
+    def retrieve(self, request, *args, **kwargs):
+        upload = self.get_object()
+        serializer = self.get_serializer(upload)
+        return Response(serializer.data, headers={'Upload-Offset': upload.offset})
+
+    def put(self, request, *args, **kwargs):
+        upload = self.get_object()
+        content_range = uploads.parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+
+        if content_range is None or content_range[2] != upload.size:
+            return Response(
+                {'message': f'Send each chunk with a Content-Range: bytes start-end/{upload.size} header'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        start, end, total = content_range
+
+        # chunks are appended in order, resume from the offset we have
+        if start != upload.offset:
+            return Response(
+                {'message': f'Next chunk has to start at byte {upload.offset}', 'offset': upload.offset},
+                status=status.HTTP_409_CONFLICT,
+                headers={'Upload-Offset': upload.offset}
+            )
+
+        written = 0
+        if request.stream is not None:
+            written = uploads.write_chunk(upload, request.stream, start, end - start + 1)
+
+        offset = start + written
+
+        # another request may have sent the same chunk in the meantime, or started finalizing
+        if not BookUpload.objects.filter(pk=upload.pk, offset=start, finalizing=False).update(offset=offset, expires=upload_expiry()):
+            upload.refresh_from_db()
+            return Response(
+                {'message': f'Next chunk has to start at byte {upload.offset}', 'offset': upload.offset},
+                status=status.HTTP_409_CONFLICT,
+                headers={'Upload-Offset': upload.offset}
+            )
+
+        return Response({'offset': offset}, headers={'Upload-Offset': offset})
+
+    def perform_destroy(self, instance):
+        uploads.remove_part(instance)
+        instance.delete()
+
+
+class FinalizeBookUploadView(generics.GenericAPIView):
+    '''
+        View to create a book from a complete upload
+    '''
+
+    serializer_class = serializers.AddBookSerializer
+    permission_classes = [IsAuthenticated, IsAuthorRole]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def get_queryset(self):
+        current_user = self.request.user
+        return uploads.open_uploads(current_user)
+
+    def claim(self):
+        '''Function to mark the upload as being finalized, or get None if another request already is'''
+
+        with transaction.atomic():
+            # the row stays locked until the claim is made
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=self.kwargs['pk'])
+            self.check_object_permissions(self.request, upload)
+            claimed = BookUpload.objects.filter(pk=upload.pk, finalizing=False).update(finalizing=True, expires=upload_expiry())
+
+        return upload if claimed else None
+
+    def post(self, request, *args, **kwargs):
+        upload = self.claim()
+
+        if upload is None:
+            return Response({'message': 'This upload is already being finalized'}, status=status.HTTP_409_CONFLICT)
+        elif not upload.is_complete:
+            BookUpload.objects.filter(pk=upload.pk).update(finalizing=False)
+            return Response(
+                {'message': f'Upload is incomplete, received {upload.offset} of {upload.size} bytes', 'offset': upload.offset},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            book_file = uploads.open_part(upload)
+        except FileNotFoundError:
+            upload.delete()
+            return Response({'message': 'The file of this upload is gone, start the upload again'}, status=status.HTTP_409_CONFLICT)
+
+        data = {
+            'title': request.data.get('title'),
+            'description': request.data.get('description'),
+            'book_file': book_file,
+        }
+        if 'book_cover_picture' in request.data:
+            data['book_cover_picture'] = request.data.get('book_cover_picture')
+
+        # validation from AddBookSerializer still runs, the part is kept so a failed finalize can be retried
+        serializer = self.get_serializer(data=data)
+        try:
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        except Exception:
+            BookUpload.objects.filter(pk=upload.pk).update(finalizing=False)
+            raise
+        finally:
+            book_file.close()
+
+        uploads.remove_part(upload)
+        upload.delete()
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ImportBooksView(APIView):
+    '''
+        View for admins to import many books at once, from files under BOOK_IMPORT_ROOT
+    '''
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        books = request.data.get('books') if isinstance(request.data, dict) else request.data
+
+        if not isinstance(books, list) or not books:
+            return Response({'message': 'Send the books to import as a list'}, status=status.HTTP_400_BAD_REQUEST)
+        elif len(books) > settings.BOOK_IMPORT_MAX_BOOKS:
+            return Response(
+                {'message': f'At most {settings.BOOK_IMPORT_MAX_BOOKS} books can be imported at once, import more with manage.py import_books'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # rows with errors are reported, the others are still imported
+        created, errors = importing.import_books(
+            books,
+            settings.BOOK_IMPORT_ROOT,
+            chunk_size=settings.BOOK_IMPORT_CHUNK_SIZE,
+            workers=settings.BOOK_IMPORT_WORKERS
+        )
+
+        return Response(
+            {'created': created, 'errors': errors},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
+
+
+class AuthorBooksView(RowListMixin, SparseFieldsetMixin, ConditionalMixin, generics.ListAPIView):
     '''
         View that displays a list of a specific user books
     '''
@@ -44,24 +236,29 @@ class AuthorBooksView(generics.ListAPIView):
     serializer_class = serializers.BookDetailsSerializer
     permission_classes = [IsAuthenticated, IsAuthorRole]
     pagination_class = DefaultPagination
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [FullTextSearchFilter, filters.OrderingFilter]
     search_fields = ['title']
     ordering_fields = ['created']
 
     def get_queryset(self):
         current_user = self.request.user
-        return Book.objects.filter(author=current_user)
+        return Book.objects.filter(author=current_user).select_related('author')
+
+    def get_validator_state(self):
+        return self.get_list_state(self.filter_queryset(self.get_queryset()), 'author__updated')
     
     def list(self, request, *args, **kwargs):
-        current_user = self.request.user
-        books = Book.objects.filter(author=current_user)
+        books = self.filter_queryset(self.get_queryset())
 
         self.check_object_permissions(self.request, books)
 
+        # only the requested page is loaded and serialized
+        page = self.paginate_queryset(books)
+
         # check for any book object
-        if books.exists():
-            serializer = self.serializer_class(books, many=True)
-            return Response(serializer.data)
+        if page:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         else:
             response_data = {
                 'message': 'You have no books yet. Click link below to add a new book',
@@ -70,7 +267,7 @@ class AuthorBooksView(generics.ListAPIView):
             return Response(response_data)
 
 
-class AllBooksView(generics.ListAPIView):
+class AllBooksView(RowListMixin, SparseFieldsetMixin, ConditionalMixin, CachedResponseMixin, AsyncReadMixin, generics.ListAPIView):
     '''
         View that displays a list of all available books
     '''
@@ -78,13 +275,22 @@ class AllBooksView(generics.ListAPIView):
     serializer_class = serializers.BookDetailsSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = DefaultPagination
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [FullTextSearchFilter, filters.OrderingFilter]
     search_fields = ['title', '=author__first_name', '=author__last_name']
     ordering_fields = ['created']
-    queryset = Book.objects.all()
+    queryset = Book.objects.select_related('author')
+
+    def get_cache_scopes(self):
+        return [CATALOG]
 
+    def get_validator_state(self):
+        return self.get_list_state(self.filter_queryset(self.get_queryset()), 'author__updated')
 
-class BookDetailsView(generics.RetrieveUpdateDestroyAPIView):
+    async def aget_validator_state(self):
+        return await self.aget_list_state(self.filter_queryset(self.get_queryset()), 'author__updated')
+
+
+class BookDetailsView(SparseFieldsetMixin, ConditionalMixin, CachedResponseMixin, AsyncReadMixin, generics.RetrieveUpdateDestroyAPIView):
     '''
         View to view, update and delete books depending on level pf permission
     '''
@@ -95,17 +301,38 @@ class BookDetailsView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         current_user = self.request.user
         return Book.objects.filter(author=current_user.pk)
+
+    def get_cache_scopes(self):
+        return [book_scope(self.kwargs['pk'])]
+
+    def get_validator_state(self):
+        return object_state(Book.objects.filter(pk=self.kwargs['pk']), 'author__email')
+
+    async def aget_validator_state(self):
+        return await aobject_state(Book.objects.filter(pk=self.kwargs['pk']), 'author__email')
     
-    def get(self, request, *args, **kwargs):
+    def retrieve(self, request, *args, **kwargs):
         pk = self.kwargs['pk']
 
         try:
-            book = Book.objects.get(pk=pk)
-            serializer = self.serializer_class(book)
-            return Response(serializer.data)
+            book = self.load_fieldset(Book.objects.select_related('author')).get(pk=pk)
+            return self.book_response(book)
+        except Book.DoesNotExist:
+            raise NotFound("This book does not exist")
+
+    async def aread(self, request, *args, **kwargs):
+        pk = self.kwargs['pk']
+
+        try:
+            book = await self.load_fieldset(Book.objects.select_related('author')).aget(pk=pk)
+            return self.book_response(book)
         except Book.DoesNotExist:
             raise NotFound("This book does not exist")
 
+    def book_response(self, book):
+        serializer = self.get_serializer(book)
+        return Response(serializer.data)
+
     def get_object(self):
         pk = self.kwargs['pk']
         book = Book.objects.get(pk=pk)
@@ -122,6 +349,80 @@ class BookDetailsView(generics.RetrieveUpdateDestroyAPIView):
             raise NotFound('Book does not exist')
 
 
+class BookBatchView(ConditionalMixin, CachedResponseMixin, generics.ListAPIView):
+    '''
+        View to get the details of several books at once, e.g. `?ids=12,7,30`.
+        Books come in the order their ids were sent, ids of books that don't
+        exist are reported in their place.
+    '''
+
+    serializer_class = serializers.BookDetailsSerializer
+    permission_classes = [IsAuthenticated]
+    queryset = Book.objects.select_related('author')
+
+    def get_ids(self):
+        if hasattr(self, '_ids'):
+            return self._ids
+
+        try:
+            ids = [int(value) for value in self.request.query_params.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            raise ValidationError({'message': 'Book ids must be a comma separated list of integers'})
+
+        # repeated ids are sent once, where they first appear
+        ids = list(dict.fromkeys(ids))
+
+        if not ids:
+            raise ValidationError({'message': 'Send the ids of the books to get'})
+        elif len(ids) > settings.BOOK_BATCH_MAX_IDS:
+            raise ValidationError({'message': f'At most {settings.BOOK_BATCH_MAX_IDS} books can be fetched at once'})
+
+        self._ids = ids
+        return ids
+
+    def get_cache_scopes(self):
+        return [book_scope(pk) for pk in self.get_ids()]
+
+    def get_validator_state(self):
+        # at most BOOK_BATCH_MAX_IDS rows, each author's email is part of the validators
+        return rows_state(Book.objects.filter(pk__in=self.get_ids()), 'author__email')
+
+    def list(self, request, *args, **kwargs):
+        ids = self.get_ids()
+        # one query for every book, whatever the number of ids
+        books = self.get_queryset().in_bulk(ids)
+
+        serialized = dict(zip(books, self.get_serializer(list(books.values()), many=True).data))
+        results = [serialized[pk] if pk in serialized else {'id': pk, 'message': 'This book does not exist'} for pk in ids]
+
+        return Response({'results': results})
+
+
+class BookDownloadView(generics.GenericAPIView):
+    '''
+        View to download a book file, whole or by byte range
+    '''
+
+    permission_classes = [IsAuthenticated]
+    queryset = Book.objects.all()
+
+    def perform_content_negotiation(self, request, force=False):
+        # clients ask for the file's own type, not one of the API renderers
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, *args, **kwargs):
+        book = self.get_object()
+
+        if not book.book_file:
+            raise NotFound('This book has no file.')
+
+        # stored files are named by their content, download them under the book's title
+        extension = os.path.splitext(book.book_file.name)[1]
+        filename = (slugify(book.title) or 'book') + extension
+
+        return downloads.file_response(request, book.book_file.storage, book.book_file.name, filename=filename)
+
+
 class AddCommentView(generics.CreateAPIView):
     '''
         View to add a new comment
@@ -136,7 +437,7 @@ class AddCommentView(generics.CreateAPIView):
         return Response(serializer.data)
     
 
-class CommentDetailsView(generics.RetrieveUpdateDestroyAPIView):
+class CommentDetailsView(ConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
     '''
         View to get, update and delete a comment
     '''
@@ -147,6 +448,9 @@ class CommentDetailsView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         pk = self.kwargs['pk']
         return Comment.objects.filter(pk=pk)
+
+    def get_validator_state(self):
+        return object_state(self.get_queryset(), 'book__title', 'commenter__email', 'book__author__email')
     
     def get_object(self):
         pk = self.kwargs['pk']
@@ -154,12 +458,12 @@ class CommentDetailsView(generics.RetrieveUpdateDestroyAPIView):
         self.check_object_permissions(self.request, comment)
         return comment
     
-    def get(self, request, *args, **kwargs):
+    def retrieve(self, request, *args, **kwargs):
         pk = self.kwargs['pk']
 
         try:
             comment = Comment.objects.get(pk=pk)
-            serializer = self.serializer_class(comment)
+            serializer = self.get_serializer(comment)
             return Response(serializer.data)
         except Comment.DoesNotExist:
             raise NotFound('This commment does not exist.')
@@ -173,48 +477,27 @@ class CommentDetailsView(generics.RetrieveUpdateDestroyAPIView):
         
     def delete(self, request, *args, **kwargs):
         try:
-            pk = self.kwargs['pk']
-            comment = Comment.objects.get(pk=pk)
+            comment = self.get_object()
 
-            # get book object
-            book_obj = comment.book
+            with transaction.atomic():
+                self.check_preconditions()
 
-            self.check_object_permissions(request, comment)
-            
-            # reduce number of comments by 1
-            book_obj.no_of_comments -= 1
+                # lock the comment so a concurrent update or delete can't change the rating we uncount
+                rating = Comment.objects.select_for_update().values_list('rating', flat=True).get(pk=comment.pk)
 
-            if book_obj.no_of_ratings == 1:
-                book_obj.average_rating = 0.00
-        
-                # reduce number of ratings by 1
-                book_obj.no_of_ratings -= 1
-            else:
-                # get existing ratings sum
-                existing_ratings_sum = book_obj.average_rating * book_obj.no_of_ratings
-                
-                # get the rating for the specific comment
-                current_comment_rating = comment.rating
-
-                # subtract current comment rating from the existing rating sum
-                new_ratings_sum = existing_ratings_sum -current_comment_rating
-
-                # reduce number of ratings by 1
-                book_obj.no_of_ratings -= 1
+                deleted, _ = Comment.objects.filter(pk=comment.pk).delete()
 
-                # get new average rating
-                book_obj.average_rating = new_ratings_sum / book_obj.no_of_ratings
+                # a concurrent delete may have got there first, its rating is uncounted once
+                if not deleted:
+                    raise NotFound('This comment does not exist.')
+                ratings.remove_rating(comment.book_id, rating)
 
-            # save book instance gotten from comment model
-            book_obj.save()
-
-            super().delete(request, *args, **kwargs)
             return Response({'message': 'Comment deleted'})
         except Comment.DoesNotExist:
             raise NotFound('This comment does not exist.')
         
 
-class AllBookCommentsView(generics.ListAPIView):
+class AllBookCommentsView(RowListMixin, ConditionalMixin, AsyncReadMixin, generics.ListAPIView):
     '''
         View to get all comments for a book
     '''
@@ -227,27 +510,34 @@ class AllBookCommentsView(generics.ListAPIView):
 
     def get_queryset(self):
         pk = self.kwargs['pk']
-        return Comment.objects.filter(book=pk)
+        return Comment.objects.filter(book=pk).select_related('commenter', 'book__author')
+
+    def get_validator_state(self):
+        return self.get_list_state(self.filter_queryset(self.get_queryset()), *COMMENT_LIST_RELATED)
+
+    async def aget_validator_state(self):
+        return await self.aget_list_state(self.filter_queryset(self.get_queryset()), *COMMENT_LIST_RELATED)
     
     def list(self, request, *args, **kwargs):
         try:
-            pk = self.kwargs['pk']
-            book_comments =  Comment.objects.filter(book=pk)
-
-            if book_comments.exists():
-                serializer = self.serializer_class(book_comments, many=True)
-                return Response(serializer.data)
-            else:
-                response_data = {
-                    'message': 'This book has no comments or does not exist. Click link below to add a comment',
-                    # 'link': reverse('book:bookComments')
-                }
-                return Response(response_data)
+            book_comments = self.filter_queryset(self.get_queryset())
+            return self.paged_response(self.paginate_queryset(book_comments))
         except Comment.DoesNotExist:
             raise NotFound('This commnet does not exist')
+
+    def paged_response(self, page):
+        if page:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        else:
+            response_data = {
+                'message': 'This book has no comments or does not exist. Click link below to add a comment',
+                # 'link': reverse('book:bookComments')
+            }
+            return Response(response_data)
         
 
-class AllUserCommentsView(generics.ListAPIView):
+class AllUserCommentsView(RowListMixin, ConditionalMixin, AsyncReadMixin, generics.ListAPIView):
     '''
         View tp get all user comments
     '''
@@ -259,15 +549,22 @@ class AllUserCommentsView(generics.ListAPIView):
 
     def get_queryset(self):
         current_user = self.request.user
-        return Comment.objects.filter(commenter=current_user)
+        return Comment.objects.filter(commenter=current_user).select_related('commenter', 'book__author')
+
+    def get_validator_state(self):
+        return self.get_list_state(self.filter_queryset(self.get_queryset()), *COMMENT_LIST_RELATED)
+
+    async def aget_validator_state(self):
+        return await self.aget_list_state(self.filter_queryset(self.get_queryset()), *COMMENT_LIST_RELATED)
 
     def list(self, request, *args, **kwargs):
-        current_user = self.request.user
-        user_comments = Comment.objects.filter(commenter=current_user)
+        user_comments = self.filter_queryset(self.get_queryset())
+        return self.paged_response(self.paginate_queryset(user_comments))
 
-        if user_comments.exists():
-            serializer = self.serializer_class(user_comments, many=True)
-            return Response(serializer.data)
+    def paged_response(self, page):
+        if page:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         else:
             response_data = {
                 'message': 'This book has no comments. Click link below to add a comment',
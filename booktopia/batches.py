@@ -0,0 +1,85 @@
+'''
+Helpers to work on rows a batch at a time.
+
+chunked() splits an iterable into lists without reading all of it, and
+CommitBatch collects values to handle together once the transaction that
+collected them commits.
+
+Signal receivers see one row at a time, e.g. post_delete sends one signal per
+book a cascade deleted. Values they add to a CommitBatch inside a batched()
+block are handled together when the block's transaction commits, so deleting
+a user with thousands of books runs one query per batch instead of one per
+book. Outside a block each add() is handled on its own once its transaction
+commits.
+'''
+
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+
+_blocks = threading.local()
+
+
+def chunked(rows, size):
+    '''Function to yield lists of `size` rows, and the rest, from an iterable'''
+
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class CommitBatch:
+    '''Values added while a transaction runs, handed to `handler` once it commits'''
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def add(self, values, using=None):
+        values = list(values)
+        if not values:
+            return
+
+        pending = getattr(_blocks, 'pending', None)
+
+        if pending is not None:
+            pending.setdefault(self, []).extend(values)
+        else:
+            # right away outside a transaction
+            transaction.on_commit(lambda: self.handler(values), using=using)
+
+
+def handle_pending(pending):
+    for batch, values in pending.items():
+        batch.handler(values)
+
+
+@contextmanager
+def batched(using=None):
+    '''
+        Atomic block whose CommitBatch values are handled together once it
+        commits. Nested blocks belong to the outermost one, and the values
+        of a block that raises are dropped with its transaction.
+    '''
+
+    if getattr(_blocks, 'pending', None) is not None:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    pending = _blocks.pending = {}
+
+    try:
+        with transaction.atomic(using=using):
+            yield
+            transaction.on_commit(lambda: handle_pending(pending), using=using)
+    finally:
+        _blocks.pending = None
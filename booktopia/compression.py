@@ -0,0 +1,103 @@
+'''
+Compression of API responses.
+
+JSON and MessagePack responses of at least COMPRESSION_MIN_SIZE bytes are
+sent with the best content coding the client accepts: Brotli when brotli is
+installed, otherwise gzip. Cached responses keep the compressed bytes of
+each coding next to the plain content, see book.cache.
+
+HTML is never compressed. The browsable API's pages carry a CSRF token,
+and compressing secrets next to content an attacker can influence exposes
+them to BREACH.
+
+A compressed body isn't the same bytes as the plain one, so like Django's
+GZipMiddleware it gets the weak form of the response's ETag. If-None-Match
+compares weakly and works with either, If-Match compares strongly and needs
+the ETag of an uncompressed response.
+
+The middleware works under ASGI too, where responses are compressed in a
+thread rather than on the event loop.
+'''
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# codings in the order they're preferred when the client accepts several equally
+ENCODINGS = (['br'] if brotli is not None else []) + ['gzip']
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack')
+
+
+def accepted_encoding(request):
+    '''Function to get the preferred coding the request's Accept-Encoding allows, or None for none'''
+
+    weights = {}
+
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, parameters = part.strip().partition(';')
+        weight = 1.0
+        parameter = parameters.strip()
+
+        if parameter.startswith('q='):
+            try:
+                weight = float(parameter[2:])
+            except ValueError:
+                weight = 0.0
+
+        if coding:
+            weights[coding.strip().lower()] = weight
+
+    choices = [(weights.get(coding, weights.get('*', 0.0)), -rank, coding) for rank, coding in enumerate(ENCODINGS)]
+    weight, _, coding = max(choices)
+
+    return coding if weight > 0 else None
+
+
+def is_compressible(content_type, content):
+    return len(content) >= settings.COMPRESSION_MIN_SIZE and (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+    return compress_string(content)
+
+
+def encode_response(response, encoding, content):
+    '''Function to send `content`, compressed with `encoding`, as the body of a response'''
+
+    response.content = content
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(content))
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    '''Middleware that compresses responses with the coding the client prefers'''
+
+    def process_response(self, request, response):
+        # file downloads stream, and bodies already encoded (e.g. cache hits) are sent as they are
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        elif not is_compressible(response.get('Content-Type'), response.content):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = accepted_encoding(request)
+        if encoding is not None:
+            encode_response(response, encoding, compress(response.content, encoding))
+
+        return response
@@ -0,0 +1,112 @@
+'''
+Expiring signed URLs for uploaded media.
+
+A signed URL carries its expiry time and an HMAC-SHA256 of the file name and
+expiry made with MEDIA_SIGNING_KEY, so anything that knows the key can check
+it without a database lookup: the serve_signed_media view below, or the front
+web server itself.
+'''
+
+import base64
+import hashlib
+import hmac
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models
+from django.http import HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from rest_framework import serializers
+
+from book.downloads import file_response
+
+
+def current_expiry():
+    '''
+        Function to get the expiry time of URLs signed now.
+
+        Expiry is rounded up to a multiple of MEDIA_URL_TTL, so URLs stay the
+        same for a while and responses that contain them can still be cached,
+        and every URL is valid for at least MEDIA_URL_TTL seconds.
+    '''
+
+    ttl = settings.MEDIA_URL_TTL
+    return (int(time.time()) // ttl + 2) * ttl
+
+
+def signature(name, expires):
+    message = f'{name}\n{expires}'.encode()
+    digest = hmac.new(settings.MEDIA_SIGNING_KEY.encode(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def sign_url(name):
+    '''Function to get the signed URL of a stored file'''
+
+    expires = current_expiry()
+    return f'{settings.SIGNED_MEDIA_URL}{quote(name)}?expires={expires}&signature={signature(name, expires)}'
+
+
+def verify(name, expires, given_signature):
+    '''Function to check a signed URL's file name, expiry and signature'''
+
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+
+    if expires < time.time():
+        return False
+
+    return constant_time_compare(signature(name, expires), given_signature or '')
+
+
+@require_GET
+def serve_signed_media(request, name):
+    '''View to send a file to anyone holding an unexpired signed URL for it'''
+
+    expires = request.GET.get('expires')
+
+    if not verify(name, expires, request.GET.get('signature')):
+        return HttpResponseForbidden('This link is invalid or has expired.')
+
+    response = file_response(request, default_storage, name, as_attachment=False)
+    response['Cache-Control'] = f'private, max-age={max(int(expires) - int(time.time()), 0)}'
+    return response
+
+
+class SignedURLMixin:
+    '''Represent a file by its signed URL instead of its MEDIA_URL'''
+
+    def to_representation(self, value):
+        if not value:
+            return None
+
+        url = sign_url(value.name)
+        request = self.context.get('request', None)
+
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class SignedFileField(SignedURLMixin, serializers.FileField):
+    pass
+
+
+class SignedImageField(SignedURLMixin, serializers.ImageField):
+    pass
+
+
+class SignedMediaSerializerMixin:
+    '''ModelSerializer mixin that represents every file and image field by a signed URL'''
+
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.FileField: SignedFileField,
+        models.ImageField: SignedImageField,
+    }
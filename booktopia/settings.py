@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'booktopia.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,6 +103,46 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# locmem is per process, use file on a single node and redis or memcached when several nodes share the cache
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache') if CACHE_BACKEND == 'file' else 'booktopia'),
+    }
+}
+
+# cache used for catalog and book detail responses, and how long entries live in seconds
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
+# responses of at least COMPRESSION_MIN_SIZE bytes are compressed with Brotli, when brotli is
+# installed, or gzip, and COMPRESSION_BROTLI_QUALITY trades Brotli's speed for size (0-11)
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))
+
+# list views of books and comments build their pages from values() rows instead of model serializers, see book.rows
+FAST_LIST_SERIALIZATION = True
+
+# book and comment reads run on the event loop with the async ORM under ASGI, see book.asynchronous;
+# opt-in until it's measured faster than sync views against the production database
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', '0') == '1'
+
+# most books one request to bookBatch/ may ask for
+BOOK_BATCH_MAX_IDS = int(os.getenv('BOOK_BATCH_MAX_IDS', 100))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -120,6 +162,42 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/4.1/topics/auth/passwords/
+# the preferred hasher makes new hashes, the others only check old ones, which are
+# made again with the preferred hasher and work factor when their user logs in
+
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'user.hashers.PBKDF2PasswordHasher')
+
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [hasher for hasher in [
+    'user.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+] if hasher != PASSWORD_HASHER]
+
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', 390000))
+
+# most password hashes running at once for logins and password changes, each holding a slot
+# in the PASSWORD_HASH_CACHE_ALIAS cache, which has to be redis or memcached to hold across
+# processes (checked by `check --deploy`); further requests are not queued but turned away
+# with a 503, see user.passwords; a slot left by a killed process expires after
+# PASSWORD_HASH_SLOT_TIMEOUT seconds
+PASSWORD_HASH_LIMIT = int(os.getenv('PASSWORD_HASH_LIMIT', os.cpu_count() or 1))
+PASSWORD_HASH_CACHE_ALIAS = 'default'
+PASSWORD_HASH_SLOT_TIMEOUT = int(os.getenv('PASSWORD_HASH_SLOT_TIMEOUT', 60))
+
+AUTHENTICATION_BACKENDS = ['user.backends.HashingLimitBackend']
+
+
+# users validated, hashed and inserted together by bulk registration and `manage.py import_users`,
+# and the most users one bulk registration request may send, their passwords are hashed
+# one at a time within the request, so larger imports belong to `manage.py import_users`
+USER_IMPORT_CHUNK_SIZE = int(os.getenv('USER_IMPORT_CHUNK_SIZE', 1000))
+BULK_REGISTER_MAX_USERS = int(os.getenv('BULK_REGISTER_MAX_USERS', 20))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
@@ -145,10 +223,67 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# uploads are stored once per distinct content, under sharded names derived from it,
+# `manage.py migrate_media_storage` moves files saved before into it
+DEFAULT_FILE_STORAGE = 'book.storage.ContentAddressedStorage'
+
+# chunked book uploads are assembled here before they are moved into MEDIA_ROOT,
+# keep it on the same filesystem so the move is a rename
+BOOK_UPLOAD_ROOT = os.path.join(MEDIA_ROOT, 'uploads')
+BOOK_UPLOAD_MAX_SIZE = int(os.getenv('BOOK_UPLOAD_MAX_SIZE', 500 * 1024 * 1024))
+
+# seconds an upload that gets no more chunks is kept, and how many unfinished uploads an author may have
+BOOK_UPLOAD_TTL = int(os.getenv('BOOK_UPLOAD_TTL', 24 * 3600))
+BOOK_UPLOAD_MAX_OPEN = int(os.getenv('BOOK_UPLOAD_MAX_OPEN', 5))
+
+# let the front web server send book downloads: 'nginx' for X-Accel-Redirect to an internal
+# location at BOOK_DOWNLOAD_ACCEL_PREFIX that aliases MEDIA_ROOT, 'sendfile' for X-Sendfile
+BOOK_DOWNLOAD_ACCEL = os.getenv('BOOK_DOWNLOAD_ACCEL')
+BOOK_DOWNLOAD_ACCEL_PREFIX = os.getenv('BOOK_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+
+# books validated, copied and inserted per transaction by `manage.py import_books` and admins' book imports,
+# threads copying their files, the most books one import request may send, and the directory its paths are under;
+# requests copy their files before they respond, so larger imports belong to `manage.py import_books`
+BOOK_IMPORT_CHUNK_SIZE = int(os.getenv('BOOK_IMPORT_CHUNK_SIZE', 500))
+BOOK_IMPORT_WORKERS = int(os.getenv('BOOK_IMPORT_WORKERS', 8))
+BOOK_IMPORT_MAX_BOOKS = int(os.getenv('BOOK_IMPORT_MAX_BOOKS', 50))
+BOOK_IMPORT_ROOT = os.getenv('BOOK_IMPORT_ROOT', os.path.join(BASE_DIR, 'imports'))
+
+# media links returned by the API are signed with this key and expire after at least MEDIA_URL_TTL seconds
+MEDIA_SIGNING_KEY = os.getenv('MEDIA_SIGNING_KEY', SECRET_KEY)
+MEDIA_URL_TTL = int(os.getenv('MEDIA_URL_TTL', 3600))
+SIGNED_MEDIA_URL = '/signedMedia/'
+
+# cover renditions: widths in pixels, encoder quality, and processes rendering them off the
+# request thread (0 renders them in the thread that saved the book)
+COVER_RENDITION_WIDTHS = [160, 320, 640]
+COVER_RENDITION_QUALITY = int(os.getenv('COVER_RENDITION_QUALITY', 80))
+COVER_RENDITION_WORKERS = int(os.getenv('COVER_RENDITION_WORKERS', 2))
+
 AUTH_USER_MODEL = 'user.CustomUser'
 
+# MessagePack is sent to clients that ask for it with `Accept: application/msgpack`,
+# and read from requests with that Content-Type, when msgpack is installed
+MSGPACK_ENABLED = find_spec('msgpack') is not None
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication"
-    ]
+        "user.authentication.CachedTokenAuthentication"
+    ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "booktopia.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ] + (["booktopia.renderers.MessagePackRenderer"] if MSGPACK_ENABLED else []),
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ] + (["booktopia.renderers.MessagePackParser"] if MSGPACK_ENABLED else []),
 }
+
+# authenticated tokens are kept in the shared cache, in front of the database
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+
+# seconds after which tokens expire and have to be replaced by logging in again, unset for tokens that never expire
+AUTH_TOKEN_TTL = int(os.environ['AUTH_TOKEN_TTL']) if os.getenv('AUTH_TOKEN_TTL') else None
@@ -3,10 +3,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .media import serve_signed_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('user.urls')),
-    path('book/', include('book.urls'))
+    path('book/', include('book.urls')),
+    path(settings.SIGNED_MEDIA_URL.lstrip('/') + '<path:name>', serve_signed_media, name='signedMedia'),
 ]
 
 if settings.DEBUG:
@@ -7,6 +7,8 @@ from .forms import UserChangeForm, UserCreationForm
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 
+from booktopia.batches import batched
+
 User = get_user_model()
 
 
@@ -33,5 +35,14 @@ class UserAdmin(UserAdmin):
     ordering = ('email',)
     filter_horizontal = ('groups', 'user_permissions',)
 
+    # the files, index entries and cached responses of a user's books are cleaned up together
+    def delete_model(self, request, obj):
+        with batched():
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with batched():
+            super().delete_queryset(request, queryset)
+
 
 admin.site.register(User, UserAdmin)
@@ -0,0 +1,140 @@
+'''
+Token authentication backed by a cache.
+
+Tokens are looked up in the shared cache before the database. An entry only
+holds the token's user fields in CACHED_USER_FIELDS, those the permission
+classes read, and when the token was created, the user's other fields are
+loaded when a request first uses them. Deleting a token or saving its user
+removes its entry, so logouts, deactivations and role changes apply right
+away in every process. There is deliberately no in-process cache in front of
+the shared one, its entries couldn't be removed from the other processes.
+'''
+
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+# user fields kept with cached tokens, checked by the views' permissions without loading the user
+CACHED_USER_FIELDS = ('id', 'is_active', 'role', 'is_staff')
+
+
+def get_cache():
+    return caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+
+
+def token_key(key):
+    # raw tokens are credentials, keep them out of cache keys; entries before CACHED_USER_FIELDS are left to expire
+    return 'booktopia:token:v2:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def is_expired(created):
+    '''Function to check if a token created at `created` is older than AUTH_TOKEN_TTL'''
+
+    ttl = settings.AUTH_TOKEN_TTL
+    return ttl is not None and created < timezone.now() - timedelta(seconds=ttl)
+
+
+def _forget(keys):
+    get_cache().delete_many([token_key(key) for key in keys])
+
+
+def invalidate_tokens(keys):
+    '''Function to drop tokens from the caches, now and once the current transaction commits'''
+
+    keys = list(keys)
+    if not keys:
+        return
+
+    _forget(keys)
+
+    # a request that read the token before this transaction commits could cache it again
+    transaction.on_commit(lambda: _forget(keys))
+
+
+def invalidate_user_tokens(user_id):
+    invalidate_tokens(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+
+class TokenKeyReader(TokenAuthentication):
+    '''TokenAuthentication whose authenticate() only parses the header, getting the token sent'''
+
+    def authenticate_credentials(self, key):
+        return key
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+        TokenAuthentication that looks tokens up in the caches before the
+        database. Async views authenticate with aauthenticate(), see book.asynchronous.
+    '''
+
+    def get_key(self, request):
+        '''Function to get the token sent in the Authorization header, or None if there's none'''
+
+        reader = TokenKeyReader()
+        reader.keyword = self.keyword
+        return reader.authenticate(request)
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        return None if key is None else await self.aauthenticate_credentials(key)
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        entry = cache.get(token_key(key))
+
+        if entry is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+
+            entry = self.get_entry(token)
+            cache.set(token_key(key), entry, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+        return self.check_entry(key, entry)
+
+    async def aauthenticate_credentials(self, key):
+        cache = get_cache()
+        entry = await cache.aget(token_key(key))
+
+        if entry is None:
+            try:
+                token = await Token.objects.select_related('user').aget(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+
+            entry = self.get_entry(token)
+            await cache.aset(token_key(key), entry, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+        return self.check_entry(key, entry)
+
+    def get_entry(self, token):
+        '''Function to get the cache entry of a token, the values of its user's CACHED_USER_FIELDS and when it was created'''
+
+        return (*(getattr(token.user, field) for field in CACHED_USER_FIELDS), token.created)
+
+    def check_entry(self, key, entry):
+        '''Function to get the user and token of a cached entry, see get_entry(), if the token can still be used'''
+
+        *values, created = entry
+        user = User.from_db(None, CACHED_USER_FIELDS, values)
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        elif is_expired(created):
+            raise exceptions.AuthenticationFailed('Token has expired.')
+
+        # the user's other fields are deferred, see CustomUser.refresh_from_db()
+        return (user, Token(key=key, user=user, created=created))
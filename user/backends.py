@@ -0,0 +1,22 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+from . import passwords
+
+
+class HashingLimitBackend(ModelBackend):
+    '''
+        ModelBackend that checks passwords within the hashing limit, see
+        user.passwords. Unknown emails still cost a hash, and outdated hashes
+        are made again with the current policy, like ModelBackend does.
+    '''
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        try:
+            return passwords.get_pool().run(super().authenticate, request, username, password, **kwargs)
+        except passwords.PasswordHashingBusy:
+            # django.contrib.auth.authenticate() stops at PermissionDenied and fails the login,
+            # passwords.authenticate() turns it into the 503 of DRF views
+            if request is not None:
+                request.password_hashing_busy = True
+            raise PermissionDenied()
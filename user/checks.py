@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+
+@register(deploy=True)
+def check_password_hash_cache(app_configs, **kwargs):
+    '''The hashing limit is only shared by processes that share its cache, see user.passwords'''
+
+    cache = caches[settings.PASSWORD_HASH_CACHE_ALIAS]
+
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return [Error(
+            f'PASSWORD_HASH_CACHE_ALIAS {settings.PASSWORD_HASH_CACHE_ALIAS!r} is not shared by the server processes.',
+            hint='Point it at a redis or memcached cache, e.g. with CACHE_BACKEND, so PASSWORD_HASH_LIMIT holds across processes.',
+            id='user.E001',
+        )]
+
+    return []
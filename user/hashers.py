@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    '''
+        PBKDF2 with its work factor set by PASSWORD_PBKDF2_ITERATIONS.
+
+        Hashes made with another number of iterations are upgraded the next
+        time their user logs in.
+    '''
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
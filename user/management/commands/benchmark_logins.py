@@ -0,0 +1,58 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand
+
+from user import passwords
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure how many password checks per second logins can do, in total and per core: one at a time, '
+        'then from simultaneous requests within the hashing limit, which turns away checks beyond it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Number of password checks to run')
+        parser.add_argument('--concurrency', type=int, default=16, help='Number of simultaneous login requests to simulate')
+
+    def measure(self, check, logins, concurrency):
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as requests:
+            results = list(requests.map(lambda _: check(), range(logins)))
+
+        elapsed = time.perf_counter() - started
+        return sum(results), elapsed
+
+    def handle(self, *args, **options):
+        logins = options['logins']
+        concurrency = options['concurrency']
+        cores = os.cpu_count() or 1
+        encoded = make_password('benchmark-password')
+
+        pool = passwords.get_pool()
+
+        def pooled():
+            try:
+                return pool.run(check_password, 'benchmark-password', encoded)
+            except passwords.PasswordHashingBusy:
+                return False
+
+        def inline():
+            return check_password('benchmark-password', encoded)
+
+        self.stdout.write(
+            f'{logins} logins on {cores} cores, hasher {encoded.split("$")[0]}, '
+            f'limit of {pool.limit} hashes at once'
+        )
+
+        for name, check, simultaneous in (('one at a time', inline, 1), ('hashing limit', pooled, concurrency)):
+            accepted, elapsed = self.measure(check, logins, simultaneous)
+            rate = accepted / elapsed
+            self.stdout.write(
+                f'{name:>13}: {simultaneous:3} requests, {rate:8.1f} logins/s, {rate / cores:8.1f} logins/s per core, '
+                f'{logins - accepted} turned away, {elapsed:.2f}s'
+            )
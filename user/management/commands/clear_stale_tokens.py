@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+
+class Command(BaseCommand):
+    help = 'Delete expired tokens and the tokens of inactive users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=settings.AUTH_TOKEN_TTL, help='Seconds after which tokens are stale, AUTH_TOKEN_TTL by default')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of tokens deleted per query')
+        parser.add_argument('--dry-run', action='store_true', help='Count stale tokens without deleting them')
+
+    def handle(self, *args, **options):
+        condition = Q(user__is_active=False)
+
+        if options['max_age'] is not None:
+            condition |= Q(created__lt=timezone.now() - timedelta(seconds=options['max_age']))
+
+        stale = Token.objects.filter(condition)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Found {stale.count()} stale tokens.'))
+            return
+
+        deleted = 0
+
+        while True:
+            # delete a batch at a time so the table isn't locked for long
+            keys = list(stale.order_by('key').values_list('key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+
+            # deletes go through the ORM so the tokens are dropped from the authentication caches
+            Token.objects.filter(key__in=keys).delete()
+            deleted += len(keys)
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stale tokens.'))
@@ -0,0 +1,61 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from user import provisioning
+
+
+class Command(BaseCommand):
+    help = 'Create users and their tokens from a CSV file with a header row, or a JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with one user per row: email, first_name, last_name, password, and optionally gender and role')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Format of the file, guessed from its extension by default')
+        parser.add_argument('--chunk-size', type=int, default=settings.USER_IMPORT_CHUNK_SIZE, help='Number of users validated and inserted together')
+        parser.add_argument('--workers', type=int, help='Number of threads hashing passwords, one per core by default')
+
+    def read_rows(self, file, file_format):
+        if file_format == 'csv':
+            for row in csv.DictReader(file):
+                # empty cells fall back to the field defaults
+                yield {key: value for key, value in row.items() if value not in ('', None)}
+            return
+
+        for line in file:
+            if not line.strip():
+                continue
+
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # reported as an invalid row
+                yield line
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        totals = {'created': 0, 'failed': 0}
+
+        def report(created, errors):
+            totals['created'] += created
+            totals['failed'] += len(errors)
+
+            for error in errors:
+                self.stdout.write(f'Row {error["row"]}: {json.dumps(error["errors"])}', self.style.WARNING)
+
+            self.stdout.write(f'{totals["created"]} users created, {totals["failed"]} rows failed so far')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                provisioning.provision_users(
+                    self.read_rows(file, file_format),
+                    chunk_size=options['chunk_size'],
+                    workers=options['workers'],
+                    on_chunk=report
+                )
+        except OSError as error:
+            raise CommandError(f'Could not read {path}: {error}')
+
+        self.stdout.write(self.style.SUCCESS(f'Created {totals["created"]} users, {totals["failed"]} rows failed.'))
@@ -37,6 +37,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_superuser = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
+    # moved on by saves of the user's details, not by logins or rehashed passwords, see book.conditional
+    updated = models.DateTimeField(auto_now=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -45,3 +47,12 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     def __str__(self):
         return self.email
+
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+
+        # users authenticated by a cached token load all their other fields on the first one used
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+
+        super().refresh_from_db(using, fields)
@@ -0,0 +1,117 @@
+'''
+Password hashing within a limit shared by every process.
+
+Hashing is deliberately slow, so a burst of logins can take every worker.
+At most PASSWORD_HASH_LIMIT hashes run at once across the processes sharing
+the PASSWORD_HASH_CACHE_ALIAS cache, each holding a slot key there. Hashes
+run in the request's own thread and nothing is queued: requests beyond the
+limit are turned away with a 503 and Retry-After right away, instead of
+holding their worker while they wait for a slot, and clients retry. The
+cache has to be shared by the processes, e.g. redis or memcached, a local
+memory cache only limits each process on its own, see user.checks.
+
+Logins go through authenticate() below, which is django.contrib.auth's with
+the 503 raised for DRF views. Other callers of django.contrib.auth's, e.g.
+the admin, see a login turned away as failed credentials, see user.backends.
+'''
+
+import uuid
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins at the moment, try again shortly.'
+    default_code = 'password_hashing_busy'
+    # sent as Retry-After
+    wait = 1
+
+
+class HashingPool:
+    '''
+        Slots for `limit` hashes at once, one cache key each so every process
+        sharing the cache takes from the same slots. Hashes run in the calling
+        thread.
+    '''
+
+    key = 'booktopia:password-hashing:slot'
+
+    def __init__(self, limit, cache_alias='default', timeout=60):
+        self.limit = limit
+        self.cache = caches[cache_alias]
+        # slots of processes killed while hashing are freed once their key expires
+        self.timeout = timeout
+
+    def slot_keys(self):
+        return [f'{self.key}:{slot}' for slot in range(self.limit)]
+
+    def acquire(self):
+        '''Returns the slot taken, or None when every slot is taken'''
+
+        holder = uuid.uuid4().hex
+
+        for key in self.slot_keys():
+            if self.cache.add(key, holder, self.timeout):
+                return key, holder
+
+        return None
+
+    def release(self, slot):
+        key, holder = slot
+
+        # a slot that expired while hashing may have been taken by another hash since
+        if self.cache.get(key) == holder:
+            self.cache.delete(key)
+
+    def run(self, function, *args, **kwargs):
+        slot = self.acquire()
+
+        if slot is None:
+            raise PasswordHashingBusy()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.release(slot)
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+
+    if _pool is None:
+        _pool = HashingPool(settings.PASSWORD_HASH_LIMIT, settings.PASSWORD_HASH_CACHE_ALIAS, settings.PASSWORD_HASH_SLOT_TIMEOUT)
+
+    return _pool
+
+
+def authenticate(request, **credentials):
+    '''django.contrib.auth.authenticate() that raises PasswordHashingBusy for logins turned away'''
+
+    user = auth.authenticate(request, **credentials)
+
+    if user is None and getattr(request, 'password_hashing_busy', False):
+        raise PasswordHashingBusy()
+
+    return user
+
+
+def hash_password(password):
+    return get_pool().run(make_password, password)
+
+
+def set_password(user, password):
+    '''Function to set a user's password like User.set_password(), hashing it within the limit'''
+
+    user.password = hash_password(password)
+    # picked up by the password validators once the user is saved
+    user._password = password
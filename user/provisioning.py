@@ -0,0 +1,136 @@
+'''
+Bulk creation of users and their tokens.
+
+Rows are validated one by one, but emails are checked a chunk at a time,
+passwords are hashed in parallel and users and tokens are inserted with one
+bulk_create each per chunk. A row that fails is reported with its errors and
+the others are still created.
+
+`manage.py import_users` hashes with a thread per core. Bulk registration
+requests hash one password at a time within the limit logins share, see
+user.passwords, so they're kept to a few users.
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+
+from rest_framework.authtoken.models import Token
+
+from booktopia.batches import chunked
+
+from .serializers import BulkUserSerializer
+
+User = get_user_model()
+
+
+def validate_chunk(numbered_rows):
+    '''Function to split (row number, row) pairs into valid users and the errors of the others'''
+
+    valid = []
+    errors = []
+    seen = set()
+
+    for number, row in numbered_rows:
+        serializer = BulkUserSerializer(data=row)
+
+        if not serializer.is_valid():
+            errors.append({'row': number, 'errors': serializer.errors})
+            continue
+
+        data = serializer.validated_data
+        data['email'] = User.objects.normalize_email(data['email'])
+
+        if data['email'].lower() in seen:
+            errors.append({'row': number, 'errors': {'message': 'Email appears more than once'}})
+            continue
+
+        seen.add(data['email'].lower())
+        valid.append((number, data))
+
+    return valid, errors
+
+
+def drop_existing(valid, errors):
+    '''Function to report rows whose email already belongs to a user, in one query'''
+
+    existing = {email.lower() for email in User.objects.filter(email__in=[data['email'] for _, data in valid]).values_list('email', flat=True)}
+    remaining = []
+
+    for number, data in valid:
+        if data['email'].lower() in existing:
+            errors.append({'row': number, 'errors': {'message': 'Email already exists'}})
+        else:
+            remaining.append((number, data))
+
+    return remaining
+
+
+def insert_users(valid, hashes):
+    '''Function to insert users and their tokens, returns the created users'''
+
+    users = [User(**{**data, 'password': password}) for (_, data), password in zip(valid, hashes)]
+
+    with transaction.atomic():
+        users = User.objects.bulk_create(users)
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+
+    return users
+
+
+def insert_each(valid, hashes, errors):
+    '''Function to insert users one at a time, reporting the rows whose email was taken meanwhile'''
+
+    users = []
+
+    for (number, data), password in zip(valid, hashes):
+        try:
+            users += insert_users([(number, data)], [password])
+        except IntegrityError:
+            errors.append({'row': number, 'errors': {'message': 'Email already exists'}})
+
+    return users
+
+
+def provision_users(rows, chunk_size=1000, workers=None, on_chunk=None, hash_password=make_password):
+    '''
+        Function to create users from an iterable of dicts.
+
+        Returns the number of users created and the errors of the rows that
+        weren't, by 1-based row number. Passwords are hashed with
+        `hash_password` in `workers` threads, one per core by default, and
+        `on_chunk(created, errors)` is called after each chunk, e.g. to
+        report progress.
+    '''
+
+    created = 0
+    all_errors = []
+    workers = workers or os.cpu_count() or 1
+
+    # hashing releases the GIL, so threads keep every core busy
+    with ThreadPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+        hash_all = executor.map if executor is not None else map
+
+        for chunk in chunked(enumerate(rows, start=1), chunk_size):
+            valid, errors = validate_chunk(chunk)
+            valid = drop_existing(valid, errors)
+            hashes = list(hash_all(hash_password, [data['password'] for _, data in valid]))
+
+            try:
+                users = insert_users(valid, hashes)
+            except IntegrityError:
+                # an email was taken while the chunk was hashed
+                users = insert_each(valid, hashes, errors)
+
+            created += len(users)
+            errors.sort(key=lambda error: error['row'])
+            all_errors.extend(errors)
+
+            if on_chunk is not None:
+                on_chunk(len(users), errors)
+
+    return created, all_errors
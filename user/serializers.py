@@ -3,6 +3,11 @@ from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 
+from booktopia.media import SignedMediaSerializerMixin
+
+from . import passwords
+from .authentication import is_expired
+
 User = get_user_model()
 
 class CreateAccountSerializer(serializers.ModelSerializer):
@@ -32,10 +37,15 @@ class CreateAccountSerializer(serializers.ModelSerializer):
         elif User.objects.filter(email=data['email']).exists():
             raise serializers.ValidationError({'message': 'Email already exists'})
         
+        return self.validate_account(data)
+
+    def validate_account(self, data):
+        '''Function to check the choices and password of a new account'''
+
         # check if gender and role choices areb valid
-        elif len(data['gender']) > 1:
+        if len(data.get('gender', User.MALE)) > 1:
             raise serializers.ValidationError({'message': 'Gender choice is not valid'})
-        elif data['role'] > 2:
+        elif data.get('role', User.USER) > 2:
             raise serializers.ValidationError({'message': 'Role choice is not valid'})
         
         # validate password
@@ -84,7 +94,7 @@ class LoginSerializer(serializers.Serializer):
         '''Authentication validation function'''
 
         # authenticate user with email and password
-        user = authenticate(email=data['email'], password=data['password'])
+        user = passwords.authenticate(self.context.get('request'), email=data['email'], password=data['password'])
 
         # check for existence of user
         if user is None:
@@ -95,15 +105,20 @@ class LoginSerializer(serializers.Serializer):
         data.pop('password')
 
         # get or create a new token
-        token= Token.objects.get_or_create(user=user)
+        token, created = Token.objects.get_or_create(user=user)
+
+        # expired tokens are replaced when their user logs in again
+        if not created and is_expired(token.created):
+            token.delete()
+            token = Token.objects.create(user=user)
 
         data['message'] = f'Welcome {email}'
-        data['token'] = token[0].key
+        data['token'] = token.key
 
         return data
 
     
-class UpdateDetailsSerializer(serializers.ModelSerializer):
+class UpdateDetailsSerializer(SignedMediaSerializerMixin, serializers.ModelSerializer):
 
     '''
         Serializer to update a user's details (email, first name and last name)
@@ -140,7 +155,7 @@ class ChangePasswordSerializer(serializers.Serializer):
         new_password = validated_data.get('new_password')
         confirm_password = validated_data.get('confirm_password')
 
-        user = authenticate(email=email, password=old_password)
+        user = passwords.authenticate(self.context.get('request'), email=email, password=old_password)
 
         if user is None:
             raise serializers.ValidationError({'message': 'User credentials incorrect. Check your email and password and try again.'})
@@ -150,9 +165,29 @@ class ChangePasswordSerializer(serializers.Serializer):
             raise serializers.ValidationError({'message': 'New password and confirm password field has to be the same.'})
         
         validate_password(new_password)
-        instance.set_password(new_password)
+        passwords.set_password(instance, new_password)
 
         instance.save()
 
         return instance
-    
\ No newline at end of file
+    
+
+class BulkUserSerializer(CreateAccountSerializer):
+    '''
+        Serializer to validate one row of a bulk user import, with the rules
+        of CreateAccountSerializer. Rows have no confirmation password, and
+        emails are checked against existing users a whole chunk at a time by
+        user.provisioning.
+    '''
+
+    password2 = None
+
+    class Meta(CreateAccountSerializer.Meta):
+        fields = ['email', 'first_name', 'last_name', 'gender', 'password', 'role']
+        extra_kwargs = {
+            'email': {'validators': []},
+            'password': {'write_only': True}
+        }
+
+    def validate(self, data):
+        return self.validate_account(data)
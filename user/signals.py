@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from . import authentication
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    '''Logouts and deleted users drop their token from the authentication caches'''
+
+    authentication.invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_token(sender, instance, created=False, **kwargs):
+    '''Cached tokens hold whether their user is active and their role, saves of the user replace them'''
+
+    if created:
+        return
+
+    authentication.invalidate_user_tokens(instance.pk)
@@ -1,3 +1,367 @@
-from django.test import TestCase
+import csv
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from . import authentication, checks, passwords
+from .authentication import CachedTokenAuthentication, get_cache
+
+User = get_user_model()
+
+
+class UpdateDetailsTests(APITestCase):
+    '''Profile details link to the profile picture through a signed URL'''
+
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', password='pass1234word', first_name='Test', last_name='User')
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_profile_pic_is_signed(self):
+        response = self.client.get(reverse('user:update'))
+
+        self.assertIn('/signedMedia/profile_pics/default.png?expires=', response.data['profile_pic'])
+        self.assertIn('&signature=', response.data['profile_pic'])
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    '''Tokens are served from the authentication caches until they change'''
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(email='reader@example.com', password='pass1234word', first_name='Test', last_name='User')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def fetch(self):
+        return self.client.get(reverse('user:update'))
+
+    def test_cached_token_needs_no_queries(self):
+        authenticate = CachedTokenAuthentication().authenticate_credentials
+
+        with self.assertNumQueries(1):
+            authenticate(self.token.key)
+
+        with self.assertNumQueries(0):
+            user, token = authenticate(self.token.key)
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.token.key))
+
+        # permissions read the cached fields, the user's other fields are loaded together once they're used
+        with self.assertNumQueries(0):
+            self.assertEqual((user.role, user.is_staff), (self.user.role, False))
+
+        with self.assertNumQueries(1):
+            self.assertEqual((user.email, user.first_name), (self.user.email, self.user.first_name))
+
+    def test_cached_entry_holds_no_user_details(self):
+        self.assertEqual(self.fetch().status_code, 200)
+
+        entry = get_cache().get(authentication.token_key(self.token.key))
+        self.assertEqual(entry, (self.user.pk, True, self.user.role, False, self.token.created))
+
+    def test_role_change_invalidates_token(self):
+        authenticate = CachedTokenAuthentication().authenticate_credentials
+        authenticate(self.token.key)
+
+        self.user.role = User.AUTHOR
+        self.user.save()
+        self.assertEqual(authenticate(self.token.key)[0].role, self.user.role)
+
+    def test_async_authentication_uses_the_caches(self):
+        authenticate = async_to_sync(CachedTokenAuthentication().aauthenticate_credentials)
+
+        with self.assertNumQueries(1):
+            user, token = authenticate(self.token.key)
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.token.key))
+
+        with self.assertNumQueries(0):
+            authenticate(self.token.key)
+
+        with self.assertRaises(AuthenticationFailed):
+            authenticate('not-a-token')
+
+    def test_async_authentication_parses_headers_like_sync(self):
+        authentication = CachedTokenAuthentication()
+        factory = APIRequestFactory()
+
+        for header in ('Token', 'Token two parts', 'Bearer something'):
+            request = Request(factory.get('/', HTTP_AUTHORIZATION=header))
+
+            try:
+                expected = authentication.authenticate(request)
+            except AuthenticationFailed as error:
+                with self.assertRaisesMessage(AuthenticationFailed, str(error.detail)):
+                    async_to_sync(authentication.aauthenticate)(request)
+            else:
+                self.assertEqual(async_to_sync(authentication.aauthenticate)(request), expected)
+
+        request = Request(factory.get('/', HTTP_AUTHORIZATION=f'Token {self.token.key}'))
+        self.assertEqual(async_to_sync(authentication.aauthenticate)(request)[0].pk, self.user.pk)
+
+    def test_logout_invalidates_token(self):
+        self.fetch()
+        self.client.post(reverse('user:logout'))
+        self.assertEqual(self.fetch().status_code, 401)
+
+    def test_deactivation_invalidates_token(self):
+        self.fetch()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.fetch().status_code, 401)
+
+    def test_password_change_refreshes_cached_user(self):
+        self.fetch()
+        response = self.client.put(reverse('user:change-password'), {
+            'email': 'reader@example.com', 'password': 'pass1234word',
+            'new_password': 'n3w-Passw0rd!', 'confirm_password': 'n3w-Passw0rd!',
+        })
+        self.assertEqual(response.status_code, 200)
+
+        user = CachedTokenAuthentication().authenticate_credentials(self.token.key)[0]
+        self.assertTrue(user.check_password('n3w-Passw0rd!'))
+
+    @override_settings(AUTH_TOKEN_TTL=60)
+    def test_expired_token_is_replaced_on_login(self):
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(self.fetch().status_code, 401)
+
+        self.client.credentials()
+        response = self.client.post(reverse('user:login'), {'email': 'reader@example.com', 'password': 'pass1234word'})
+        self.assertNotEqual(response.data['token'], self.token.key)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {response.data["token"]}')
+        self.assertEqual(self.fetch().status_code, 200)
+
+    def test_stale_tokens_are_cleared(self):
+        inactive = User.objects.create(email='gone@example.com', password='pass1234word', is_active=False)
+        Token.objects.create(user=inactive)
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timedelta(days=30))
+
+        output = StringIO()
+        call_command('clear_stale_tokens', stdout=output)
+        self.assertIn('Deleted 1 stale tokens.', output.getvalue())
+
+        call_command('clear_stale_tokens', '--max-age', str(7 * 24 * 3600), stdout=output)
+        self.assertFalse(Token.objects.exists())
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class PasswordHashingTests(APITestCase):
+    '''Logins check passwords in a bounded pool and upgrade outdated hashes'''
+
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', password='pass1234word', first_name='Test', last_name='User')
+
+    def login(self):
+        return self.client.post(reverse('user:login'), {'email': 'reader@example.com', 'password': 'pass1234word'})
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(self.user.check_password('pass1234word'))
+
+    def test_wrong_password_and_unknown_email(self):
+        response = self.client.post(reverse('user:login'), {'email': 'reader@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('user:login'), {'email': 'nobody@example.com', 'password': 'pass1234word'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_pool_turns_logins_away(self):
+        pool = passwords.HashingPool(limit=1)
+        self.addCleanup(setattr, passwords, '_pool', passwords._pool)
+        passwords._pool = pool
+
+        # the only slot is taken by a login in progress, in this or another process
+        slot = pool.acquire()
+        self.assertIsNotNone(slot)
+        self.addCleanup(pool.cache.delete_many, pool.slot_keys())
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        pool.release(slot)
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(pool.cache.get_many(pool.slot_keys()), {})
+
+    def test_full_pool_fails_other_logins(self):
+        pool = passwords.HashingPool(limit=1)
+        self.addCleanup(setattr, passwords, '_pool', passwords._pool)
+        passwords._pool = pool
+
+        slot = pool.acquire()
+        self.addCleanup(pool.release, slot)
+
+        # the admin and other callers of django.contrib.auth see failed credentials rather than an error
+        request = APIRequestFactory().post('/admin/login/')
+        self.assertIsNone(authenticate(request, email='reader@example.com', password='pass1234word'))
+        self.assertTrue(request.password_hashing_busy)
+
+        with self.assertRaises(passwords.PasswordHashingBusy):
+            passwords.authenticate(APIRequestFactory().post('/'), email='reader@example.com', password='pass1234word')
+
+    def test_pool_cache_must_be_shared(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=local):
+            self.assertEqual([error.id for error in checks.check_password_hash_cache(None)], ['user.E001'])
+
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': '127.0.0.1:11211'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(checks.check_password_hash_cache(None), [])
+
+    def test_expired_slots_never_overshoot_the_limit(self):
+        pool = passwords.HashingPool(limit=2, timeout=1)
+        self.addCleanup(pool.cache.delete_many, pool.slot_keys())
+
+        in_flight = [pool.acquire(), pool.acquire()]
+        self.assertIsNone(pool.acquire())
+
+        # the hashes outlive their slots, as those of a killed process would
+        later = time.time() + 2
+        with mock.patch('time.time', return_value=later):
+            taken = [pool.acquire(), pool.acquire()]
+            self.assertNotIn(None, taken)
+            self.assertIsNone(pool.acquire())
+
+            # the expired hashes finishing leave the slots taken since alone
+            for slot in in_flight:
+                pool.release(slot)
+            self.assertIsNone(pool.acquire())
+
+            pool.release(taken[0])
+            self.assertIsNotNone(pool.acquire())
+            self.assertIsNone(pool.acquire())
+
+    def test_failed_logins_are_signalled(self):
+        failed = []
+        receiver = lambda sender, credentials, **kwargs: failed.append(credentials['email'])
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+
+        self.client.post(reverse('user:login'), {'email': 'reader@example.com', 'password': 'wrong'})
+        self.assertEqual(failed, ['reader@example.com'])
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class BulkProvisioningTests(APITestCase):
+    '''Admins create many users and tokens at once, rows with errors are reported'''
+
+    def setUp(self):
+        self.admin = User.objects.create(email='admin@example.com', password='pass1234word', is_staff=True)
+        token = Token.objects.create(user=self.admin)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def row(self, email, password='s3cure-Passw0rd', **extras):
+        return {'email': email, 'first_name': 'Bulk', 'last_name': 'Reader', 'password': password, **extras}
+
+    def test_batch_registration(self):
+        users = [
+            self.row('one@example.com'),
+            self.row('admin@example.com'),
+            self.row('two@example.com', password='123'),
+            self.row('three@example.com', role=1),
+            self.row('ONE@example.com'),
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('user:bulkRegister'), {'users': users}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 3, 5])
+
+        inserts = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('INSERT INTO "user_customuser"')]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertEqual(User.objects.get(email='three@example.com').role, User.AUTHOR)
+        self.assertEqual(Token.objects.filter(user__email__in=['one@example.com', 'three@example.com']).count(), 2)
+
+        self.client.credentials()
+        response = self.client.post(reverse('user:login'), {'email': 'one@example.com', 'password': 's3cure-Passw0rd'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_email_taken_during_hashing_is_reported(self):
+        hash_password = passwords.hash_password
+
+        def register_meanwhile(password):
+            # another registration commits while this request hashes
+            if not User.objects.filter(email='two@example.com').exists():
+                User.objects.create(email='two@example.com', password='pass1234word')
+            return hash_password(password)
+
+        users = [self.row('one@example.com'), self.row('two@example.com'), self.row('three@example.com')]
+
+        with mock.patch.object(passwords, 'hash_password', register_meanwhile):
+            response = self.client.post(reverse('user:bulkRegister'), {'users': users}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'], [{'row': 2, 'errors': {'message': 'Email already exists'}}])
+
+    @override_settings(BULK_REGISTER_MAX_USERS=2)
+    def test_requests_are_kept_small(self):
+        users = [self.row(f'reader{i}@example.com') for i in range(3)]
+
+        response = self.client.post(reverse('user:bulkRegister'), {'users': users}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('manage.py import_users', response.data['message'])
+
+    def test_hashing_counts_against_the_login_limit(self):
+        pool = passwords.HashingPool(limit=1)
+        self.addCleanup(setattr, passwords, '_pool', passwords._pool)
+        self.addCleanup(pool.cache.delete_many, pool.slot_keys())
+        passwords._pool = pool
+
+        self.assertIsNotNone(pool.acquire())
+        response = self.client.post(reverse('user:bulkRegister'), {'users': [self.row('one@example.com')]}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(User.objects.filter(email='one@example.com').exists())
+
+    def test_admins_only(self):
+        reader = User.objects.create(email='reader@example.com', password='pass1234word')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=reader).key}')
+
+        response = self.client.post(reverse('user:bulkRegister'), {'users': [self.row('one@example.com')]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_import_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'users.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, ['email', 'first_name', 'last_name', 'password', 'gender'])
+            writer.writeheader()
+            writer.writerow(self.row('one@example.com', gender='F'))
+            writer.writerow(self.row('not-an-email'))
+            writer.writerow(self.row('two@example.com', gender=''))
+
+        output = StringIO()
+        call_command('import_users', path, '--chunk-size', '2', stdout=output)
+
+        self.assertIn('Row 2: {"email"', output.getvalue())
+        self.assertIn('Created 2 users, 1 rows failed.', output.getvalue())
+        self.assertEqual(User.objects.get(email='one@example.com').gender, User.FEMALE)
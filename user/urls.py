@@ -4,6 +4,7 @@ from . import views
 app_name = 'user'
 urlpatterns = [
     path('register/', views.RegisterView.as_view(), name='register'),
+    path('bulkRegister/', views.BulkRegisterView.as_view(), name='bulkRegister'),
     path('login/', views.LoginView.as_view(), name='login'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
     path('update/', views.UpdateDetailsView.as_view(), name='update'),
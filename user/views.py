@@ -1,14 +1,15 @@
 from django.shortcuts import render
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from rest_framework import generics
+from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.parsers import MultiPartParser
 
-from . import serializers
+from . import passwords, provisioning, serializers
 
 User = get_user_model()
 
@@ -29,6 +30,39 @@ class RegisterView(generics.CreateAPIView):
         return Response({'message': 'Registration successful'})
     
 
+class BulkRegisterView(APIView):
+
+    '''
+        View for admins to register many users at once
+    '''
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        users = request.data.get('users') if isinstance(request.data, dict) else request.data
+
+        if not isinstance(users, list) or not users:
+            return Response({'message': 'Send the users to register as a list'}, status=status.HTTP_400_BAD_REQUEST)
+        elif len(users) > settings.BULK_REGISTER_MAX_USERS:
+            return Response(
+                {'message': f'At most {settings.BULK_REGISTER_MAX_USERS} users can be registered at once, import more with manage.py import_users'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # rows with errors are reported, the others are still registered
+        created, errors = provisioning.provision_users(
+            users,
+            chunk_size=settings.USER_IMPORT_CHUNK_SIZE,
+            workers=1,
+            hash_password=passwords.hash_password
+        )
+
+        return Response(
+            {'created': created, 'errors': errors},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
+
+
 class LoginView(APIView):
 
     '''
@@ -36,7 +70,7 @@ class LoginView(APIView):
     '''
 
     def post(self, request):
-        serializer = serializers.LoginSerializer(data=request.data)
+        serializer = serializers.LoginSerializer(data=request.data, context={'request': request})
 
         serializer.is_valid(raise_exception=True)
 
@@ -76,9 +110,9 @@ class UpdateDetailsView(generics.RetrieveUpdateAPIView):
         current_user = self.request.user
         return User.objects.filter(pk=current_user.pk)
     
-    # get current user object
+    # get current user object, with all its fields
     def get_object(self):
-        return self.request.user
+        return self.get_queryset().get()
     
 
 class ChangePasswordView(generics.RetrieveUpdateAPIView):
@@ -94,7 +128,7 @@ class ChangePasswordView(generics.RetrieveUpdateAPIView):
         return User.objects.filter(pk=current_user.pk)
 
     def get_object(self):
-        return self.request.user
+        return self.get_queryset().get()
     
     def update(self, request, *args, **kwargs):
         super().update(request, *args, **kwargs)